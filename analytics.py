@@ -0,0 +1,152 @@
+import logging
+import threading
+import time
+
+from sqlalchemy import text
+
+from counters import CounterBuffer
+
+logger = logging.getLogger(__name__)
+
+# Bucket widths in seconds; also stored as click_buckets.resolution
+MINUTE = 60
+HOUR = 3600
+DAY = 86400
+
+GRANULARITIES = {'minute': MINUTE, 'hour': HOUR, 'day': DAY}
+
+UPSERT_BUCKET = text(
+    'INSERT INTO click_buckets (short_code, resolution, bucket_start, count) '
+    'VALUES (:short_code, :resolution, :bucket_start, :count) '
+    'ON CONFLICT (short_code, resolution, bucket_start) '
+    'DO UPDATE SET count = count + excluded.count'
+)
+
+ROLLUP_BUCKETS = text(
+    'INSERT INTO click_buckets (short_code, resolution, bucket_start, count) '
+    'SELECT short_code, :coarser, bucket_start - bucket_start % :coarser AS rolled, SUM(count) '
+    'FROM click_buckets WHERE resolution = :finer AND bucket_start < :cutoff '
+    'GROUP BY short_code, rolled '
+    'ON CONFLICT (short_code, resolution, bucket_start) '
+    'DO UPDATE SET count = count + excluded.count'
+)
+
+DELETE_BUCKETS = text(
+    'DELETE FROM click_buckets WHERE resolution = :resolution AND bucket_start < :cutoff'
+)
+
+
+def bucket_start(timestamp, width):
+    """Align an epoch timestamp to the start of its bucket"""
+    timestamp = int(timestamp)
+    return timestamp - timestamp % width
+
+
+class ClickAnalytics:
+    """Per-minute click buckets with hourly and daily rollups
+
+    Clicks are counted in memory per (short_code, minute) and upserted into
+    ``click_buckets`` by a write-behind buffer. Minute buckets older than
+    their retention are folded into hour buckets, hours into days, and days
+    past their retention are dropped. Buckets live on the shard of their
+    short code; ``shards`` is a ``shards.ShardSet``.
+    """
+
+    def __init__(self, shards, flush_interval=10.0, flush_size=5000,
+                 minute_retention=2 * DAY, hour_retention=90 * DAY, day_retention=730 * DAY,
+                 rollup_interval=300):
+        self.shards = shards
+        self.retention = {MINUTE: minute_retention, HOUR: hour_retention, DAY: day_retention}
+        self.rollup_interval = rollup_interval
+        self.buffer = CounterBuffer(self._write, flush_interval, flush_size)
+        self._rollup_lock = threading.Lock()
+        self._last_rollup = time.monotonic()
+
+    def record(self, short_code, timestamp=None):
+        """Count one click for short_code"""
+        if timestamp is None:
+            timestamp = time.time()
+        self.buffer.increment((short_code, bucket_start(timestamp, MINUTE)))
+
+    def flush(self):
+        """Write pending minute buckets now"""
+        return self.buffer.flush()
+
+    def stop(self):
+        """Stop the background flusher, writing whatever is pending"""
+        self.buffer.stop()
+
+    def _write(self, items):
+        unwritten = []
+        for shard, group in self.shards.group(items, key=lambda item: item[0][0]).items():
+            try:
+                with self.shards.begin(shard) as conn:
+                    conn.execute(UPSERT_BUCKET, [
+                        {'short_code': code, 'resolution': MINUTE, 'bucket_start': start, 'count': count}
+                        for (code, start), count in group
+                    ])
+            except Exception:
+                logger.exception('Failed to write %d click buckets to shard %d', len(group), shard)
+                unwritten.extend(group)
+
+        if time.monotonic() - self._last_rollup >= self.rollup_interval:
+            self.rollup()
+        return unwritten
+
+    def rollup(self, now=None):
+        """Fold expired fine buckets into coarser ones and drop expired days"""
+        if now is None:
+            now = time.time()
+
+        with self._rollup_lock:
+            for shard in range(len(self.shards)):
+                for finer, coarser in ((MINUTE, HOUR), (HOUR, DAY)):
+                    # Only fold whole coarse buckets so a bucket is never split
+                    cutoff = bucket_start(now - self.retention[finer], coarser)
+                    with self.shards.begin(shard) as conn:
+                        conn.execute(ROLLUP_BUCKETS, {'finer': finer, 'coarser': coarser, 'cutoff': cutoff})
+                        conn.execute(DELETE_BUCKETS, {'resolution': finer, 'cutoff': cutoff})
+
+                with self.shards.begin(shard) as conn:
+                    conn.execute(DELETE_BUCKETS, {'resolution': DAY,
+                                                  'cutoff': bucket_start(now - self.retention[DAY], DAY)})
+            self._last_rollup = time.monotonic()
+
+    def series(self, short_code, start, end, width):
+        """Return [(bucket_start, count)] for short_code in [start, end)
+
+        Buckets at the requested width or finer are summed, so recent minute
+        data and older rolled-up hours line up in the same series. Each
+        resolution is an index range scan on (short_code, resolution,
+        bucket_start). Minutes still in the write-behind buffer are added in,
+        so a click shows up before it is flushed.
+        """
+        resolutions = [r for r in (MINUTE, HOUR, DAY) if r <= width]
+        start = bucket_start(start, width)
+        params = {'short_code': short_code, 'width': width, 'start': start, 'end': end}
+        placeholders = []
+        for index, resolution in enumerate(resolutions):
+            params[f'r{index}'] = resolution
+            placeholders.append(f':r{index}')
+
+        query = text(
+            'SELECT bucket_start - bucket_start % :width AS bucket, SUM(count) '
+            'FROM click_buckets WHERE short_code = :short_code '
+            f'AND resolution IN ({", ".join(placeholders)}) '
+            'AND bucket_start >= :start AND bucket_start < :end '
+            'GROUP BY bucket ORDER BY bucket'
+        )
+        with self.shards.begin(self.shards.shard_for(short_code)) as conn:
+            counts = {row[0]: row[1] for row in conn.execute(query, params)}
+
+        pending = self.buffer.pending_items(
+            lambda key: key[0] == short_code and start <= key[1] < end)
+        for (_, minute), count in pending:
+            bucket = bucket_start(minute, width)
+            counts[bucket] = counts.get(bucket, 0) + count
+        return sorted(counts.items())
+
+    def delete(self, conn, short_code):
+        """Drop every bucket of short_code using the given connection"""
+        conn.execute(text('DELETE FROM click_buckets WHERE short_code = :short_code'),
+                     {'short_code': short_code})
@@ -1,553 +1,560 @@
-from flask import Flask, request, jsonify, redirect, render_template
-from flask_sqlalchemy import SQLAlchemy
+from flask import Flask, g
+import click
+from contextlib import nullcontext
 from datetime import datetime, timezone
-import string
-import random
-import validators
+import atexit
+from functools import partial
+import gzip
+import logging
 import os
+import sys
+import threading
+import time
 
-app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///url_shortener.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-# Initialize SQLAlchemy
-db = SQLAlchemy(app)
-
-# Model definition
-class ShortURL(db.Model):
-    __tablename__ = 'short_urls'
-    
-    id = db.Column(db.Integer, primary_key=True)
-    original_url = db.Column(db.String(2048), nullable=False)
-    short_code = db.Column(db.String(10), unique=True, nullable=False)
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
-    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), 
-                          onupdate=lambda: datetime.now(timezone.utc))
-    access_count = db.Column(db.Integer, default=0)
-    
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'url': self.original_url,
-            'shortCode': self.short_code,
-            'createdAt': self.created_at.isoformat(),
-            'updatedAt': self.updated_at.isoformat(),
-            'accessCount': self.access_count
-        }
-    
-    def __repr__(self):
-        return f'<ShortURL {self.short_code} -> {self.original_url}>'
-
-# Utility functions
-def generate_short_code(length=6):
-    """Generate a random short code"""
-    characters = string.ascii_letters + string.digits
-    return ''.join(random.choice(characters) for _ in range(length))
-
-def validate_url(url):
-    """Validate URL format"""
-    if not url:
-        return False, "URL is required"
-    
-    if not validators.url(url):
-        return False, "Invalid URL format"
-    
-    return True, ""
-
-# Create database tables
-with app.app_context():
-    db.create_all()
-
-# API Routes
-@app.route('/shorten', methods=['POST'])
-def create_short_url():
-    """Create a new short URL"""
-    data = request.get_json()
-    
-    if not data or 'url' not in data:
-        return jsonify({'error': 'URL is required'}), 400
-    
-    url = data['url']
-    
-    # Validate URL
-    is_valid, error_message = validate_url(url)
-    if not is_valid:
-        return jsonify({'error': error_message}), 400
-    
-    # Generate unique short code
-    short_code = generate_short_code()
-    while ShortURL.query.filter_by(short_code=short_code).first():
-        short_code = generate_short_code()
-    
-    # Create new short URL
-    new_url = ShortURL(original_url=url, short_code=short_code)
-    db.session.add(new_url)
-    db.session.commit()
-    
-    return jsonify(new_url.to_dict()), 201
-
-@app.route('/shorten/<short_code>', methods=['GET'])
-def get_short_url(short_code):
-    """Retrieve original URL from short code"""
-    short_url = ShortURL.query.filter_by(short_code=short_code).first()
-    
-    if not short_url:
-        return jsonify({'error': 'Short URL not found'}), 404
-    
-    return jsonify(short_url.to_dict()), 200
-
-@app.route('/<short_code>')
-def redirect_to_original(short_code):
-    """Redirect to original URL and track access count"""
-    short_url = ShortURL.query.filter_by(short_code=short_code).first()
-    
-    if not short_url:
-        return jsonify({'error': 'Short URL not found'}), 404
-    
-    # Increment access count
-    short_url.access_count += 1
-    db.session.commit()
-    
-    return redirect(short_url.original_url)
-
-@app.route('/shorten/<short_code>', methods=['PUT'])
-def update_short_url(short_code):
-    """Update an existing short URL"""
-    short_url = ShortURL.query.filter_by(short_code=short_code).first()
-    
-    if not short_url:
-        return jsonify({'error': 'Short URL not found'}), 404
-    
-    data = request.get_json()
-    
-    if not data or 'url' not in data:
-        return jsonify({'error': 'URL is required'}), 400
-    
-    new_url = data['url']
-    
-    # Validate URL
-    is_valid, error_message = validate_url(new_url)
-    if not is_valid:
-        return jsonify({'error': error_message}), 400
-    
-    # Update URL
-    short_url.original_url = new_url
-    db.session.commit()
-    
-    return jsonify(short_url.to_dict()), 200
-
-@app.route('/shorten/<short_code>', methods=['DELETE'])
-def delete_short_url(short_code):
-    """Delete a short URL"""
-    short_url = ShortURL.query.filter_by(short_code=short_code).first()
-    
-    if not short_url:
-        return jsonify({'error': 'Short URL not found'}), 404
-    
-    db.session.delete(short_url)
-    db.session.commit()
-    
-    return '', 204
-
-@app.route('/shorten/<short_code>/stats', methods=['GET'])
-def get_url_stats(short_code):
-    """Get statistics for a short URL"""
-    short_url = ShortURL.query.filter_by(short_code=short_code).first()
-    
-    if not short_url:
-        return jsonify({'error': 'Short URL not found'}), 404
-    
-    return jsonify(short_url.to_dict()), 200
-
-@app.route('/all-urls', methods=['GET'])
-def get_all_urls():
-    """Get all short URLs (for frontend display)"""
-    urls = ShortURL.query.all()
-    return jsonify([url.to_dict() for url in urls])
-
-# Frontend Routes
-@app.route('/')
-def index():
-    """Frontend interface"""
-    return '''
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>URL Shortener</title>
-        <style>
-            * {
-                margin: 0;
-                padding: 0;
-                box-sizing: border-box;
-            }
-            body {
-                font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-                line-height: 1.6;
-                color: #333;
-                background-color: #f4f4f4;
-                padding: 20px;
-            }
-            .container {
-                max-width: 800px;
-                margin: 0 auto;
-                background: white;
-                padding: 30px;
-                border-radius: 10px;
-                box-shadow: 0 2px 10px rgba(0, 0, 0, 0.1);
-            }
-            h1 {
-                text-align: center;
-                margin-bottom: 30px;
-                color: #2c3e50;
-            }
-            .section {
-                margin-bottom: 30px;
-                padding: 20px;
-                border: 1px solid #e1e1e1;
-                border-radius: 8px;
-                background: #fafafa;
-            }
-            .section h2 {
-                margin-bottom: 15px;
-                color: #34495e;
-                font-size: 1.2em;
-            }
-            form {
-                display: flex;
-                gap: 10px;
-                margin-bottom: 15px;
-                flex-wrap: wrap;
-            }
-            input[type="url"], input[type="text"] {
-                flex: 1;
-                min-width: 200px;
-                padding: 10px;
-                border: 1px solid #ddd;
-                border-radius: 4px;
-                font-size: 14px;
-            }
-            button {
-                padding: 10px 20px;
-                background: #3498db;
-                color: white;
-                border: none;
-                border-radius: 4px;
-                cursor: pointer;
-                font-size: 14px;
-                transition: background 0.3s;
-            }
-            button:hover {
-                background: #2980b9;
-            }
-            button.danger {
-                background: #e74c3c;
-            }
-            button.danger:hover {
-                background: #c0392b;
-            }
-            .result {
-                padding: 10px;
-                margin-top: 10px;
-                border-radius: 4px;
-                font-family: monospace;
-                font-size: 14px;
-                white-space: pre-wrap;
-                word-break: break-all;
-            }
-            .success {
-                background: #d4edda;
-                border: 1px solid #c3e6cb;
-                color: #155724;
-            }
-            .error {
-                background: #f8d7da;
-                border: 1px solid #f5c6cb;
-                color: #721c24;
-            }
-            .info {
-                background: #d1ecf1;
-                border: 1px solid #bee5eb;
-                color: #0c5460;
-            }
-            .url-item {
-                padding: 10px;
-                margin: 5px 0;
-                background: white;
-                border: 1px solid #ddd;
-                border-radius: 4px;
-            }
-            .url-item:hover {
-                background: #f8f9fa;
-            }
-            @media (max-width: 600px) {
-                form {
-                    flex-direction: column;
-                }
-                input[type="url"], input[type="text"] {
-                    min-width: 100%;
-                }
-            }
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <h1>URL Shortener</h1>
-            
-            <!-- Create Short URL Form -->
-            <div class="section">
-                <h2>Create Short URL</h2>
-                <form id="createForm">
-                    <input type="url" id="originalUrl" placeholder="Enter your long URL" required>
-                    <button type="submit">Shorten URL</button>
-                </form>
-                <div id="createResult"></div>
-            </div>
-
-            <!-- Get URL Form -->
-            <div class="section">
-                <h2>Get Original URL</h2>
-                <form id="getForm">
-                    <input type="text" id="shortCodeGet" placeholder="Enter short code" required>
-                    <button type="submit">Get URL</button>
-                </form>
-                <div id="getResult"></div>
-            </div>
-
-            <!-- Update URL Form -->
-            <div class="section">
-                <h2>Update Short URL</h2>
-                <form id="updateForm">
-                    <input type="text" id="shortCodeUpdate" placeholder="Short code" required>
-                    <input type="url" id="newUrl" placeholder="New URL" required>
-                    <button type="submit">Update URL</button>
-                </form>
-                <div id="updateResult"></div>
-            </div>
-
-            <!-- Delete URL Form -->
-            <div class="section">
-                <h2>Delete Short URL</h2>
-                <form id="deleteForm">
-                    <input type="text" id="shortCodeDelete" placeholder="Enter short code" required>
-                    <button type="submit" class="danger">Delete URL</button>
-                </form>
-                <div id="deleteResult"></div>
-            </div>
-
-            <!-- Get Stats Form -->
-            <div class="section">
-                <h2>Get URL Statistics</h2>
-                <form id="statsForm">
-                    <input type="text" id="shortCodeStats" placeholder="Enter short code" required>
-                    <button type="submit">Get Stats</button>
-                </form>
-                <div id="statsResult"></div>
-            </div>
-
-            <!-- All URLs Section -->
-            <div class="section">
-                <h2>All Short URLs</h2>
-                <button onclick="loadAllURLs()">Load All URLs</button>
-                <div id="allUrls"></div>
-            </div>
-        </div>
-
-        <script>
-            const API_BASE = '';
-
-            // Create Short URL
-            document.getElementById('createForm').addEventListener('submit', async (e) => {
-                e.preventDefault();
-                const url = document.getElementById('originalUrl').value;
-                const resultDiv = document.getElementById('createResult');
-                
-                try {
-                    const response = await fetch('/shorten', {
-                        method: 'POST',
-                        headers: {
-                            'Content-Type': 'application/json',
-                        },
-                        body: JSON.stringify({ url })
-                    });
-                    
-                    const data = await response.json();
-                    
-                    if (response.ok) {
-                        resultDiv.innerHTML = `
-                            <div class="result success">
-                                <strong>Short URL created successfully!</strong><br>
-                                Short Code: ${data.shortCode}<br>
-                                Original URL: ${data.url}<br>
-                                Access your short URL: <a href="/${data.shortCode}" target="_blank">/${data.shortCode}</a>
-                            </div>
-                        `;
-                        document.getElementById('createForm').reset();
-                    } else {
-                        resultDiv.innerHTML = `<div class="result error">Error: ${data.error}</div>`;
-                    }
-                } catch (error) {
-                    resultDiv.innerHTML = `<div class="result error">Network error: ${error.message}</div>`;
-                }
-            });
-
-            // Get Original URL
-            document.getElementById('getForm').addEventListener('submit', async (e) => {
-                e.preventDefault();
-                const shortCode = document.getElementById('shortCodeGet').value;
-                const resultDiv = document.getElementById('getResult');
-                
-                try {
-                    const response = await fetch(`/shorten/${shortCode}`);
-                    const data = await response.json();
-                    
-                    if (response.ok) {
-                        resultDiv.innerHTML = `
-                            <div class="result success">
-                                <strong>URL Found!</strong><br>
-                                Short Code: ${data.shortCode}<br>
-                                Original URL: ${data.url}<br>
-                                Created: ${new Date(data.createdAt).toLocaleString()}<br>
-                                <a href="${data.url}" target="_blank">Visit URL</a>
-                            </div>
-                        `;
-                    } else {
-                        resultDiv.innerHTML = `<div class="result error">Error: ${data.error}</div>`;
-                    }
-                } catch (error) {
-                    resultDiv.innerHTML = `<div class="result error">Network error: ${error.message}</div>`;
-                }
-            });
-
-            // Update Short URL
-            document.getElementById('updateForm').addEventListener('submit', async (e) => {
-                e.preventDefault();
-                const shortCode = document.getElementById('shortCodeUpdate').value;
-                const newUrl = document.getElementById('newUrl').value;
-                const resultDiv = document.getElementById('updateResult');
-                
-                try {
-                    const response = await fetch(`/shorten/${shortCode}`, {
-                        method: 'PUT',
-                        headers: {
-                            'Content-Type': 'application/json',
-                        },
-                        body: JSON.stringify({ url: newUrl })
-                    });
-                    
-                    const data = await response.json();
-                    
-                    if (response.ok) {
-                        resultDiv.innerHTML = `
-                            <div class="result success">
-                                <strong>URL updated successfully!</strong><br>
-                                Short Code: ${data.shortCode}<br>
-                                New URL: ${data.url}<br>
-                                Updated: ${new Date(data.updatedAt).toLocaleString()}
-                            </div>
-                        `;
-                        document.getElementById('updateForm').reset();
-                    } else {
-                        resultDiv.innerHTML = `<div class="result error">Error: ${data.error}</div>`;
-                    }
-                } catch (error) {
-                    resultDiv.innerHTML = `<div class="result error">Network error: ${error.message}</div>`;
-                }
-            });
-
-            // Delete Short URL
-            document.getElementById('deleteForm').addEventListener('submit', async (e) => {
-                e.preventDefault();
-                const shortCode = document.getElementById('shortCodeDelete').value;
-                const resultDiv = document.getElementById('deleteResult');
-                
-                try {
-                    const response = await fetch(`/shorten/${shortCode}`, {
-                        method: 'DELETE'
-                    });
-                    
-                    if (response.status === 204) {
-                        resultDiv.innerHTML = `<div class="result success">Short URL "${shortCode}" deleted successfully!</div>`;
-                        document.getElementById('deleteForm').reset();
-                    } else {
-                        const data = await response.json();
-                        resultDiv.innerHTML = `<div class="result error">Error: ${data.error}</div>`;
-                    }
-                } catch (error) {
-                    resultDiv.innerHTML = `<div class="result error">Network error: ${error.message}</div>`;
-                }
-            });
-
-            // Get URL Statistics
-            document.getElementById('statsForm').addEventListener('submit', async (e) => {
-                e.preventDefault();
-                const shortCode = document.getElementById('shortCodeStats').value;
-                const resultDiv = document.getElementById('statsResult');
-                
-                try {
-                    const response = await fetch(`/shorten/${shortCode}/stats`);
-                    const data = await response.json();
-                    
-                    if (response.ok) {
-                        resultDiv.innerHTML = `
-                            <div class="result success">
-                                <strong>Statistics for ${data.shortCode}</strong><br>
-                                Original URL: ${data.url}<br>
-                                Access Count: ${data.accessCount}<br>
-                                Created: ${new Date(data.createdAt).toLocaleString()}<br>
-                                Last Updated: ${new Date(data.updatedAt).toLocaleString()}
-                            </div>
-                        `;
-                    } else {
-                        resultDiv.innerHTML = `<div class="result error">Error: ${data.error}</div>`;
-                    }
-                } catch (error) {
-                    resultDiv.innerHTML = `<div class="result error">Network error: ${error.message}</div>`;
-                }
-            });
-
-            // Load all URLs
-            async function loadAllURLs() {
-                const resultDiv = document.getElementById('allUrls');
-                resultDiv.innerHTML = '<div class="result info">Loading...</div>';
-                
-                try {
-                    const response = await fetch('/all-urls');
-                    const data = await response.json();
-                    
-                    if (response.ok) {
-                        if (data.length === 0) {
-                            resultDiv.innerHTML = '<div class="result info">No URLs found. Create your first short URL!</div>';
-                            return;
-                        }
-                        
-                        let html = '<div class="result success">';
-                        data.forEach(url => {
-                            html += `
-                                <div class="url-item">
-                                    <strong>${url.shortCode}</strong><br>
-                                    Original: ${url.url}<br>
-                                    Access Count: ${url.accessCount}<br>
-                                    Created: ${new Date(url.createdAt).toLocaleString()}<br>
-                                    <a href="/${url.shortCode}" target="_blank">Visit</a> | 
-                                    <a href="/shorten/${url.shortCode}/stats" target="_blank">Stats</a>
-                                </div>
-                            `;
-                        });
-                        html += '</div>';
-                        resultDiv.innerHTML = html;
-                    } else {
-                        resultDiv.innerHTML = `<div class="result error">Error: ${data.error}</div>`;
-                    }
-                } catch (error) {
-                    resultDiv.innerHTML = `<div class="result error">Error: ${error.message}</div>`;
-                }
-            }
-        </script>
-    </body>
-    </html>
-    '''
+from sqlalchemy import delete, insert, text
+from sqlalchemy.orm import Session
+
+from analytics import DAY, ClickAnalytics
+from cache import LRUCache
+from codegen import IdBlockAllocator, make_code_generator
+from counters import CounterBuffer
+from expiry import ExpirySweeper
+from models import ClickBucket, ClickDimension, ShortURL, ShortURLArchive, ShortURLTombstone, db, url_hash
+from shards import ROW_ID_SEQUENCE, ShardSet, shard_database_url, shard_schema, sync_row_id_sequence
+from sqlite_profile import apply_pragmas, resolve_profile
+from validation import UrlValidator
+
+logger = logging.getLogger(__name__)
+
+def env_int(name):
+    """Read an optional integer environment variable"""
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+def load_config(app):
+    """Read runtime settings from environment variables"""
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///url_shortener.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLITE_PROFILE'] = os.environ.get('SQLITE_PROFILE', 'tuned')
+    app.config['SHARD_COUNT'] = int(os.environ.get('SHARD_COUNT', 1))
+    app.config['REDIRECT_CACHE_SIZE'] = int(os.environ.get('REDIRECT_CACHE_SIZE', 10000))
+    app.config['REDIRECT_CACHE_TTL'] = float(os.environ.get('REDIRECT_CACHE_TTL', 300)) or None
+    app.config['URL_VALIDATION_CACHE_SIZE'] = int(os.environ.get('URL_VALIDATION_CACHE_SIZE', 100000))
+    app.config['ACCESS_COUNT_FLUSH_INTERVAL'] = float(os.environ.get('ACCESS_COUNT_FLUSH_INTERVAL', 5))
+    app.config['ACCESS_COUNT_FLUSH_SIZE'] = int(os.environ.get('ACCESS_COUNT_FLUSH_SIZE', 1000))
+    app.config['SHORT_CODE_STRATEGY'] = os.environ.get('SHORT_CODE_STRATEGY', 'shuffle')
+    app.config['SHORT_CODE_LENGTH'] = int(os.environ.get('SHORT_CODE_LENGTH', 6))
+    app.config['SHORT_CODE_SECRET'] = os.environ.get('SHORT_CODE_SECRET', 'url-shortener')
+    app.config['SHORT_CODE_BLOCK_SIZE'] = int(os.environ.get('SHORT_CODE_BLOCK_SIZE', 1000))
+    app.config['BATCH_MAX_URLS'] = int(os.environ.get('BATCH_MAX_URLS', 500000))
+    app.config['BATCH_CHUNK_SIZE'] = int(os.environ.get('BATCH_CHUNK_SIZE', 1000))
+    app.config['ALL_URLS_MAX_PAGE_SIZE'] = int(os.environ.get('ALL_URLS_MAX_PAGE_SIZE', 1000))
+    app.config['ALL_URLS_STREAM_BATCH'] = int(os.environ.get('ALL_URLS_STREAM_BATCH', 1000))
+    app.config['ANALYTICS_FLUSH_INTERVAL'] = float(os.environ.get('ANALYTICS_FLUSH_INTERVAL', 10))
+    app.config['ANALYTICS_MINUTE_RETENTION'] = int(os.environ.get('ANALYTICS_MINUTE_RETENTION', 2 * DAY))
+    app.config['ANALYTICS_HOUR_RETENTION'] = int(os.environ.get('ANALYTICS_HOUR_RETENTION', 90 * DAY))
+    app.config['ANALYTICS_DAY_RETENTION'] = int(os.environ.get('ANALYTICS_DAY_RETENTION', 730 * DAY))
+    app.config['CLICK_LOG_DIR'] = os.environ.get('CLICK_LOG_DIR')
+    app.config['CLICK_LOG_QUEUE_SIZE'] = int(os.environ.get('CLICK_LOG_QUEUE_SIZE', 100000))
+    app.config['CLICK_LOG_SAMPLE_THRESHOLD'] = float(os.environ.get('CLICK_LOG_SAMPLE_THRESHOLD', 0.5))
+    app.config['CLICK_LOG_SAMPLE_EVERY'] = int(os.environ.get('CLICK_LOG_SAMPLE_EVERY', 10))
+    app.config['CLICK_LOG_FLUSH_INTERVAL'] = float(os.environ.get('CLICK_LOG_FLUSH_INTERVAL', 1))
+    app.config['CLICK_LOG_SEGMENT_BYTES'] = int(os.environ.get('CLICK_LOG_SEGMENT_BYTES', 64 << 20))
+    app.config['CLICK_LOG_SEGMENT_SECONDS'] = float(os.environ.get('CLICK_LOG_SEGMENT_SECONDS', 300))
+    app.config['CLICK_LOG_COMPACT_INTERVAL'] = float(os.environ.get('CLICK_LOG_COMPACT_INTERVAL', 60))
+    app.config['GEOIP_TABLE_PATH'] = os.environ.get('GEOIP_TABLE_PATH')
+    app.config['REDIRECT_SNAPSHOT_PATH'] = os.environ.get('REDIRECT_SNAPSHOT_PATH')
+    app.config['REDIRECT_SNAPSHOT_CHECK_INTERVAL'] = float(os.environ.get('REDIRECT_SNAPSHOT_CHECK_INTERVAL', 5))
+    app.config['PERMANENT_REDIRECT_STATUS'] = int(os.environ.get('PERMANENT_REDIRECT_STATUS', 301))
+    app.config['PERMANENT_REDIRECT_MAX_AGE'] = int(os.environ.get('PERMANENT_REDIRECT_MAX_AGE', 86400))
+    app.config['EXPIRY_SWEEP_INTERVAL'] = float(os.environ.get('EXPIRY_SWEEP_INTERVAL', 60))
+    app.config['EXPIRY_SWEEP_BATCH'] = int(os.environ.get('EXPIRY_SWEEP_BATCH', 500))
+    app.config['EXPIRY_ARCHIVE'] = os.environ.get('EXPIRY_ARCHIVE', '').lower() in ('1', 'true', 'yes')
+    app.config['DEDUP_URLS'] = os.environ.get('DEDUP_URLS', '').lower() in ('1', 'true', 'yes')
+    app.config['DEDUP_BLOOM_CAPACITY'] = int(os.environ.get('DEDUP_BLOOM_CAPACITY', 10_000_000))
+    app.config['DEDUP_BLOOM_ERROR_RATE'] = float(os.environ.get('DEDUP_BLOOM_ERROR_RATE', 0.01))
+    app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '1').lower() in ('1', 'true', 'yes')
+    app.config['PROFILER_ALLOWED'] = os.environ.get('PROFILER_ALLOWED', '').lower() in ('1', 'true', 'yes')
+    app.config['TOP_LINKS_CAPACITY'] = int(os.environ.get('TOP_LINKS_CAPACITY', 1000))
+    app.config['TOP_LINKS_RECONCILE_INTERVAL'] = float(os.environ.get('TOP_LINKS_RECONCILE_INTERVAL', 60))
+    app.config['RATE_LIMIT_ENABLED'] = os.environ.get('RATE_LIMIT_ENABLED', '').lower() in ('1', 'true', 'yes')
+    app.config['RATE_LIMIT_CREATE_RATE'] = float(os.environ.get('RATE_LIMIT_CREATE_RATE', 1))
+    app.config['RATE_LIMIT_CREATE_BURST'] = int(os.environ.get('RATE_LIMIT_CREATE_BURST', 20))
+    app.config['RATE_LIMIT_REDIRECT_RATE'] = float(os.environ.get('RATE_LIMIT_REDIRECT_RATE', 50))
+    app.config['RATE_LIMIT_REDIRECT_BURST'] = int(os.environ.get('RATE_LIMIT_REDIRECT_BURST', 200))
+    app.config['RATE_LIMIT_BATCH_RATE'] = float(os.environ.get('RATE_LIMIT_BATCH_RATE', 100))
+    app.config['RATE_LIMIT_BATCH_BURST'] = int(os.environ.get('RATE_LIMIT_BATCH_BURST', 10000))
+    app.config['RATE_LIMIT_KEY_HEADER'] = os.environ.get('RATE_LIMIT_KEY_HEADER', 'X-API-Key')
+    app.config['RATE_LIMIT_API_KEYS'] = frozenset(key.strip() for key in os.environ.get('RATE_LIMIT_API_KEYS', '').split(',')
+                                                  if key.strip())
+    app.config['RATE_LIMIT_MAX_KEYS'] = int(os.environ.get('RATE_LIMIT_MAX_KEYS', 100000))
+    app.config['RATE_LIMIT_STORE_PATH'] = os.environ.get('RATE_LIMIT_STORE_PATH')
+    app.config['BULK_TRANSFER_ALLOWED'] = os.environ.get('BULK_TRANSFER_ALLOWED', '').lower() in ('1', 'true', 'yes')
+    app.config['BULK_TRANSFER_BATCH'] = int(os.environ.get('BULK_TRANSFER_BATCH', 1000))
+
+    # Storage profile: connection PRAGMAs and pool sizing applied at engine creation
+    pragmas, pool_options = resolve_profile(app.config['SQLITE_PROFILE'], {
+        'synchronous': os.environ.get('SQLITE_SYNCHRONOUS'),
+        'mmap_size': env_int('SQLITE_MMAP_SIZE'),
+        'cache_size': env_int('SQLITE_CACHE_SIZE'),
+        'busy_timeout': env_int('SQLITE_BUSY_TIMEOUT'),
+        'pool_size': env_int('DB_POOL_SIZE'),
+        'max_overflow': env_int('DB_MAX_OVERFLOW'),
+    })
+    app.config['SQLITE_PRAGMAS'] = pragmas
+
+    # Shards 1..N-1 are binds stored next to the primary database (see shards.py)
+    app.config['SQLALCHEMY_BINDS'] = {
+        f'shard{shard}': shard_database_url(app.config['SQLALCHEMY_DATABASE_URI'], shard)
+        for shard in range(1, app.config['SHARD_COUNT'])
+    }
+    if ':memory:' not in app.config['SQLALCHEMY_DATABASE_URI']:
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = pool_options
+
+class Shortener:
+    """Per-application caches, buffers and generators used by the routes
+
+    Stored as ``app.extensions['shortener']``. Optional components are
+    ``None`` when disabled, and their modules are only imported when enabled.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        config = app.config
+
+        # Storage: short codes are routed to one of SHARD_COUNT databases
+        with app.app_context():
+            self.shards = ShardSet([db.engine] + [db.engines[f'shard{shard}']
+                                                  for shard in range(1, config['SHARD_COUNT'])])
+
+        # With several shards, row IDs come from a global sequence so they stay unique
+        self.row_ids = None
+        if len(self.shards) > 1:
+            self.row_ids = IdBlockAllocator(partial(self.reserve_id_block, name=ROW_ID_SEQUENCE),
+                                            config['SHORT_CODE_BLOCK_SIZE'])
+
+        # Short code -> (original URL, permanent, expires) cache for the redirect hot path
+        self.redirect_cache = LRUCache(maxsize=config['REDIRECT_CACHE_SIZE'], ttl=config['REDIRECT_CACHE_TTL'])
+
+        # Fast-path URL validation with memoized verdicts
+        self.url_validator = UrlValidator(cache_size=config['URL_VALIDATION_CACHE_SIZE'])
+
+        # Optional memory-mapped snapshot shared by every worker on the host
+        self.redirect_snapshot = None
+        if config['REDIRECT_SNAPSHOT_PATH']:
+            from snapshot import SnapshotReader
+            self.redirect_snapshot = SnapshotReader(config['REDIRECT_SNAPSHOT_PATH'],
+                                                    check_interval=config['REDIRECT_SNAPSHOT_CHECK_INTERVAL'],
+                                                    shards=self.shards, short_urls=ShortURL.__table__,
+                                                    tombstones=ShortURLTombstone.__table__)
+
+        # Short code generator; block-allocated strategies need no per-create query
+        self.code_generator = make_code_generator(config['SHORT_CODE_STRATEGY'],
+                                                  reserve_block=self.reserve_id_block,
+                                                  length=config['SHORT_CODE_LENGTH'],
+                                                  secret=config['SHORT_CODE_SECRET'],
+                                                  block_size=config['SHORT_CODE_BLOCK_SIZE'])
+
+        # Write-behind buffer for redirect access counts
+        self.access_counts = CounterBuffer(self.write_access_counts,
+                                           flush_interval=config['ACCESS_COUNT_FLUSH_INTERVAL'],
+                                           flush_size=config['ACCESS_COUNT_FLUSH_SIZE'])
+
+        # Per-minute click buckets rolled up into hours and days
+        self.click_analytics = ClickAnalytics(self.shards,
+                                              flush_interval=config['ANALYTICS_FLUSH_INTERVAL'],
+                                              minute_retention=config['ANALYTICS_MINUTE_RETENTION'],
+                                              hour_retention=config['ANALYTICS_HOUR_RETENTION'],
+                                              day_retention=config['ANALYTICS_DAY_RETENTION'])
+
+        # Batched removal of links past their expires_at
+        self.expiry_sweeper = ExpirySweeper(self.shards, ShortURL.__table__, ShortURLTombstone.__table__,
+                                            (ClickBucket.__table__, ClickDimension.__table__),
+                                            archive=ShortURLArchive.__table__ if config['EXPIRY_ARCHIVE'] else None,
+                                            interval=config['EXPIRY_SWEEP_INTERVAL'],
+                                            batch_size=config['EXPIRY_SWEEP_BATCH'])
+
+        # Optional per-click metadata log, compacted into click_dimensions
+        self.click_log = None
+        if config['CLICK_LOG_DIR']:
+            from clicklog import ClickLog
+            geoip = None
+            if config['GEOIP_TABLE_PATH']:
+                from geoip import GeoIPTable
+                geoip = GeoIPTable.load(config['GEOIP_TABLE_PATH'])
+            self.click_log = ClickLog(config['CLICK_LOG_DIR'], self.shards, geoip=geoip,
+                                      capacity=config['CLICK_LOG_QUEUE_SIZE'],
+                                      sample_threshold=config['CLICK_LOG_SAMPLE_THRESHOLD'],
+                                      sample_every=config['CLICK_LOG_SAMPLE_EVERY'],
+                                      flush_interval=config['CLICK_LOG_FLUSH_INTERVAL'],
+                                      segment_bytes=config['CLICK_LOG_SEGMENT_BYTES'],
+                                      segment_seconds=config['CLICK_LOG_SEGMENT_SECONDS'],
+                                      compact_interval=config['CLICK_LOG_COMPACT_INTERVAL'],
+                                      retention=config['ANALYTICS_DAY_RETENTION'])
+
+        # Most-clicked links per window, reconciled against the database
+        self.leaderboard = None
+        if config['TOP_LINKS_CAPACITY'] > 0:
+            from leaderboard import Leaderboard
+            self.leaderboard = Leaderboard(self.shards, (self.access_counts, self.click_analytics.buffer),
+                                           capacity=config['TOP_LINKS_CAPACITY'],
+                                           reconcile_interval=config['TOP_LINKS_RECONCILE_INTERVAL'])
+
+        # Opt-in per-client token buckets for creates and redirects
+        self.rate_limiter = None
+        if config['RATE_LIMIT_ENABLED']:
+            from ratelimit import MemoryBucketStore, RateLimiter, SQLiteBucketStore
+            if config['RATE_LIMIT_STORE_PATH']:
+                store = SQLiteBucketStore(config['RATE_LIMIT_STORE_PATH'])
+            else:
+                store = MemoryBucketStore(max_keys=config['RATE_LIMIT_MAX_KEYS'])
+            self.rate_limiter = RateLimiter({
+                'create': (config['RATE_LIMIT_CREATE_RATE'], config['RATE_LIMIT_CREATE_BURST']),
+                'redirect': (config['RATE_LIMIT_REDIRECT_RATE'], config['RATE_LIMIT_REDIRECT_BURST']),
+                # Charged one token per submitted URL
+                'batch': (config['RATE_LIMIT_BATCH_RATE'], config['RATE_LIMIT_BATCH_BURST']),
+            }, store, api_keys=config['RATE_LIMIT_API_KEYS'])
+
+        # Opt-in reuse of existing short URLs for identical destinations
+        self.url_deduplicator = None
+        if config['DEDUP_URLS']:
+            from dedup import UrlDeduplicator
+            self.url_deduplicator = UrlDeduplicator(ShortURL,
+                                                    capacity=config['DEDUP_BLOOM_CAPACITY'],
+                                                    error_rate=config['DEDUP_BLOOM_ERROR_RATE'])
+
+        # Request, SQL and cache instrumentation exposed on /metrics
+        self.metrics_registry = None
+        self.request_profiler = None
+
+        # Background work starts with the first request, never in CLI commands
+        self.started = False
+        self._start_lock = threading.Lock()
+
+    def validate_url(self, url):
+        """Validate URL format"""
+        return self.url_validator.validate(url)
+
+    def session(self, shard):
+        """ORM session on a shard, scoped to the app context like db.session"""
+        if shard == 0:
+            return db.session
+        sessions = g.setdefault('shard_sessions', {})
+        if shard not in sessions:
+            sessions[shard] = Session(self.shards.engines[shard])
+        return sessions[shard]
+
+    def session_for(self, short_code):
+        """ORM session on the shard owning short_code"""
+        return self.session(self.shards.shard_for(short_code))
+
+    def sessions(self):
+        """ORM sessions on every shard, in shard order"""
+        return [self.session(shard) for shard in range(len(self.shards))]
+
+    def close_sessions(self, exc=None):
+        """Close the shard sessions of the ending app context"""
+        for session in g.pop('shard_sessions', {}).values():
+            session.close()
+
+    def next_row_id(self):
+        """Explicit id for a new short URL, or None to let the database assign it"""
+        return self.row_ids.next_id() if self.row_ids is not None else None
+
+    def next_row_ids(self, count):
+        return self.row_ids.next_ids(count) if self.row_ids is not None else [None] * count
+
+    def find_duplicate(self, url, redirect_policy):
+        """Stored short URL for an identical destination and policy, using short-lived sessions"""
+        sessions = [Session(engine) for engine in self.shards.engines]
+        try:
+            return self.url_deduplicator.find(sessions, url, redirect_policy)
+        finally:
+            for session in sessions:
+                session.close()
+
+    def write_access_counts(self, items):
+        """Persist buffered access counts in one transaction per shard
+
+        Returns the items of shards that could not be written, for a retry.
+        """
+        failed = []
+        for shard, group in self.shards.group(items).items():
+            try:
+                with self.shards.begin(shard) as conn:
+                    conn.execute(
+                        text('UPDATE short_urls SET access_count = access_count + :amount '
+                             'WHERE short_code = :short_code'),
+                        [{'short_code': code, 'amount': amount} for code, amount in group])
+            except Exception:
+                logger.exception('Failed to write %d access counts to shard %d', len(group), shard)
+                failed.extend(group)
+        return failed
+
+    def reserve_id_block(self, size, name='short_code'):
+        """Atomically reserve size consecutive IDs and return the first one"""
+        with self.app.app_context():
+            with db.engine.begin() as conn:
+                conn.execute(text('INSERT OR IGNORE INTO code_sequences (name, next_value) '
+                                  'VALUES (:name, 0)'), {'name': name})
+                conn.execute(text('UPDATE code_sequences SET next_value = next_value + :size '
+                                  'WHERE name = :name'), {'name': name, 'size': size})
+                end = conn.execute(text('SELECT next_value FROM code_sequences WHERE name = :name'),
+                                   {'name': name}).scalar()
+        return end - size
+
+    def purge_short_code(self, session, short_code):
+        """Remove data tied to a deleted short code and leave a tombstone for snapshot builds"""
+        self.click_analytics.delete(session, short_code)
+        session.execute(delete(ClickDimension).where(ClickDimension.short_code == short_code))
+        session.execute(insert(ShortURLTombstone).prefix_with('OR REPLACE'),
+                        {'short_code': short_code, 'deleted_at': datetime.now(timezone.utc)})
+
+    def forget_cached(self, short_code):
+        """Drop process-local redirect state for a changed or deleted short code"""
+        self.redirect_cache.invalidate(short_code)
+        if self.redirect_snapshot is not None:
+            self.redirect_snapshot.mask(short_code)
+
+    def with_pending_count(self, short_url):
+        """Serialize a short URL including access counts not yet flushed"""
+        data = short_url.to_dict()
+        data['accessCount'] = (data['accessCount'] or 0) + self.access_counts.pending(short_url.short_code)
+        return data
+
+    def redirect_headers(self, permanent, expires=None):
+        """Status code and Cache-Control header for a redirect under the link's policy"""
+        if permanent:
+            max_age = self.app.config['PERMANENT_REDIRECT_MAX_AGE']
+            # Clients must not keep following a link after it expires
+            if expires is not None:
+                max_age = max(0, min(max_age, int(expires - time.time())))
+            return self.app.config['PERMANENT_REDIRECT_STATUS'], f'public, max-age={max_age}'
+        # Tracked links must reach us on every click to be counted
+        return 302, 'no-store'
+
+    def start(self):
+        """Start background work that needs the database, once; called when serving"""
+        if self.started:
+            return
+        with self._start_lock:
+            if self.started:
+                return
+            self.started = True
+            if self.app.config['EXPIRY_SWEEP_INTERVAL'] > 0:
+                self.expiry_sweeper.start()
+            if self.click_log is not None:
+                self.click_log.start()
+            if self.leaderboard is not None:
+                self.leaderboard.start()
+            if self.url_deduplicator is not None:
+                self.url_deduplicator.load([partial(Session, engine) for engine in self.shards.engines])
+            atexit.register(self.stop)
+
+    def stop(self):
+        """Stop background work and flush buffered counters; registered with atexit by start()"""
+        self.expiry_sweeper.stop()
+        if self.leaderboard is not None:
+            self.leaderboard.stop()
+        self.access_counts.stop()
+        self.click_analytics.stop()
+        if self.click_log is not None:
+            self.click_log.stop()
+
+    def instrument(self):
+        """Record request/SQL metrics and expose component counters"""
+        from metrics import MetricsRegistry, SamplingProfiler, instrument
+
+        self.metrics_registry = registry = MetricsRegistry()
+        self.request_profiler = SamplingProfiler()
+        with self.app.app_context():
+            instrument(self.app, self.shards.engines, registry, self.request_profiler)
+
+        redirect_cache = self.redirect_cache
+        url_validator = self.url_validator
+        redirect_snapshot = self.redirect_snapshot
+        url_deduplicator = self.url_deduplicator
+
+        def cache_ratio():
+            stats = redirect_cache.stats()
+            lookups = stats['hits'] + stats['misses']
+            return stats['hits'] / lookups if lookups else None
+
+        registry.counter_callback('redirect_cache_lookups_total', 'Redirect cache lookups by result',
+                                  lambda: {('hit',): redirect_cache.hits, ('miss',): redirect_cache.misses},
+                                  ('result',))
+        registry.counter_callback('redirect_cache_evictions_total', 'Redirect cache LRU evictions',
+                                  lambda: redirect_cache.evictions)
+        registry.gauge('redirect_cache_entries', 'Entries in the redirect cache', lambda: len(redirect_cache))
+        registry.gauge('redirect_cache_hit_ratio', 'Redirect cache hits / lookups', cache_ratio)
+        registry.counter_callback('url_validations_total', 'Uncached URL validations by path',
+                                  lambda: {('fast',): url_validator.fast_accepts, ('full',): url_validator.full_checks},
+                                  ('path',))
+
+        buffers = {'access_counts': self.access_counts, 'click_buckets': self.click_analytics.buffer}
+        registry.gauge('counter_buffer_pending', 'Buffered increments not yet written',
+                       lambda: {(name,): buffer.stats()['pendingIncrements'] for name, buffer in buffers.items()},
+                       ('buffer',))
+        registry.counter_callback('counter_buffer_flushes_total', 'Batched counter flushes',
+                                  lambda: {(name,): buffer.flushes for name, buffer in buffers.items()},
+                                  ('buffer',))
+        registry.counter_callback('counter_buffer_flush_seconds_total', 'Time spent writing counter batches',
+                                  lambda: {(name,): buffer.flush_seconds for name, buffer in buffers.items()},
+                                  ('buffer',))
+
+        expiry_sweeper = self.expiry_sweeper
+        registry.counter_callback('expiry_sweep_removed_total', 'Expired short URLs removed by the sweeper',
+                                  lambda: expiry_sweeper.removed)
+        registry.counter_callback('expiry_sweep_seconds_total', 'Time spent sweeping expired short URLs',
+                                  lambda: expiry_sweeper.sweep_seconds)
+
+        click_log = self.click_log
+        if click_log is not None:
+            registry.counter_callback('click_log_events_total', 'Click events by outcome at the queue',
+                                      lambda: {('queued',): click_log.enqueued, ('sampled_out',): click_log.sampled_out,
+                                               ('dropped',): click_log.dropped},
+                                      ('outcome',))
+            registry.gauge('click_log_queue_depth', 'Click events waiting to be written', click_log.pending)
+            registry.counter_callback('click_log_compacted_records_total', 'Click events folded into click_dimensions',
+                                      lambda: click_log.compacted_records)
+            registry.counter_callback('click_log_compact_seconds_total', 'Time spent compacting the click log',
+                                      lambda: click_log.compact_seconds)
+
+        rate_limiter = self.rate_limiter
+        if rate_limiter is not None:
+            registry.counter_callback('rate_limit_decisions_total', 'Rate limited requests by limit and result',
+                                      lambda: {**{(name, 'allowed'): count for name, count in rate_limiter.allowed.items()},
+                                               **{(name, 'rejected'): count for name, count in rate_limiter.rejected.items()}},
+                                      ('limit', 'result'))
+
+        leaderboard = self.leaderboard
+        if leaderboard is not None:
+            registry.counter_callback('top_links_reconcile_seconds_total', 'Time spent reconciling the top links',
+                                      lambda: leaderboard.reconcile_seconds)
+
+        if redirect_snapshot is not None:
+            registry.counter_callback('redirect_snapshot_lookups_total', 'Snapshot lookups by result',
+                                      lambda: {('hit',): redirect_snapshot.hits, ('miss',): redirect_snapshot.misses},
+                                      ('result',))
+        if url_deduplicator is not None:
+            registry.counter_callback('dedup_bloom_skips_total', 'New URLs answered by the Bloom filter alone',
+                                      lambda: url_deduplicator.bloom_skips)
+            registry.counter_callback('dedup_index_lookups_total', 'Dedup lookups that reached the url_hash index',
+                                      lambda: url_deduplicator.index_lookups)
+
+def init_database(app):
+    """Create missing tables and search indexes, apply additive migrations and backfill derived columns
+
+    Run once per deployment (``flask --app app init-db`` or ``python init.py``)
+    rather than on every worker start. Returns the (table, column) pairs added.
+    """
+    from migrations import backfill_column, upgrade_schema
+    from search import install_search_index, url_host
+
+    shards = app.extensions['shortener'].shards
+    with app.app_context():
+        db.create_all()
+        for engine in shards.engines[1:]:
+            db.metadata.create_all(engine, tables=shard_schema(db.metadata))
+
+        added = []
+        for engine in shards.engines:
+            added.extend(upgrade_schema(engine, db.metadata))
+            with engine.connect() as conn:
+                backfill_column(conn, ShortURL.__table__, 'url_hash', url_hash)
+                backfill_column(conn, ShortURL.__table__, 'host', url_host)
+            install_search_index(engine)
+        if len(shards) > 1:
+            sync_row_id_sequence(shards.engines, ShortURL.__table__)
+    return added
+
+def open_transfer_file(path, mode):
+    """Text file for export/import; gzip for .gz paths and stdin/stdout for -"""
+    if path == '-':
+        return nullcontext(sys.stdout if mode == 'w' else sys.stdin)
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+def create_app():
+    """Application factory
+
+    Builds the app from environment settings without touching the database
+    schema; run ``init-db`` first on a new database. Background threads
+    start with the first request (or ``Shortener.start()``), so apps built
+    by CLI commands and scripts never run them.
+    """
+    from assets import AssetStore
+    from routes import api, frontend, ops
+
+    app = Flask(__name__, static_folder=None)
+    load_config(app)
+
+    # Initialize SQLAlchemy
+    db.init_app(app)
+    shortener = Shortener(app)
+    for engine in shortener.shards.engines:
+        apply_pragmas(engine, app.config['SQLITE_PRAGMAS'])
+    app.extensions['shortener'] = shortener
+    app.before_request(shortener.start)
+    app.teardown_appcontext(shortener.close_sessions)
+    app.extensions['assets'] = AssetStore(os.path.join(app.root_path, 'static'))
+    if app.config['METRICS_ENABLED']:
+        shortener.instrument()
+
+    app.register_blueprint(api)
+    app.register_blueprint(ops)
+    app.register_blueprint(frontend)
+
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Create or upgrade the database schema"""
+        added = init_database(app)
+        click.echo(f'Database ready ({len(added)} columns added)')
+
+    @app.cli.command('sweep-expired')
+    def sweep_expired_command():
+        """Remove expired short URLs now"""
+        removed, seconds = shortener.expiry_sweeper.sweep()
+        click.echo(f'Removed {removed} expired short URLs in {seconds:.2f}s')
+
+    @app.cli.command('export-urls')
+    @click.argument('path')
+    @click.option('--after', type=int, default=0, help='Only export rows with a larger id.')
+    def export_urls_command(path, after):
+        """Write every short URL to PATH as NDJSON (gzip if it ends in .gz, - for stdout)"""
+        from transfer import export_lines
+
+        start = time.perf_counter()
+        count = 0
+        with open_transfer_file(path, 'w') as handle:
+            for line in export_lines(shortener.shards.engines, ShortURL.__table__, after,
+                                     batch_size=app.config['BULK_TRANSFER_BATCH']):
+                handle.write(line)
+                count += 1
+        elapsed = time.perf_counter() - start
+        click.echo(f'Exported {count} short URLs in {elapsed:.2f}s ({count / elapsed if elapsed else 0:.0f} rows/s)',
+                   err=True)
+
+    @app.cli.command('import-urls')
+    @click.argument('path')
+    @click.option('--conflict', type=click.Choice(['skip', 'replace', 'fail']), default='skip',
+                  help='What to do with short codes that already exist.')
+    def import_urls_command(path, conflict):
+        """Load short URLs from an NDJSON export at PATH (gzip if it ends in .gz, - for stdin)"""
+        from transfer import import_lines
+
+        row_ids = shortener.next_row_ids if shortener.row_ids is not None else None
+        with open_transfer_file(path, 'r') as handle:
+            result = import_lines(shortener.shards, ShortURL.__table__, handle, conflict=conflict,
+                                  batch_size=app.config['BULK_TRANSFER_BATCH'], row_ids=row_ids,
+                                  url_validator=shortener.url_validator)
+        click.echo(f"Imported {result['written']} of {result['rows']} short URLs ({result['skipped']} skipped) "
+                   f"in {result['seconds']:.2f}s ({result['rowsPerSecond'] or 0} rows/s)")
+
+    return app
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    app = create_app()
+    init_database(app)
+    app.run(debug=True)
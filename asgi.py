@@ -0,0 +1,322 @@
+"""ASGI entry point serving the redirect and /shorten API on asyncio
+
+Run with any ASGI server, for example::
+
+    uvicorn asgi:application --workers 2
+
+Requests are handled on the event loop and talk to the database through
+SQLAlchemy's async engine (``aiosqlite`` for SQLite), so concurrent
+redirects wait on connections instead of holding OS threads. The
+``ShortURL`` model, redirect cache, access counter buffer, click analytics
+and short code generator are those of a Flask app built by ``create_app()``,
+with one async engine per storage shard; the remaining endpoints (stats, batch, listing, frontend) stay on the WSGI app.
+"""
+import asyncio
+import json
+import time
+from urllib.parse import unquote
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from werkzeug.http import http_date, parse_etags
+
+from app import create_app
+from models import LOOKUP_ORIGINAL_URL, ShortURL, redirect_target, url_hash
+from routes import MAX_CODE_ATTEMPTS, parse_expires_at, parse_redirect_policy, short_url_etag
+from search import url_host
+from sqlite_profile import apply_pragmas
+
+# Sync dialects and the async drivers that replace them
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+    'mysql': 'mysql+aiomysql',
+}
+
+
+def async_database_url(url):
+    """Swap the async driver into a sync engine's database URL"""
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise RuntimeError(f'No async driver configured for {backend!r}')
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+class ShortenerASGI:
+    """Minimal ASGI application for the redirect and /shorten routes"""
+
+    def __init__(self, flask_app=None):
+        self.flask_app = flask_app
+        self.shortener = None
+        self.engines = None
+        self.sessions = None
+
+    async def startup(self):
+        # The Flask app is built here rather than at import
+        if self.flask_app is None:
+            self.flask_app = create_app()
+        self.shortener = self.flask_app.extensions['shortener']
+        self.shortener.start()
+        self.engines = [create_async_engine(async_database_url(engine.url))
+                        for engine in self.shortener.shards.engines]
+        for engine in self.engines:
+            apply_pragmas(engine.sync_engine, self.flask_app.config['SQLITE_PRAGMAS'])
+        self.sessions = [async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+                         for engine in self.engines]
+
+    def session_for(self, short_code):
+        """New async session on the shard owning short_code"""
+        return self.sessions[self.shortener.shards.shard_for(short_code)]()
+
+    async def shutdown(self):
+        for engine in self.engines or ():
+            await engine.dispose()
+        if self.shortener is not None:
+            await asyncio.to_thread(self.shortener.access_counts.flush)
+            await asyncio.to_thread(self.shortener.click_analytics.flush)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        if self.engines is None:
+            await self.startup()
+
+        method = scope['method']
+        parts = [unquote(part) for part in scope['path'].strip('/').split('/')]
+
+        if parts[0] == 'shorten':
+            if len(parts) == 1 and method == 'POST':
+                status, headers, body = (self.check_rate_limit('create', scope)
+                                         or await self.create_short_url(await read_json(receive)))
+            elif len(parts) == 2 and parts[1] and method == 'GET':
+                status, headers, body = await self.get_short_url(
+                    parts[1], request_header(scope, b'if-none-match'))
+            elif len(parts) == 2 and parts[1] and method == 'PUT':
+                status, headers, body = await self.update_short_url(parts[1], await read_json(receive))
+            elif len(parts) == 2 and parts[1] and method == 'DELETE':
+                status, headers, body = await self.delete_short_url(parts[1])
+            else:
+                status, headers, body = json_response({'error': 'Not found'}, 404)
+        elif len(parts) == 1 and parts[0] and method in ('GET', 'HEAD'):
+            status, headers, body = (self.check_rate_limit('redirect', scope)
+                                     or await self.redirect_to_original(parts[0], scope))
+        else:
+            status, headers, body = json_response({'error': 'Not found'}, 404)
+
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': b'' if method == 'HEAD' else body})
+
+    def check_rate_limit(self, limit, scope):
+        """429 response if the client has run out of tokens for limit, else None"""
+        limiter = self.shortener.rate_limiter
+        if limiter is None:
+            return None
+        from ratelimit import retry_after_header
+
+        header = self.flask_app.config['RATE_LIMIT_KEY_HEADER'].lower().encode('latin-1')
+        client = scope.get('client')
+        allowed, retry_after = limiter.check(limit, limiter.client(request_header(scope, header),
+                                                                   client[0] if client else None))
+        if allowed:
+            return None
+        status, headers, body = json_response({'error': 'Rate limit exceeded'}, 429)
+        return status, headers + [(b'retry-after', retry_after_header(retry_after).encode())], body
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await self.startup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def find(self, session, short_code):
+        result = await session.execute(select(ShortURL).where(ShortURL.short_code == short_code))
+        return result.scalars().first()
+
+    async def redirect_to_original(self, short_code, scope):
+        """Redirect to original URL and track access count"""
+        target = self.shortener.redirect_cache.get(short_code)
+
+        if target is None and self.shortener.redirect_snapshot is not None:
+            target = self.shortener.redirect_snapshot.lookup(short_code)
+
+        if target is None:
+            async with self.session_for(short_code) as session:
+                result = await session.execute(LOOKUP_ORIGINAL_URL, {'short_code': short_code})
+                target = result.first()
+
+            if target is None:
+                return json_response({'error': 'Short URL not found'}, 404)
+            target = redirect_target(target)
+            self.shortener.redirect_cache.set(short_code, target)
+
+        original_url, permanent, expires = target
+        if expires is not None and expires <= time.time():
+            return json_response({'error': 'Short URL has expired'}, 410)
+
+        self.shortener.access_counts.increment(short_code)
+        self.shortener.click_analytics.record(short_code)
+        if self.shortener.leaderboard is not None:
+            self.shortener.leaderboard.record(short_code)
+        if self.shortener.click_log is not None:
+            client = scope.get('client')
+            self.shortener.click_log.record(short_code, client[0] if client else None,
+                                            request_header(scope, b'referer'),
+                                            request_header(scope, b'user-agent'))
+        status, cache_control = self.shortener.redirect_headers(permanent, expires)
+        return status, [(b'location', original_url.encode('utf-8')),
+                        (b'cache-control', cache_control.encode())], b''
+
+    async def create_short_url(self, data):
+        """Create a new short URL"""
+        if not isinstance(data, dict) or 'url' not in data:
+            return json_response({'error': 'URL is required'}, 400)
+
+        url = data['url']
+        is_valid, error_message = self.shortener.validate_url(url)
+        if not is_valid:
+            return json_response({'error': error_message}, 400)
+
+        try:
+            policy = parse_redirect_policy(data)
+            expires_at = parse_expires_at(data)
+        except ValueError as exc:
+            return json_response({'error': str(exc)}, 400)
+
+        if self.shortener.url_deduplicator is not None and expires_at is None:
+            # Scans every shard with the sync engines, off the loop
+            existing = await asyncio.to_thread(self.shortener.find_duplicate, url, policy)
+            if existing is not None:
+                return json_response(self.shortener.with_pending_count(existing), 200)
+
+        for _ in range(MAX_CODE_ATTEMPTS):
+            # Block reservations are rare but synchronous, keep them off the loop
+            short_code = await asyncio.to_thread(self.shortener.code_generator.next_code)
+            row_id = None
+            if self.shortener.row_ids is not None:
+                row_id = await asyncio.to_thread(self.shortener.next_row_id)
+            new_url = ShortURL(id=row_id, original_url=url, short_code=short_code, redirect_policy=policy,
+                               expires_at=expires_at)
+            async with self.session_for(short_code) as session:
+                session.add(new_url)
+                try:
+                    await session.commit()
+                    break
+                except IntegrityError:
+                    await session.rollback()
+        else:
+            return json_response({'error': 'Could not allocate a unique short code'}, 503)
+
+        if self.shortener.url_deduplicator is not None:
+            self.shortener.url_deduplicator.add(new_url.url_hash)
+        return json_response(new_url.to_dict(), 201)
+
+    async def get_short_url(self, short_code, if_none_match=None):
+        """Retrieve original URL from short code"""
+        async with self.session_for(short_code) as session:
+            short_url = await self.find(session, short_code)
+
+        if not short_url:
+            return json_response({'error': 'Short URL not found'}, 404)
+        if short_url.is_expired():
+            return json_response({'error': 'Short URL has expired'}, 410)
+
+        etag = short_url_etag(short_url, short_url.access_count)
+        validators = [(b'etag', f'"{etag}"'.encode()),
+                      (b'last-modified', http_date(short_url.updated_at).encode()),
+                      (b'cache-control', b'no-cache')]
+        if if_none_match and parse_etags(if_none_match).contains_weak(etag):
+            return 304, validators, b''
+        status, headers, body = json_response(short_url.to_dict(), 200)
+        return status, headers + validators, body
+
+    async def update_short_url(self, short_code, data):
+        """Update an existing short URL"""
+        async with self.session_for(short_code) as session:
+            short_url = await self.find(session, short_code)
+            if not short_url:
+                return json_response({'error': 'Short URL not found'}, 404)
+
+            if not isinstance(data, dict) or ('url' not in data and 'redirectPolicy' not in data
+                                              and 'expiresAt' not in data):
+                return json_response({'error': 'URL is required'}, 400)
+
+            new_url = data.get('url', short_url.original_url)
+            is_valid, error_message = self.shortener.validate_url(new_url)
+            if not is_valid:
+                return json_response({'error': error_message}, 400)
+
+            try:
+                policy = parse_redirect_policy(data, default=short_url.redirect_policy)
+                expires_at = parse_expires_at(data, default=short_url.expires_at)
+            except ValueError as exc:
+                return json_response({'error': str(exc)}, 400)
+
+            short_url.original_url = new_url
+            short_url.url_hash = url_hash(new_url)
+            short_url.host = url_host(new_url)
+            short_url.redirect_policy = policy
+            short_url.expires_at = expires_at
+            await session.commit()
+
+        self.shortener.forget_cached(short_code)
+        if self.shortener.url_deduplicator is not None:
+            self.shortener.url_deduplicator.add(short_url.url_hash)
+        return json_response(short_url.to_dict(), 200)
+
+    async def delete_short_url(self, short_code):
+        """Delete a short URL"""
+        async with self.session_for(short_code) as session:
+            short_url = await self.find(session, short_code)
+            if not short_url:
+                return json_response({'error': 'Short URL not found'}, 404)
+
+            await session.delete(short_url)
+            await session.run_sync(self.shortener.purge_short_code, short_code)
+            await session.commit()
+
+        self.shortener.forget_cached(short_code)
+        self.shortener.access_counts.discard(short_code)
+        if self.shortener.leaderboard is not None:
+            self.shortener.leaderboard.discard(short_code)
+        return 204, [], b''
+
+
+async def read_json(receive):
+    """Read the full request body and decode it as JSON, or None"""
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    try:
+        return json.loads(b''.join(chunks) or b'null')
+    except ValueError:
+        return None
+
+
+def request_header(scope, name):
+    """Return the first value of a request header, or None"""
+    for key, value in scope['headers']:
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+
+def json_response(data, status):
+    body = json.dumps(data).encode('utf-8')
+    return status, [(b'content-type', b'application/json'),
+                    (b'content-length', str(len(body)).encode())], body
+
+
+application = ShortenerASGI()
@@ -0,0 +1,68 @@
+"""Static files compressed once and served with content-hashed URLs
+
+Each file is read, hashed and gzip-compressed the first time it is
+requested and kept in memory until its mtime changes, so requests never pay
+for compression. ``url()`` appends the content hash as ``?v=`` so pages can
+reference assets that browsers and CDNs may cache for a year.
+"""
+from collections import namedtuple
+import gzip
+import hashlib
+import mimetypes
+import os
+import stat
+import threading
+
+from werkzeug.security import safe_join
+
+# Responses smaller than this are not worth a Content-Encoding
+MIN_COMPRESS_SIZE = 512
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+
+Asset = namedtuple('Asset', 'data gzipped version mimetype mtime_ns')
+
+
+class AssetStore:
+    def __init__(self, folder):
+        self.folder = os.path.abspath(folder)
+        self._assets = {}
+        self._lock = threading.Lock()
+
+    def get(self, filename):
+        """Return the Asset for filename, or None if there is no such file"""
+        path = safe_join(self.folder, filename)
+        if path is None:
+            return None
+        try:
+            info = os.stat(path)
+        except OSError:
+            return None
+        if not stat.S_ISREG(info.st_mode):
+            return None
+
+        asset = self._assets.get(filename)
+        if asset is None or asset.mtime_ns != info.st_mtime_ns:
+            with self._lock:
+                asset = self._assets[filename] = self._load(path, info.st_mtime_ns)
+        return asset
+
+    def _load(self, path, mtime_ns):
+        with open(path, 'rb') as handle:
+            data = handle.read()
+        mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+        gzipped = None
+        if len(data) >= MIN_COMPRESS_SIZE and mimetype.startswith(COMPRESSIBLE_TYPES):
+            # mtime=0 keeps the output identical across workers and restarts
+            gzipped = gzip.compress(data, compresslevel=9, mtime=0)
+            if len(gzipped) >= len(data):
+                gzipped = None
+        version = hashlib.blake2b(data, digest_size=8).hexdigest()
+        return Asset(data, gzipped, version, mimetype, mtime_ns)
+
+    def url(self, filename):
+        """Public URL of filename carrying its content hash"""
+        asset = self.get(filename)
+        if asset is None:
+            return f'/static/{filename}'
+        return f'/static/{filename}?v={asset.version}'
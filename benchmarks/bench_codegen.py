@@ -0,0 +1,60 @@
+"""Create throughput of each short code strategy at growing table sizes
+
+Usage:
+    python benchmarks/bench_codegen.py [--sizes 10000 1000000 10000000] [--creates 2000]
+
+The table is seeded with random legacy-style codes up to each size in turn,
+then every strategy creates ``--creates`` links through ``POST /shorten``.
+One JSON object per (size, strategy) is printed to stdout.
+"""
+import argparse
+import json
+import time
+
+from common import seed_rows, temp_database
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 1000000, 10000000])
+    parser.add_argument('--creates', type=int, default=2000)
+    parser.add_argument('--strategies', nargs='+', default=['random', 'sequential', 'shuffle'])
+    args = parser.parse_args()
+
+    path = temp_database('bench-codegen-')
+
+    from app import create_app, init_database
+    from codegen import make_code_generator
+
+    app = create_app()
+    init_database(app)
+    shortener = app.extensions['shortener']
+    client = app.test_client()
+    for size in sorted(args.sizes):
+        rows = seed_rows(path, size)
+        for strategy in args.strategies:
+            shortener.code_generator = make_code_generator(
+                strategy,
+                reserve_block=shortener.reserve_id_block,
+                length=app.config['SHORT_CODE_LENGTH'],
+                secret=app.config['SHORT_CODE_SECRET'],
+                block_size=app.config['SHORT_CODE_BLOCK_SIZE'])
+
+            start = time.perf_counter()
+            for i in range(args.creates):
+                response = client.post('/shorten', json={'url': f'https://example.com/{i}'})
+                assert response.status_code == 201, response.get_json()
+            elapsed = time.perf_counter() - start
+
+            print(json.dumps({
+                'benchmark': 'create',
+                'strategy': strategy,
+                'existingRows': rows,
+                'creates': args.creates,
+                'seconds': round(elapsed, 4),
+                'createsPerSecond': round(args.creates / elapsed, 1),
+            }), flush=True)
+
+
+if __name__ == '__main__':
+    main()
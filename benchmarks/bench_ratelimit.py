@@ -0,0 +1,123 @@
+"""Overhead of the rate limiter, per bucket store and on the redirect path
+
+Usage:
+    python benchmarks/bench_ratelimit.py [--takes 200000] [--threads 1 8] [--clients 10000] [--redirects 5000]
+
+First each store takes tokens directly: the memory store with 64 lock
+stripes and with a single lock, from every thread count in ``--threads``,
+and the shared SQLite store from one thread. Then ``--redirects`` redirects
+go through the Flask test client with limiting off, on with the memory
+store and on with the SQLite store; the limits are set high enough that
+nothing is rejected, so only the bookkeeping is measured. One JSON object
+per measurement is printed to stdout.
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+
+from common import environment, load_codes, seed_rows, summarize, temp_database
+
+
+def bench_store(store, takes, threads, clients):
+    """Take takes tokens in total from threads threads; returns takes per second"""
+    keys = [f'redirect:ip:10.0.{i // 256}.{i % 256}' for i in range(clients)]
+    per_thread = takes // threads
+    barrier = threading.Barrier(threads + 1)
+
+    def run(seed):
+        rng = random.Random(seed)
+        sample = [rng.choice(keys) for _ in range(1024)]
+        barrier.wait()
+        for i in range(per_thread):
+            store.take(sample[i & 1023], 1e9, 1e9)
+
+    workers = [threading.Thread(target=run, args=(seed,)) for seed in range(threads)]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    return per_thread * threads, elapsed
+
+
+def bench_redirects(codes, redirects):
+    """Redirect latency through a fresh app built from the current environment"""
+    from app import create_app
+
+    app = create_app()
+    client = app.test_client()
+    rng = random.Random(1)
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(redirects):
+        code = rng.choice(codes)
+        before = time.perf_counter()
+        response = client.get('/' + code)
+        latencies.append(time.perf_counter() - before)
+        assert response.status_code in (301, 302), response.status_code
+    elapsed = time.perf_counter() - start
+    app.extensions['shortener'].stop()
+    return summarize(latencies, elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--takes', type=int, default=200000)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--clients', type=int, default=10000)
+    parser.add_argument('--redirects', type=int, default=5000)
+    parser.add_argument('--dataset', type=int, default=10000)
+    args = parser.parse_args()
+
+    path = temp_database('bench-ratelimit-')
+
+    from app import create_app, init_database
+    from ratelimit import MemoryBucketStore, SQLiteBucketStore
+
+    meta = environment()
+    store_dir = tempfile.mkdtemp(prefix='bench-ratelimit-store-')
+    stores = [('memory', threads, lambda: MemoryBucketStore(stripes=64)) for threads in args.threads]
+    stores += [('memory-1-lock', threads, lambda: MemoryBucketStore(stripes=1)) for threads in args.threads]
+    stores.append(('sqlite', 1, lambda: SQLiteBucketStore(os.path.join(store_dir, 'buckets.db'))))
+    for name, threads, factory in stores:
+        takes = args.takes if name != 'sqlite' else args.takes // 10
+        done, elapsed = bench_store(factory(), takes, threads, args.clients)
+        print(json.dumps({
+            'benchmark': 'store',
+            'store': name,
+            'threads': threads,
+            'clients': args.clients,
+            'takes': done,
+            'seconds': round(elapsed, 4),
+            'takesPerSecond': round(done / elapsed, 1),
+            'microsecondsPerTake': round(elapsed / done * 1e6, 3),
+            'environment': meta,
+        }), flush=True)
+
+    init_database(create_app())
+    seed_rows(path, args.dataset)
+    codes = [code for _, code in load_codes(path)]
+
+    os.environ.update(RATE_LIMIT_REDIRECT_RATE='1000000000', RATE_LIMIT_REDIRECT_BURST='1000000000')
+    for mode, settings in (('off', {'RATE_LIMIT_ENABLED': '0'}),
+                           ('memory', {'RATE_LIMIT_ENABLED': '1'}),
+                           ('sqlite', {'RATE_LIMIT_ENABLED': '1',
+                                       'RATE_LIMIT_STORE_PATH': os.path.join(store_dir, 'app-buckets.db')})):
+        os.environ.pop('RATE_LIMIT_STORE_PATH', None)
+        os.environ.update(settings)
+        print(json.dumps({
+            'benchmark': 'redirect',
+            'rateLimit': mode,
+            **bench_redirects(codes, args.redirects),
+            'environment': meta,
+        }), flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Before/after comparison of SQLite storage profiles
+
+Usage:
+    python benchmarks/bench_sqlite_profile.py [--profiles default tuned] [--mode macro]
+                                              [--dataset 100000] [--requests 5000]
+                                              [--concurrency 16] [--with-cache]
+
+Each profile runs the harness in its own process against its own database,
+since the profile is applied when the engine is created. The redirect cache
+is disabled unless ``--with-cache`` is given so lookups reach SQLite, and the
+access count buffer flushes every 10 clicks to keep the writer busy.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from common import environment
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def run_profile(profile, args):
+    env = dict(os.environ, SQLITE_PROFILE=profile, ACCESS_COUNT_FLUSH_SIZE='10')
+    if not args.with_cache:
+        env['REDIRECT_CACHE_SIZE'] = '0'
+
+    with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as handle:
+        output = handle.name
+    try:
+        subprocess.run([sys.executable, os.path.join(HERE, 'harness.py'),
+                        '--mode', args.mode, '--dataset', str(args.dataset),
+                        '--requests', str(args.requests), '--concurrency', str(args.concurrency),
+                        '--scenarios', *args.scenarios, '--output', output],
+                       env=env, check=True)
+        with open(output) as handle:
+            return json.load(handle)['results']
+    finally:
+        os.unlink(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--profiles', nargs='+', default=['default', 'tuned'])
+    parser.add_argument('--mode', choices=('micro', 'macro'), default='macro')
+    parser.add_argument('--dataset', type=int, default=100000)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--scenarios', nargs='+', default=['redirect', 'create', 'stats'])
+    parser.add_argument('--with-cache', action='store_true')
+    args = parser.parse_args()
+
+    report = {
+        'environment': environment(),
+        'parameters': {
+            'mode': args.mode,
+            'dataset': args.dataset,
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'redirectCache': args.with_cache,
+        },
+        'profiles': {profile: run_profile(profile, args) for profile in args.profiles},
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Worker startup cost: import time, app construction and first requests
+
+Usage:
+    python benchmarks/bench_startup.py [--runs 20] [--dataset 10000]
+
+Every run starts a fresh interpreter, as a new worker would, against a
+database that was initialized (``init.py``) and seeded beforehand. Each run
+records the time to import ``app``, to build the app with ``create_app()``,
+and the latency of the first frontend page, first redirect and first create.
+The report gives the median, p95 and max of each across runs.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from common import ROOT, environment, load_codes, percentile, seed_rows, temp_database
+
+# Runs in the child interpreter; prints one JSON object of timings in seconds
+PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import app as app_module
+imported = time.perf_counter()
+app = app_module.create_app()
+created = time.perf_counter()
+client = app.test_client()
+timings = {'import': imported - start, 'createApp': created - imported}
+for name, method, path, body in (('firstPage', 'GET', '/', None),
+                                 ('firstRedirect', 'GET', '/' + sys.argv[1], None),
+                                 ('firstCreate', 'POST', '/shorten', {'url': 'https://example.com/startup'})):
+    before = time.perf_counter()
+    response = client.open(path, method=method, json=body)
+    timings[name] = time.perf_counter() - before
+    assert response.status_code < 400, (path, response.status_code)
+timings['total'] = time.perf_counter() - start
+print(json.dumps(timings))
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--dataset', type=int, default=10000)
+    args = parser.parse_args()
+
+    path = temp_database('bench-startup-')
+    subprocess.run([sys.executable, os.path.join(ROOT, 'init.py')], check=True,
+                   capture_output=True, cwd=ROOT)
+    seed_rows(path, args.dataset)
+    code = load_codes(path, limit=1)[0][1]
+
+    samples = {}
+    for _ in range(args.runs):
+        output = subprocess.run([sys.executable, '-c', PROBE, code], check=True, capture_output=True,
+                                text=True, cwd=ROOT, env=dict(os.environ, PYTHONDONTWRITEBYTECODE='0'))
+        for name, seconds in json.loads(output.stdout.splitlines()[-1]).items():
+            samples.setdefault(name, []).append(seconds)
+
+    ms = lambda value: round(value * 1000, 2)
+    report = {
+        'environment': environment(),
+        'parameters': {'runs': args.runs, 'dataset': args.dataset},
+        'startupMs': {
+            name: {
+                'median': ms(statistics.median(values)),
+                'p95': ms(percentile(sorted(values), 95)),
+                'max': ms(max(values)),
+            }
+            for name, values in samples.items()
+        },
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
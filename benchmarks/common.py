@@ -0,0 +1,105 @@
+"""Shared helpers for the benchmark scripts"""
+import os
+import platform
+import random
+import sqlite3
+import string
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ALPHABET = string.ascii_letters + string.digits
+
+
+def temp_database(prefix='bench-'):
+    """Point the app at a fresh SQLite file and make it importable"""
+    path = os.path.join(tempfile.mkdtemp(prefix=prefix), 'bench.db')
+    os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    return path
+
+
+def seed_rows(path, target, chunk=50000):
+    """Top the short_urls table up to target rows with random codes"""
+    conn = sqlite3.connect(path)
+    count = conn.execute('SELECT COUNT(*) FROM short_urls').fetchone()[0]
+    now = time.strftime('%Y-%m-%d %H:%M:%S')
+    while count < target:
+        batch = min(chunk, target - count)
+        rows = [(f'https://example.com/seed/{count + i}',
+                 ''.join(random.choices(ALPHABET, k=6)), now, now)
+                for i in range(batch)]
+        conn.executemany('INSERT OR IGNORE INTO short_urls '
+                         '(original_url, short_code, created_at, updated_at, access_count) '
+                         'VALUES (?, ?, ?, ?, 0)', rows)
+        conn.commit()
+        count = conn.execute('SELECT COUNT(*) FROM short_urls').fetchone()[0]
+    conn.close()
+    return count
+
+
+def load_codes(path, limit=None):
+    """Return (id, short_code) pairs from the table in id order"""
+    conn = sqlite3.connect(path)
+    query = 'SELECT id, short_code FROM short_urls ORDER BY id'
+    if limit:
+        query += f' LIMIT {int(limit)}'
+    rows = conn.execute(query).fetchall()
+    conn.close()
+    return rows
+
+
+def zipf_sampler(population, s=1.1, seed=None):
+    """Return a function drawing items with Zipf(s) popularity by position"""
+    rng = random.Random(seed)
+    weights = []
+    total = 0.0
+    for rank in range(1, len(population) + 1):
+        total += 1.0 / rank ** s
+        weights.append(total)
+    return lambda: rng.choices(population, cum_weights=weights)[0]
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, elapsed, errors=0):
+    """Latency percentiles (ms) and throughput for one scenario"""
+    latencies = sorted(latencies)
+    ms = lambda value: round(value * 1000, 3) if value is not None else None
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'seconds': round(elapsed, 4),
+        'throughput': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'latencyMs': {
+            'mean': ms(sum(latencies) / len(latencies)) if latencies else None,
+            'p50': ms(percentile(latencies, 50)),
+            'p95': ms(percentile(latencies, 95)),
+            'p99': ms(percentile(latencies, 99)),
+            'max': ms(latencies[-1]) if latencies else None,
+        },
+    }
+
+
+def environment():
+    """Metadata that makes results comparable across commits"""
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                  capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {
+        'commit': revision,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+    }
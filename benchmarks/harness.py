@@ -0,0 +1,195 @@
+"""Latency and throughput harness for the redirect, create, stats and listing paths
+
+Usage:
+    python benchmarks/harness.py [--mode micro|macro] [--dataset 10000]
+                                 [--requests 5000] [--concurrency 8] [--zipf 1.1]
+                                 [--scenarios redirect create stats all-urls]
+                                 [--output results.json]
+
+``micro`` drives the Flask test client in-process, ``macro`` serves the app
+from a local threaded WSGI server and talks HTTP/1.1 keep-alive to it. Keys
+for redirect and stats requests are drawn with Zipf-skewed popularity. The
+report is a single JSON document with p50/p95/p99 latency and throughput per
+scenario plus the commit it was measured on.
+"""
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+
+from common import environment, load_codes, seed_rows, summarize, temp_database, zipf_sampler
+
+SCENARIOS = ('redirect', 'create', 'stats', 'all-urls')
+
+
+def build_requests(scenario, ids, pick_code, rng):
+    """Return a function producing (method, path, body) for one request"""
+    if scenario == 'redirect':
+        return lambda: ('GET', '/' + pick_code(), None)
+    if scenario == 'stats':
+        return lambda: ('GET', f'/shorten/{pick_code()}/stats', None)
+    if scenario == 'create':
+        return lambda: ('POST', '/shorten', {'url': f'https://example.com/bench/{rng.random()}'})
+    if scenario == 'all-urls':
+        return lambda: ('GET', f'/all-urls?limit=100&after={rng.choice(ids)}', None)
+    raise ValueError(f'Unknown scenario: {scenario}')
+
+
+def micro_sender(app):
+    """Per-thread sender backed by the Flask test client"""
+    def factory():
+        client = app.test_client()
+
+        def send(method, path, body):
+            return client.open(path, method=method, json=body).status_code
+        return send
+    return factory
+
+
+def macro_sender(host, port):
+    """Per-thread sender holding one keep-alive HTTP connection"""
+    def factory():
+        conn = http.client.HTTPConnection(host, port)
+
+        def send(method, path, body):
+            headers = {}
+            payload = None
+            if body is not None:
+                payload = json.dumps(body)
+                headers['Content-Type'] = 'application/json'
+            conn.request(method, path, body=payload, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            return response.status
+        return send
+    return factory
+
+
+def serve_in_background(app):
+    """Start a threaded WSGI server on a free local port"""
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class KeepAliveHandler(WSGIRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=KeepAliveHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def run_scenario(sender_factory, next_request, total, concurrency):
+    """Issue total requests across concurrency threads and summarize them"""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    per_thread = [total // concurrency + (1 if i < total % concurrency else 0)
+                  for i in range(concurrency)]
+
+    def worker(count):
+        send = sender_factory()
+        local = []
+        failed = 0
+        for _ in range(count):
+            method, path, body = next_request()
+            start = time.perf_counter()
+            try:
+                status = send(method, path, body)
+            except (OSError, http.client.HTTPException):
+                status = 599
+            local.append(time.perf_counter() - start)
+            if status >= 400:
+                failed += 1
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=worker, args=(count,)) for count in per_thread]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, time.perf_counter() - start, errors[0])
+
+
+def run(app, path, mode='micro', dataset=10000, requests=5000, concurrency=8,
+        zipf=1.1, scenarios=SCENARIOS, warmup=200, seed=42):
+    """Seed the database, run every scenario and return the report"""
+    rows = seed_rows(path, dataset)
+    pairs = load_codes(path)
+    ids = [row_id for row_id, _ in pairs]
+    codes = [code for _, code in pairs]
+    rng = random.Random(seed)
+    shuffled = codes[:]
+    rng.shuffle(shuffled)
+    pick_code = zipf_sampler(shuffled, zipf, seed)
+
+    server = None
+    if mode == 'macro':
+        server = serve_in_background(app)
+        factory = macro_sender('127.0.0.1', server.server_port)
+    else:
+        factory = micro_sender(app)
+
+    results = {}
+    try:
+        for scenario in scenarios:
+            next_request = build_requests(scenario, ids, pick_code, rng)
+            if warmup:
+                run_scenario(factory, next_request, warmup, concurrency)
+            results[scenario] = run_scenario(factory, next_request, requests, concurrency)
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    return {
+        'environment': environment(),
+        'parameters': {
+            'mode': mode,
+            'dataset': rows,
+            'requests': requests,
+            'concurrency': concurrency,
+            'zipf': zipf,
+            'warmup': warmup,
+        },
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mode', choices=('micro', 'macro'), default='micro')
+    parser.add_argument('--dataset', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--zipf', type=float, default=1.1)
+    parser.add_argument('--warmup', type=int, default=200)
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    path = temp_database('bench-harness-')
+    from app import create_app, init_database
+
+    app = create_app()
+    init_database(app)
+
+    report = run(app, path, mode=args.mode, dataset=args.dataset, requests=args.requests,
+                 concurrency=args.concurrency, zipf=args.zipf, scenarios=args.scenarios,
+                 warmup=args.warmup)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            handle.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
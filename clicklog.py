@@ -0,0 +1,323 @@
+"""Per-click metadata through a bounded queue, an append-only log and compaction
+
+Redirects only append a small tuple to an in-process queue; they never wait
+on disk or the database. A writer thread drains the queue in batches,
+resolves the country and appends one NDJSON line per click to the active
+segment of the log directory::
+
+    clicks-<pid>-<start ms>.ndjson.part    segment being written
+    clicks-<pid>-<start ms>.ndjson         sealed, waiting for compaction
+
+Segments are sealed by size or age. A compaction thread folds sealed
+segments into daily per-code counts in ``click_dimensions`` (referrer host,
+country and user agent family), then removes them. Each shard records the
+segments it has absorbed in ``click_log_segments`` in the same transaction
+as the counts, so a segment is never counted twice even if compaction is
+interrupted or several workers share the directory.
+
+When the queue runs past ``sample_threshold`` of its capacity only one in
+``sample_every`` clicks is kept, carrying that weight so aggregates stay
+unbiased, and once it is full clicks are dropped.
+"""
+from collections import Counter, deque
+from datetime import datetime, timezone
+import glob
+import json
+import logging
+import os
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+
+from analytics import DAY, bucket_start
+
+logger = logging.getLogger(__name__)
+
+# Longest referrer and user agent kept in the log
+MAX_HEADER_LENGTH = 512
+
+# Sealed segments of dead processes are picked up after this many seconds idle
+STALE_SEGMENT_SECONDS = 3600
+
+UPSERT_DIMENSION = text(
+    'INSERT INTO click_dimensions (short_code, dimension, day, value, count) '
+    'VALUES (:short_code, :dimension, :day, :value, :count) '
+    'ON CONFLICT (short_code, dimension, day, value) '
+    'DO UPDATE SET count = count + excluded.count'
+)
+
+CLAIM_SEGMENT = text(
+    'INSERT INTO click_log_segments (name, records, compacted_at) VALUES (:name, :records, :compacted_at)'
+)
+
+# Checked in order; the first matching pattern names the family
+AGENT_FAMILIES = (
+    ('bot', re.compile(r'bot|crawl|spider|slurp|preview|facebookexternalhit', re.I)),
+    ('cli', re.compile(r'^(curl|wget|python|go-http|java|okhttp|libwww)', re.I)),
+    ('edge', re.compile(r'Edg(e|A|iOS)?/')),
+    ('opera', re.compile(r'OPR/|Opera')),
+    ('chrome', re.compile(r'Chrome/|CriOS/')),
+    ('firefox', re.compile(r'Firefox/|FxiOS/')),
+    ('safari', re.compile(r'Safari/')),
+)
+
+
+def agent_family(user_agent):
+    """Coarse browser family of a User-Agent header"""
+    if not user_agent:
+        return 'unknown'
+    for family, pattern in AGENT_FAMILIES:
+        if pattern.search(user_agent):
+            return family
+    return 'other'
+
+
+def referrer_host(referrer):
+    """Host of a Referer header, or "(direct)" without one"""
+    if not referrer:
+        return '(direct)'
+    try:
+        host = urlsplit(referrer).hostname
+    except ValueError:
+        host = None
+    return (host or '(invalid)')[:255]
+
+
+class ClickLog:
+    """Bounded click queue, segment-rotated NDJSON log and its compactor
+
+    ``shards`` is a ``shards.ShardSet``; ``geoip`` anything with a
+    ``country(address)`` method, or None.
+    """
+
+    def __init__(self, directory, shards, geoip=None, capacity=100000, sample_threshold=0.5,
+                 sample_every=10, batch_size=1000, flush_interval=1.0, segment_bytes=64 << 20,
+                 segment_seconds=300, compact_interval=60, retention=730 * DAY):
+        self.directory = directory
+        self.shards = shards
+        self.geoip = geoip
+        self.capacity = capacity
+        self.sample_depth = int(capacity * sample_threshold)
+        self.sample_every = sample_every
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.compact_interval = compact_interval
+        self.retention = retention
+
+        self._queue = deque()
+        self._sample_counter = 0
+        self._segment = None
+        self._segment_path = None
+        self._segment_opened = 0.0
+        self._write_lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._threads = []
+
+        self.enqueued = 0
+        self.sampled_out = 0
+        self.dropped = 0
+        self.written = 0
+        self.sealed = 0
+        self.compacted_segments = 0
+        self.compacted_records = 0
+        self.compact_seconds = 0.0
+
+    def record(self, short_code, remote_addr, referrer, user_agent, timestamp=None):
+        """Queue one click without blocking; returns False if it was sampled out or dropped"""
+        depth = len(self._queue)
+        weight = 1
+        if depth >= self.sample_depth:
+            if depth >= self.capacity:
+                self.dropped += 1
+                return False
+            self._sample_counter += 1
+            if self._sample_counter % self.sample_every:
+                self.sampled_out += 1
+                return False
+            weight = self.sample_every
+
+        self._queue.append((timestamp or time.time(), short_code, remote_addr,
+                            referrer and referrer[:MAX_HEADER_LENGTH],
+                            user_agent and user_agent[:MAX_HEADER_LENGTH], weight))
+        self.enqueued += 1
+        if depth + 1 == self.batch_size:
+            self._wakeup.set()
+        return True
+
+    def pending(self):
+        return len(self._queue)
+
+    def flush(self):
+        """Append every queued click to the active segment"""
+        with self._write_lock:
+            written = 0
+            while self._queue:
+                lines = []
+                for _ in range(min(self.batch_size, len(self._queue))):
+                    timestamp, short_code, address, referrer, user_agent, weight = self._queue.popleft()
+                    country = self.geoip.country(address) if self.geoip is not None else None
+                    lines.append(json.dumps({'t': round(timestamp, 3), 'c': short_code, 'r': referrer,
+                                             'a': user_agent, 'g': country, 'w': weight},
+                                            separators=(',', ':')))
+                self._append(lines)
+                written += len(lines)
+            if self._segment is not None:
+                self._segment.flush()
+                if time.monotonic() - self._segment_opened >= self.segment_seconds:
+                    self._seal()
+            self.written += written
+            return written
+
+    def _append(self, lines):
+        if self._segment is None:
+            os.makedirs(self.directory, exist_ok=True)
+            name = f'clicks-{os.getpid()}-{int(time.time() * 1000)}.ndjson'
+            self._segment_path = os.path.join(self.directory, name)
+            self._segment = open(self._segment_path + '.part', 'a', encoding='utf-8')
+            self._segment_opened = time.monotonic()
+        self._segment.write('\n'.join(lines) + '\n')
+        if self._segment.tell() >= self.segment_bytes:
+            self._seal()
+
+    def _seal(self):
+        self._segment.close()
+        os.replace(self._segment_path + '.part', self._segment_path)
+        self._segment = None
+        self.sealed += 1
+
+    def sealed_segments(self):
+        """Segments ready for compaction, oldest first
+
+        Unsealed segments left behind by a process that died are included
+        once they have not been written for STALE_SEGMENT_SECONDS.
+        """
+        paths = glob.glob(os.path.join(self.directory, 'clicks-*.ndjson'))
+        own = self._segment_path + '.part' if self._segment is not None else None
+        for path in glob.glob(os.path.join(self.directory, 'clicks-*.ndjson.part')):
+            if path != own and time.time() - os.path.getmtime(path) > STALE_SEGMENT_SECONDS:
+                paths.append(path)
+        return sorted(paths, key=os.path.basename)
+
+    def compact(self):
+        """Fold sealed segments into click_dimensions; returns (segments, records)"""
+        with self._compact_lock:
+            start = time.perf_counter()
+            segments = records = 0
+            for path in self.sealed_segments():
+                try:
+                    records += self._compact_segment(path)
+                except FileNotFoundError:
+                    # Compacted by another worker sharing the directory
+                    continue
+                segments += 1
+
+            now = time.time()
+            for shard in range(len(self.shards)):
+                with self.shards.begin(shard) as conn:
+                    conn.execute(text('DELETE FROM click_dimensions WHERE day < :cutoff'),
+                                 {'cutoff': bucket_start(now - self.retention, DAY)})
+
+            self.compacted_segments += segments
+            self.compacted_records += records
+            self.compact_seconds += time.perf_counter() - start
+        if segments:
+            logger.info('Compacted %d click log segments (%d clicks) in %.3fs',
+                        segments, records, time.perf_counter() - start)
+        return segments, records
+
+    def _compact_segment(self, path):
+        name = os.path.basename(path).removesuffix('.part')
+        counts = Counter()
+        records = 0
+        with open(path, encoding='utf-8') as handle:
+            for line in handle:
+                try:
+                    click = json.loads(line)
+                    day = bucket_start(click['t'], DAY)
+                    short_code = click['c']
+                    weight = click.get('w', 1)
+                except (ValueError, KeyError, TypeError):
+                    # A torn last line from a crash
+                    continue
+                records += 1
+                counts[short_code, 'referrer', day, referrer_host(click.get('r'))] += weight
+                counts[short_code, 'country', day, click.get('g') or '??'] += weight
+                counts[short_code, 'agent', day, agent_family(click.get('a'))] += weight
+
+        compacted_at = datetime.now(timezone.utc)
+        for shard, group in self.shards.group(counts.items(), key=lambda item: item[0][0]).items():
+            try:
+                with self.shards.begin(shard) as conn:
+                    # The claim row fails on a shard that already has this segment
+                    conn.execute(CLAIM_SEGMENT, {'name': name, 'records': records, 'compacted_at': compacted_at})
+                    conn.execute(UPSERT_DIMENSION, [
+                        {'short_code': short_code, 'dimension': dimension, 'day': day, 'value': value,
+                         'count': count}
+                        for (short_code, dimension, day, value), count in group
+                    ])
+            except IntegrityError:
+                continue
+        os.unlink(path)
+        return records
+
+    def start(self):
+        """Start the writer and compaction threads"""
+        if self._threads:
+            return
+        self._stopped.clear()
+        self._threads = [
+            threading.Thread(target=self._run_writer, name='click-log-writer', daemon=True),
+            threading.Thread(target=self._run_compactor, name='click-log-compact', daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """Stop both threads, writing out and sealing whatever is queued"""
+        self._stopped.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join()
+        self._threads = []
+        self.flush()
+        with self._write_lock:
+            if self._segment is not None:
+                self._seal()
+
+    def stats(self):
+        return {
+            'queued': len(self._queue),
+            'enqueued': self.enqueued,
+            'sampledOut': self.sampled_out,
+            'dropped': self.dropped,
+            'written': self.written,
+            'sealedSegments': self.sealed,
+            'compactedSegments': self.compacted_segments,
+            'compactedRecords': self.compacted_records,
+            'compactSeconds': round(self.compact_seconds, 6),
+        }
+
+    def _run_writer(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Failed to write the click log')
+
+    def _run_compactor(self):
+        while not self._stopped.wait(self.compact_interval):
+            try:
+                self.compact()
+            except Exception:
+                logger.exception('Click log compaction failed')
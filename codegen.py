@@ -0,0 +1,165 @@
+import hashlib
+import random
+import string
+import threading
+
+# Base62 alphabet used by every short code strategy
+ALPHABET = string.digits + string.ascii_letters
+BASE = len(ALPHABET)
+
+STRATEGIES = ('random', 'sequential', 'shuffle')
+
+
+def generate_short_code(length=6):
+    """Generate a random short code"""
+    return ''.join(random.choice(ALPHABET) for _ in range(length))
+
+
+def base62_encode(number, length=0):
+    """Encode a non-negative integer in base62, left-padded to length"""
+    if number < 0:
+        raise ValueError('Cannot encode a negative number')
+
+    chars = []
+    while number:
+        number, remainder = divmod(number, BASE)
+        chars.append(ALPHABET[remainder])
+    encoded = ''.join(reversed(chars)) or ALPHABET[0]
+    return encoded.rjust(length, ALPHABET[0])
+
+
+def base62_decode(code):
+    """Decode a base62 string back into an integer"""
+    number = 0
+    for char in code:
+        number = number * BASE + ALPHABET.index(char)
+    return number
+
+
+class IdBlockAllocator:
+    """Hand out monotonically increasing IDs from locally reserved blocks
+
+    ``reserve_block(size)`` must atomically reserve ``size`` consecutive IDs
+    in shared storage and return the first one. Only one call is made per
+    block, so most allocations never leave the process.
+    """
+
+    def __init__(self, reserve_block, block_size=1000):
+        self.reserve_block = reserve_block
+        self.block_size = block_size
+        self._next = 0
+        self._end = 0
+        self._lock = threading.Lock()
+
+    def next_id(self):
+        """Return the next unused ID"""
+        return self.next_ids(1)[0]
+
+    def next_ids(self, count):
+        """Return count unused IDs, reserving new blocks as needed"""
+        ids = []
+        with self._lock:
+            while len(ids) < count:
+                if self._next >= self._end:
+                    size = max(self.block_size, count - len(ids))
+                    self._next = self.reserve_block(size)
+                    self._end = self._next + size
+                take = min(count - len(ids), self._end - self._next)
+                ids.extend(range(self._next, self._next + take))
+                self._next += take
+        return ids
+
+
+class RandomCodeGenerator:
+    """Random base62 codes; uniqueness is left to the database constraint"""
+
+    def __init__(self, length=6):
+        self.length = length
+
+    def next_code(self):
+        return generate_short_code(self.length)
+
+    def next_codes(self, count):
+        return [generate_short_code(self.length) for _ in range(count)]
+
+
+class SequentialCodeGenerator:
+    """Base62 encoding of block-allocated IDs
+
+    IDs are offset so that every code is at least ``length`` characters.
+    """
+
+    def __init__(self, allocator, length=6):
+        self.allocator = allocator
+        self.offset = BASE ** (length - 1) if length > 1 else 0
+
+    def next_code(self):
+        return base62_encode(self.offset + self.allocator.next_id())
+
+    def next_codes(self, count):
+        return [base62_encode(self.offset + n) for n in self.allocator.next_ids(count)]
+
+
+class ShuffledCodeGenerator:
+    """Fixed-length codes from a keyed bijective shuffle of allocated IDs
+
+    A balanced Feistel network keyed with ``secret`` permutes the smallest
+    even-width bit space covering ``62 ** length``; results outside the
+    keyspace are re-encrypted (cycle walking), so distinct IDs always map
+    to distinct codes without consulting the database.
+    """
+
+    rounds = 4
+
+    def __init__(self, allocator, secret, length=6):
+        self.allocator = allocator
+        self.length = length
+        self.domain = BASE ** length
+        self.half_bits = (self.domain.bit_length() + 1) // 2
+        self.half_mask = (1 << self.half_bits) - 1
+        if isinstance(secret, str):
+            secret = secret.encode('utf-8')
+        self.key = hashlib.sha256(secret).digest()
+
+    def _round(self, index, value):
+        digest = hashlib.blake2b(value.to_bytes(8, 'big') + bytes([index]),
+                                 key=self.key, digest_size=8).digest()
+        return int.from_bytes(digest, 'big') & self.half_mask
+
+    def _encrypt(self, value):
+        left, right = value >> self.half_bits, value & self.half_mask
+        for index in range(self.rounds):
+            left, right = right, left ^ self._round(index, right)
+        return (left << self.half_bits) | right
+
+    def permute(self, number):
+        """Map an ID in [0, 62 ** length) to another ID in the same range"""
+        if not 0 <= number < self.domain:
+            raise ValueError(f'ID {number} is outside the {self.length}-character keyspace')
+        number = self._encrypt(number)
+        while number >= self.domain:
+            number = self._encrypt(number)
+        return number
+
+    def next_code(self):
+        return base62_encode(self.permute(self.allocator.next_id()), self.length)
+
+    def next_codes(self, count):
+        return [base62_encode(self.permute(n), self.length)
+                for n in self.allocator.next_ids(count)]
+
+
+def make_code_generator(strategy, reserve_block=None, length=6, secret='', block_size=1000):
+    """Build a short code generator for the configured strategy"""
+    if strategy == 'random':
+        return RandomCodeGenerator(length)
+
+    if strategy not in STRATEGIES:
+        raise ValueError(f'Unknown short code strategy: {strategy!r}')
+    if reserve_block is None:
+        raise ValueError(f'The {strategy!r} strategy needs an ID block allocator')
+
+    allocator = IdBlockAllocator(reserve_block, block_size)
+    if strategy == 'sequential':
+        return SequentialCodeGenerator(allocator, length)
+    return ShuffledCodeGenerator(allocator, secret, length)
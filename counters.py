@@ -0,0 +1,127 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class CounterBuffer:
+    """In-memory write-behind buffer of per-key increments
+
+    Increments are collected per key and handed to ``writer`` as a list of
+    ``(key, amount)`` pairs, either every ``flush_interval`` seconds or as
+    soon as ``flush_size`` increments are pending. If the writer raises, the
+    batch is merged back so the next flush retries it; a writer that only
+    stored part of the batch returns the pairs it did not store instead.
+    """
+
+    def __init__(self, writer, flush_interval=5.0, flush_size=1000):
+        self.writer = writer
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self._pending = {}
+        self._pending_total = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.flushes = 0
+        self.flushed = 0
+        self.flush_seconds = 0.0
+
+    def increment(self, key, amount=1):
+        """Record amount increments for key"""
+        with self._lock:
+            self._pending[key] = self._pending.get(key, 0) + amount
+            self._pending_total += amount
+            full = self._pending_total >= self.flush_size
+
+        if self._thread is None:
+            self.start()
+        if full:
+            self._wakeup.set()
+
+    def pending(self, key):
+        """Return increments for key that have not been written yet"""
+        with self._lock:
+            return self._pending.get(key, 0)
+
+    def pending_items(self, match):
+        """Return (key, amount) pairs not written yet whose key satisfies match"""
+        with self._lock:
+            return [(key, amount) for key, amount in self._pending.items() if match(key)]
+
+    def discard(self, key):
+        """Forget pending increments for key"""
+        with self._lock:
+            self._pending_total -= self._pending.pop(key, 0)
+
+    def flush(self):
+        """Hand every pending increment to the writer in one batch"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                batch = self._pending
+                self._pending = {}
+                self._pending_total = 0
+
+            items = list(batch.items())
+            start = time.perf_counter()
+            try:
+                unwritten = self.writer(items) or []
+            except Exception:
+                logger.exception('Failed to flush %d buffered counters', len(items))
+                unwritten = items
+            if unwritten:
+                with self._lock:
+                    for key, amount in unwritten:
+                        self._pending[key] = self._pending.get(key, 0) + amount
+                        self._pending_total += amount
+            if unwritten is items:
+                return 0
+
+            self.flushes += 1
+            self.flushed += len(items) - len(unwritten)
+            self.flush_seconds += time.perf_counter() - start
+            return len(items) - len(unwritten)
+
+    def start(self):
+        """Start the background flush thread"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name='counter-flush',
+                                            daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the background thread and flush whatever is left"""
+        self._stopped.set()
+        self._wakeup.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        self._thread = None
+        self.flush()
+
+    def stats(self):
+        """Return pending and flushed counters"""
+        with self._lock:
+            return {
+                'pendingKeys': len(self._pending),
+                'pendingIncrements': self._pending_total,
+                'flushes': self.flushes,
+                'flushedKeys': self.flushed,
+                'flushSeconds': round(self.flush_seconds, 6),
+            }
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            if self._stopped.is_set():
+                break
+            self.flush()
@@ -0,0 +1,169 @@
+from datetime import datetime, timezone
+import math
+import threading
+import time
+
+from sqlalchemy import select
+
+from models import normalize_url, url_hash
+from snapshot import OVERLAP
+
+
+class BloomFilter:
+    """Bit-array Bloom filter keyed by url_hash values"""
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, digest):
+        # Double hashing over the two halves of the 128-bit digest
+        first, second = int(digest[:16], 16), int(digest[16:], 16) | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, digest):
+        for position in self._positions(digest):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, digest):
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(digest))
+
+
+class UrlDeduplicator:
+    """Find an existing short URL for an identical destination
+
+    A Bloom filter of every stored ``url_hash`` answers most lookups for new
+    URLs without touching the database; anything it might contain is checked
+    with an indexed ``url_hash`` lookup. Only links with the requested
+    ``redirect_policy`` are reused. The filter is loaded in the
+    background and topped up every ``refresh_interval`` seconds with rows
+    other workers created (by id) or changed in place (by ``updated_at``);
+    until it is loaded every lookup goes to the index. Links with an ``expires_at`` are never reused.
+
+    Lookups take one session per shard; the filter covers all of them.
+    """
+
+    def __init__(self, model, capacity=10_000_000, error_rate=0.01, refresh_interval=5.0):
+        self.model = model
+        self.bloom = BloomFilter(capacity, error_rate)
+        self.refresh_interval = refresh_interval
+        self.ready = False
+        # Highest id loaded into the filter, per shard engine
+        self._last_ids = {}
+        # Start of the next updated_at range to read, per shard engine
+        self._updated_since = {}
+        self._next_refresh = 0.0
+        self._lock = threading.Lock()
+        self.bloom_skips = 0
+        self.index_lookups = 0
+
+    def load(self, session_factories, batch_size=50000):
+        """Fill the filter from the table on every shard in a background thread"""
+        def run():
+            for session_factory in session_factories:
+                session = session_factory()
+                try:
+                    self._refresh(session, batch_size)
+                finally:
+                    session.close()
+            self.ready = True
+        thread = threading.Thread(target=run, name='dedup-bloom-load', daemon=True)
+        thread.start()
+        return thread
+
+    def _refresh(self, session, batch_size=50000):
+        table = self.model.__table__
+        bind = session.get_bind()
+        checked = datetime.now(timezone.utc).replace(tzinfo=None)
+        while True:
+            rows = session.execute(
+                select(table.c.id, table.c.url_hash).where(table.c.id > self._last_ids.get(bind, 0))
+                .order_by(table.c.id).limit(batch_size)).all()
+            if not rows:
+                break
+            with self._lock:
+                for row_id, digest in rows:
+                    if digest:
+                        self.bloom.add(digest)
+                self._last_ids[bind] = max(self._last_ids.get(bind, 0), rows[-1][0])
+
+        # Updates and replacing imports change url_hash without a new id
+        since = self._updated_since.get(bind)
+        if since is not None:
+            digests = session.execute(
+                select(table.c.url_hash).where(table.c.updated_at >= since, table.c.url_hash.is_not(None))).scalars()
+            with self._lock:
+                for digest in digests:
+                    self.bloom.add(digest)
+        self._updated_since[bind] = checked - OVERLAP
+
+    def might_exist(self, sessions, digest):
+        """False only if no stored URL can have this hash"""
+        if not self.ready:
+            return True
+
+        now = time.monotonic()
+        if now >= self._next_refresh:
+            self._next_refresh = now + self.refresh_interval
+            for session in sessions:
+                self._refresh(session)
+
+        if digest in self.bloom:
+            return True
+        self.bloom_skips += 1
+        return False
+
+    def find(self, sessions, url, redirect_policy='tracked'):
+        """Return the stored short URL for an identical destination and policy, or None"""
+        digest = url_hash(url)
+        if not self.might_exist(sessions, digest):
+            return None
+
+        self.index_lookups += 1
+        normalized = normalize_url(url)
+        for session in sessions:
+            for candidate in session.execute(
+                    select(self.model).where(self.model.url_hash == digest,
+                                             self.model.redirect_policy == redirect_policy,
+                                             self.model.expires_at.is_(None))).scalars():
+                if normalize_url(candidate.original_url) == normalized:
+                    return candidate
+        return None
+
+    def find_many(self, sessions, urls, redirect_policy='tracked'):
+        """Map each URL that already has a short URL with redirect_policy to its short code"""
+        digests = {}
+        for url in urls:
+            digest = url_hash(url)
+            if self.might_exist(sessions, digest):
+                digests.setdefault(digest, []).append(url)
+        if not digests:
+            return {}
+
+        self.index_lookups += 1
+        found = {}
+        table = self.model.__table__
+        for session in sessions:
+            for code, original_url, digest in session.execute(
+                    select(table.c.short_code, table.c.original_url, table.c.url_hash)
+                    .where(table.c.url_hash.in_(digests), table.c.redirect_policy == redirect_policy,
+                           table.c.expires_at.is_(None))):
+                normalized = normalize_url(original_url)
+                for url in digests[digest]:
+                    if normalize_url(url) == normalized:
+                        found.setdefault(url, code)
+        return found
+
+    def add(self, digest):
+        """Record a newly stored hash"""
+        with self._lock:
+            self.bloom.add(digest)
+
+    def stats(self):
+        return {
+            'ready': self.ready,
+            'bloomSkips': self.bloom_skips,
+            'indexLookups': self.index_lookups,
+        }
@@ -0,0 +1,136 @@
+"""Background removal of short URLs past their ``expires_at``
+
+Expired links stop redirecting as soon as they expire (the redirect path
+checks the expiry it caches alongside the URL); the sweeper only reclaims
+their rows. It works in small batches, each its own short transaction that
+opens with the ``DELETE`` so the SQLite write lock is taken up front and
+released within milliseconds, and pauses between batches to let request
+writes through.
+"""
+from datetime import datetime, timezone
+import logging
+import threading
+import time
+
+from sqlalchemy import delete, insert, select
+
+logger = logging.getLogger(__name__)
+
+
+class ExpirySweeper:
+    """Delete (or archive) expired short URLs every ``interval`` seconds
+
+    Every shard of ``shards`` (a ``shards.ShardSet``) is swept in turn. Each
+    removed code gets a tombstone so incremental snapshot builds drop it,
+    and its rows in each of ``click_tables`` are deleted. With an
+    ``archive`` table the removed rows are copied there in the same
+    transaction.
+    """
+
+    def __init__(self, shards, short_urls, tombstones, click_tables=(), archive=None,
+                 interval=60.0, batch_size=500, pause=0.05):
+        self.shards = shards
+        self.short_urls = short_urls
+        self.tombstones = tombstones
+        self.click_tables = click_tables
+        self.archive = archive
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self._sweep_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.runs = 0
+        self.batches = 0
+        self.removed = 0
+        self.sweep_seconds = 0.0
+        self.last_run = None
+
+    def sweep(self, now=None):
+        """Remove every row expired at now; returns (rows removed, seconds spent)"""
+        if now is None:
+            now = datetime.now(timezone.utc)
+
+        with self._sweep_lock:
+            start = time.perf_counter()
+            removed = 0
+            for shard in range(len(self.shards)):
+                while not self._stopped.is_set():
+                    count = self._sweep_batch(shard, now)
+                    removed += count
+                    if count < self.batch_size:
+                        break
+                    time.sleep(self.pause)
+            elapsed = time.perf_counter() - start
+
+            self.runs += 1
+            self.removed += removed
+            self.sweep_seconds += elapsed
+            self.last_run = {'at': now.isoformat(), 'removed': removed, 'seconds': round(elapsed, 6)}
+        if removed:
+            logger.info('Removed %d expired short URLs in %.3fs', removed, elapsed)
+        return removed, elapsed
+
+    def _sweep_batch(self, shard, now):
+        table = self.short_urls
+        expired = (select(table.c.id).where(table.c.expires_at <= now)
+                   .order_by(table.c.expires_at).limit(self.batch_size))
+
+        with self.shards.begin(shard) as conn:
+            rows = conn.execute(
+                delete(table).where(table.c.id.in_(expired))
+                .returning(table.c.id, table.c.short_code, table.c.original_url, table.c.created_at,
+                           table.c.access_count, table.c.redirect_policy, table.c.expires_at)
+            ).all()
+            if not rows:
+                return 0
+
+            codes = [row.short_code for row in rows]
+            if self.archive is not None:
+                conn.execute(insert(self.archive), [
+                    {'short_url_id': row.id, 'short_code': row.short_code, 'original_url': row.original_url,
+                     'created_at': row.created_at, 'access_count': row.access_count,
+                     'redirect_policy': row.redirect_policy, 'expires_at': row.expires_at,
+                     'archived_at': now}
+                    for row in rows
+                ])
+            conn.execute(insert(self.tombstones).prefix_with('OR REPLACE'),
+                         [{'short_code': code, 'deleted_at': now} for code in codes])
+            for click_table in self.click_tables:
+                conn.execute(delete(click_table).where(click_table.c.short_code.in_(codes)))
+
+        self.batches += 1
+        return len(rows)
+
+    def start(self):
+        """Start the background sweep thread"""
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='expiry-sweep', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread, finishing the current batch"""
+        self._stopped.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        self._thread = None
+
+    def stats(self):
+        """Return sweep totals and the outcome of the last run"""
+        return {
+            'runs': self.runs,
+            'batches': self.batches,
+            'removed': self.removed,
+            'sweepSeconds': round(self.sweep_seconds, 6),
+            'lastRun': self.last_run,
+        }
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception('Expiry sweep failed')
@@ -0,0 +1,75 @@
+"""Country lookup from a local table of IP ranges
+
+The table is a CSV file with one ``start,end,country`` row per range, where
+``start`` and ``end`` are IPv4 or IPv6 addresses (or their integer values)
+and ``country`` is an ISO 3166 alpha-2 code, the layout of the common free
+"IP to country" downloads. Ranges are kept in sorted arrays per address
+family and looked up with a binary search.
+"""
+from array import array
+from bisect import bisect_right
+import csv
+import ipaddress
+
+
+def parse_address(value):
+    value = value.strip()
+    if value.isdigit():
+        number = int(value)
+        return ipaddress.ip_address(number) if number < 2 ** 32 else ipaddress.IPv6Address(number)
+    return ipaddress.ip_address(value)
+
+
+class GeoIPTable:
+    """Sorted, non-overlapping IP ranges mapped to country codes"""
+
+    def __init__(self, ranges=()):
+        # Per IP version: range starts, range ends and country codes
+        self._tables = {}
+        for version, rows in self._by_version(ranges).items():
+            rows.sort()
+            # IPv6 integers exceed 64 bits, so only IPv4 uses compact arrays
+            starts = array('Q', (row[0] for row in rows)) if version == 4 else [row[0] for row in rows]
+            ends = array('Q', (row[1] for row in rows)) if version == 4 else [row[1] for row in rows]
+            self._tables[version] = (starts, ends, [row[2] for row in rows])
+
+    @staticmethod
+    def _by_version(ranges):
+        by_version = {4: [], 6: []}
+        for start, end, country in ranges:
+            start, end = parse_address(str(start)), parse_address(str(end))
+            if start.version != end.version or int(end) < int(start):
+                raise ValueError(f'Invalid IP range {start} - {end}')
+            by_version[start.version].append((int(start), int(end), country.strip().upper()))
+        return by_version
+
+    @classmethod
+    def load(cls, path):
+        """Read a start,end,country CSV file; lines starting with # are skipped"""
+        with open(path, newline='') as handle:
+            rows = (row for row in csv.reader(handle) if row and not row[0].startswith('#'))
+            return cls((row[0], row[1], row[2]) for row in rows)
+
+    def __len__(self):
+        return sum(len(table[0]) for table in self._tables.values())
+
+    def country(self, address):
+        """Country code of address, or None if it is unknown or not an IP"""
+        if not address:
+            return None
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            return None
+        if ip.version == 6 and ip.ipv4_mapped is not None:
+            ip = ip.ipv4_mapped
+
+        table = self._tables.get(ip.version)
+        if not table:
+            return None
+        starts, ends, countries = table
+        number = int(ip)
+        index = bisect_right(starts, number) - 1
+        if index >= 0 and number <= ends[index]:
+            return countries[index]
+        return None
@@ -0,0 +1,26 @@
+"""Create or upgrade the database schema
+
+Usage:
+    python init.py
+
+Equivalent to ``flask --app app init-db``. Run it once for a new database
+and again after upgrading; it only adds missing tables, columns and indexes
+and backfills derived columns, so it is safe to repeat.
+"""
+import time
+
+from app import create_app, init_database
+
+
+def main():
+    start = time.perf_counter()
+    app = create_app()
+    added = init_database(app)
+    for table, column in added:
+        print(f'Added {table}.{column}')
+    print(f"Database ready at {app.config['SQLALCHEMY_DATABASE_URI']} "
+          f'in {time.perf_counter() - start:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+"""Most-clicked short URLs over all time and over the last hour and day
+
+Each window keeps a base of its top ``capacity`` codes as read from the
+database at the last reconciliation, and every redirect since then is
+counted in one shared space-saving sketch. A window's top N is the largest
+base + recent sums, so ``GET /top`` never scans ``short_urls``.
+
+Reconciliation (every ``reconcile_interval`` seconds, and on start) first
+flushes this worker's buffered counters, then reads each shard's top codes:
+all-time from the ``access_count`` index, windows from the minute and hour
+``click_buckets`` in range. That folds in clicks served by other workers,
+lets old clicks slide out of the windows, and rebuilds the leaderboard
+after a restart from a few index range scans.
+"""
+from datetime import datetime, timezone
+import heapq
+import logging
+import threading
+import time
+
+from sqlalchemy import text
+
+from analytics import DAY, HOUR, MINUTE, bucket_start
+
+logger = logging.getLogger(__name__)
+
+# Window name -> length in seconds (None is all time)
+WINDOWS = {'all': None, 'day': DAY, 'hour': HOUR}
+
+TOP_ALL_TIME = text(
+    'SELECT short_code, access_count FROM short_urls '
+    'WHERE expires_at IS NULL OR expires_at > :now '
+    'ORDER BY access_count DESC LIMIT :limit'
+)
+
+# Minute buckets cover the window unless retention already rolled them into hours
+TOP_IN_WINDOW = text(
+    'SELECT short_code, SUM(count) AS clicks FROM click_buckets '
+    'WHERE resolution IN (:minute, :hour) AND bucket_start >= :since '
+    'GROUP BY short_code ORDER BY clicks DESC LIMIT :limit'
+)
+
+
+class SpaceSaving:
+    """Approximate counts of the ``capacity`` most frequent keys in fixed memory
+
+    When a new key arrives and the table is full, the key with the smallest
+    count is evicted and the newcomer inherits that count, so estimates
+    never undercount by more than the evicted minimum. The minimum is found
+    through a min-heap whose stale entries are skipped lazily.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        self._heap = []
+
+    def add(self, key, amount=1):
+        counts = self.counts
+        if key in counts:
+            counts[key] += amount
+        elif len(counts) < self.capacity:
+            counts[key] = amount
+        else:
+            while True:
+                count, smallest = heapq.heappop(self._heap)
+                if counts.get(smallest) == count:
+                    break
+            del counts[smallest]
+            counts[key] = count + amount
+        heapq.heappush(self._heap, (counts[key], key))
+        if len(self._heap) > 4 * self.capacity:
+            # Drop stale entries before the heap outgrows the table
+            self._heap = [(count, key) for key, count in counts.items()]
+            heapq.heapify(self._heap)
+
+    def discard(self, key):
+        self.counts.pop(key, None)
+
+    def __len__(self):
+        return len(self.counts)
+
+
+class Leaderboard:
+    """Top-N short codes per window; ``shards`` is a ``shards.ShardSet``
+
+    ``buffers`` are the counter buffers (with a ``flush()`` method) whose
+    writes the reconciliation reads back: access counts and click buckets.
+    """
+
+    def __init__(self, shards, buffers=(), capacity=1000, reconcile_interval=60.0):
+        self.shards = shards
+        self.buffers = buffers
+        self.capacity = capacity
+        self.reconcile_interval = reconcile_interval
+        self._base = {window: {} for window in WINDOWS}
+        self._recent = SpaceSaving(capacity)
+        self._lock = threading.Lock()
+        self._reconcile_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.reconciled_at = None
+        self.reconciles = 0
+        self.reconcile_seconds = 0.0
+
+    def record(self, short_code):
+        """Count one click for short_code"""
+        with self._lock:
+            self._recent.add(short_code)
+
+    def discard(self, short_code):
+        """Forget a deleted short code"""
+        with self._lock:
+            self._recent.discard(short_code)
+            for base in self._base.values():
+                base.pop(short_code, None)
+
+    def top(self, window, limit):
+        """[(short_code, clicks)] of the limit most-clicked codes in window, largest first"""
+        with self._lock:
+            base = self._base[window]
+            recent = self._recent.counts
+            totals = dict(base)
+            for short_code, count in recent.items():
+                totals[short_code] = totals.get(short_code, 0) + count
+        return heapq.nlargest(limit, totals.items(), key=lambda item: (item[1], item[0]))
+
+    def reconcile(self, now=None):
+        """Rebuild every window from the database; returns the seconds it took"""
+        if now is None:
+            now = time.time()
+
+        with self._reconcile_lock:
+            start = time.perf_counter()
+            for buffer in self.buffers:
+                buffer.flush()
+
+            base = {window: {} for window in WINDOWS}
+            expires_now = datetime.fromtimestamp(now, timezone.utc).replace(tzinfo=None)
+            for shard in range(len(self.shards)):
+                with self.shards.begin(shard) as conn:
+                    for window, length in WINDOWS.items():
+                        if length is None:
+                            rows = conn.execute(TOP_ALL_TIME, {'now': expires_now, 'limit': self.capacity})
+                        else:
+                            rows = conn.execute(TOP_IN_WINDOW, {
+                                'minute': MINUTE, 'hour': HOUR, 'since': bucket_start(now - length, MINUTE),
+                                'limit': self.capacity,
+                            })
+                        base[window].update((short_code, count or 0) for short_code, count in rows)
+
+            for window, counts in base.items():
+                if len(counts) > self.capacity:
+                    base[window] = dict(heapq.nlargest(self.capacity, counts.items(), key=lambda item: item[1]))
+            # Swapped together so no click is in both the base and the sketch;
+            # clicks recorded since the flush are left out until the next run
+            with self._lock:
+                self._base = base
+                self._recent = SpaceSaving(self.capacity)
+
+            elapsed = time.perf_counter() - start
+            self.reconciled_at = datetime.fromtimestamp(now, timezone.utc)
+            self.reconciles += 1
+            self.reconcile_seconds += elapsed
+        logger.debug('Reconciled the top links leaderboard in %.3fs', elapsed)
+        return elapsed
+
+    def start(self):
+        """Reconcile now and then every reconcile_interval seconds in the background"""
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='top-links-reconcile', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread"""
+        self._stopped.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        self._thread = None
+
+    def stats(self):
+        return {
+            'trackedRecent': len(self._recent),
+            'reconciles': self.reconciles,
+            'reconcileSeconds': round(self.reconcile_seconds, 6),
+            'reconciledAt': self.reconciled_at.isoformat() if self.reconciled_at else None,
+        }
+
+    def _run(self):
+        while True:
+            try:
+                self.reconcile()
+            except Exception:
+                logger.exception('Top links reconciliation failed')
+            if self._stopped.wait(self.reconcile_interval):
+                return
@@ -0,0 +1,284 @@
+"""Low-overhead request/database instrumentation rendered as Prometheus text"""
+import bisect
+import cProfile
+import io
+import pstats
+import random
+import re
+import threading
+import time
+import weakref
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+# Latency buckets in seconds, from sub-millisecond cache hits to slow commits
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+_PLACEHOLDER_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def statement_label(statement, limit=120):
+    """Collapse a SQL statement into a bounded-cardinality label"""
+    statement = _PLACEHOLDER_LIST.sub('(?, ...)', statement)
+    statement = _WHITESPACE.sub(' ', statement).strip()
+    return statement if len(statement) <= limit else statement[:limit - 3] + '...'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labelnames, labels)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, labels=()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                    cumulative += bucket_count
+                    le = f'le="{bound}"'
+                    lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}')
+                label_text = _format_labels(self.labelnames, labels)
+                lines.append(f'{self.name}_sum{label_text} {total}')
+                lines.append(f'{self.name}_count{label_text} {count}')
+        return lines
+
+
+class CallbackMetric:
+    """Gauge or counter whose samples are read from a callback at scrape time"""
+
+    def __init__(self, name, documentation, callback, labelnames=(), kind='gauge'):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.labelnames = tuple(labelnames)
+        self.kind = kind
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        samples = self.callback()
+        if not isinstance(samples, dict):
+            samples = {(): samples}
+        for labels, value in sorted(samples.items()):
+            if value is not None:
+                lines.append(f'{self.name}{_format_labels(self.labelnames, labels)} {value}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, callback, labelnames=()):
+        return self.register(CallbackMetric(name, documentation, callback, labelnames))
+
+    def counter_callback(self, name, documentation, callback, labelnames=()):
+        return self.register(CallbackMetric(name, documentation, callback, labelnames, kind='counter'))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+class SamplingProfiler:
+    """cProfile a random sample of requests and aggregate the results
+
+    Off by default; ``configure()`` toggles it at runtime. Only sampled
+    requests pay the profiling overhead.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.sample_rate = 0.01
+        self.samples = 0
+        self._stats = None
+        self._lock = threading.Lock()
+
+    def configure(self, enabled=None, sample_rate=None):
+        if sample_rate is not None:
+            self.sample_rate = min(1.0, max(0.0, float(sample_rate)))
+        if enabled is not None:
+            self.enabled = bool(enabled)
+
+    def reset(self):
+        with self._lock:
+            self._stats = None
+            self.samples = 0
+
+    def start(self):
+        """Return a running profiler if this request is sampled, else None"""
+        if not self.enabled or random.random() >= self.sample_rate:
+            return None
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def stop(self, profiler):
+        profiler.disable()
+        with self._lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(profiler)
+            else:
+                self._stats.add(profiler)
+            self.samples += 1
+
+    def report(self, sort='cumulative', limit=50):
+        with self._lock:
+            if self._stats is None:
+                return 'No profiled requests yet\n'
+            output = io.StringIO()
+            self._stats.stream = output
+            self._stats.sort_stats(sort).print_stats(limit)
+            return f'{self.samples} sampled requests\n' + output.getvalue()
+
+
+def instrument(app, engines, registry, profiler=None):
+    """Record per-route latency, per-statement SQL latency, queries per request and commits
+
+    SQL statements are timed on every engine in ``engines`` (one per shard).
+    """
+    request_latency = registry.histogram(
+        'http_request_duration_seconds', 'Request latency by route', ('method', 'route', 'status'))
+    request_queries = registry.histogram(
+        'http_request_db_queries', 'SQL statements executed per request', ('route',),
+        buckets=QUERY_COUNT_BUCKETS)
+    statement_latency = registry.histogram(
+        'db_statement_duration_seconds', 'SQL statement latency', ('statement',))
+    commit_latency = registry.histogram(
+        'db_commit_duration_seconds', 'ORM session commit latency (flush plus COMMIT)')
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_start = time.perf_counter()
+        g.metrics_queries = 0
+        if profiler is not None:
+            g.metrics_profiler = profiler.start()
+
+    @app.after_request
+    def record_request(response):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return response
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        request_latency.observe(time.perf_counter() - start,
+                                (request.method, route, str(response.status_code)))
+        request_queries.observe(g.pop('metrics_queries', 0), (route,))
+        sampled = g.pop('metrics_profiler', None)
+        if sampled is not None:
+            profiler.stop(sampled)
+        return response
+
+    def start_statement_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_start', []).append(time.perf_counter())
+
+    def record_statement(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['metrics_start'].pop()
+        statement_latency.observe(time.perf_counter() - started, (statement_label(statement),))
+        if has_request_context() and 'metrics_queries' in g:
+            g.metrics_queries += 1
+
+    def discard_statement_timer(context):
+        if context.connection is not None and context.connection.info.get('metrics_start'):
+            context.connection.info['metrics_start'].pop()
+
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', start_statement_timer)
+        event.listen(engine, 'after_cursor_execute', record_statement)
+        event.listen(engine, 'handle_error', discard_statement_timer)
+        _commit_histograms[engine] = commit_latency
+
+    # Session events are class-wide, so they are registered once per process
+    if not event.contains(Session, 'before_commit', _start_commit_timer):
+        event.listen(Session, 'before_commit', _start_commit_timer)
+        event.listen(Session, 'after_commit', _record_commit)
+        event.listen(Session, 'after_rollback', _discard_commit_timer)
+
+
+# Commit latency histogram of each instrumented engine, so every app only
+# records the commits of its own sessions
+_commit_histograms = weakref.WeakKeyDictionary()
+
+
+def _start_commit_timer(session):
+    try:
+        bind = session.get_bind()
+    except (RuntimeError, SQLAlchemyError):
+        # Flask-SQLAlchemy sessions outside an app context, or unbound ones
+        return
+    histogram = _commit_histograms.get(getattr(bind, 'engine', bind))
+    if histogram is not None:
+        session.info['metrics_commit'] = (histogram, time.perf_counter())
+
+
+def _record_commit(session):
+    timer = session.info.pop('metrics_commit', None)
+    if timer is not None:
+        histogram, started = timer
+        histogram.observe(time.perf_counter() - started)
+
+
+def _discard_commit_timer(session):
+    session.info.pop('metrics_commit', None)
@@ -0,0 +1,59 @@
+from sqlalchemy import bindparam, inspect, select, text, update
+
+
+def upgrade_schema(engine, metadata):
+    """Bring tables created by older versions up to the current models
+
+    ``create_all()`` only creates missing tables, so columns and indexes added
+    to existing models are applied here. Only additive changes are supported:
+    new columns must be nullable or carry a server default. Returns the list
+    of (table, column) pairs that were added.
+    """
+    inspector = inspect(engine)
+    added = []
+    with engine.begin() as conn:
+        for table in metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}'
+                if column.server_default is not None:
+                    default = column.server_default.arg
+                    if isinstance(default, str):
+                        default = "'" + default.replace("'", "''") + "'"
+                    ddl += f' DEFAULT {default}'
+                conn.execute(text(ddl))
+                added.append((table.name, column.name))
+
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+    return added
+
+
+def backfill_column(connection, table, column, compute, batch_size=5000):
+    """Set column to compute(original_url) for rows stored before it existed
+
+    Rows are paged by id, so each batch is one index range scan however many
+    rows are left. Returns the number of rows updated.
+    """
+    target = table.c[column]
+    updated = 0
+    after = 0
+    while True:
+        rows = connection.execute(
+            select(table.c.id, table.c.original_url).where(target.is_(None), table.c.id > after)
+            .order_by(table.c.id).limit(batch_size)).all()
+        if not rows:
+            return updated
+        after = rows[-1][0]
+        connection.execute(
+            update(table).where(table.c.id == bindparam('row_id'))
+            # Keep updated_at as is so snapshot builds do not re-read every row
+            .values({column: bindparam('value'), 'updated_at': table.c.updated_at}),
+            [{'row_id': row_id, 'value': compute(url)} for row_id, url in rows])
+        connection.commit()
+        updated += len(rows)
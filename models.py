@@ -0,0 +1,168 @@
+from flask_sqlalchemy import SQLAlchemy
+from datetime import datetime, timezone
+import hashlib
+import time
+from urllib.parse import urlsplit, urlunsplit
+
+from sqlalchemy import bindparam, select
+
+from search import default_url_host
+
+# Bound to an application by create_app()
+db = SQLAlchemy()
+
+# Ports dropped from URLs before they are hashed for deduplication
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+# tracked: uncached 302 so every click is counted; permanent: cacheable 301/308
+REDIRECT_POLICIES = ('tracked', 'permanent')
+
+# Dimensions aggregated into click_dimensions
+CLICK_DIMENSIONS = ('referrer', 'country', 'agent')
+
+def expiry_timestamp(expires_at):
+    """Epoch seconds of a stored (naive UTC) expires_at, or None"""
+    if expires_at is None:
+        return None
+    return expires_at.replace(tzinfo=timezone.utc).timestamp()
+
+def naive_utc(value):
+    """A datetime as SQLite hands it back: naive UTC"""
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def normalize_url(url):
+    """Canonical form used for duplicate detection
+
+    Scheme and host are lower-cased, default ports are dropped and an empty
+    path becomes ``/``. Path, query and fragment are kept as submitted.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f'{host}:{parts.port}'
+    if parts.username is not None:
+        userinfo = parts.username + (f':{parts.password}' if parts.password is not None else '')
+        host = f'{userinfo}@{host}'
+    return urlunsplit((scheme, host, parts.path or '/', parts.query, parts.fragment))
+
+def url_hash(url):
+    """Fixed-width (32 hex characters) hash of the normalized URL, stored for every row"""
+    return hashlib.blake2b(normalize_url(url).encode('utf-8'), digest_size=16).hexdigest()
+
+def default_url_hash(context):
+    """Column default: hash of the normalized URL being inserted"""
+    return url_hash(context.get_current_parameters()['original_url'])
+
+# Model definition
+class ShortURL(db.Model):
+    __tablename__ = 'short_urls'
+
+    id = db.Column(db.Integer, primary_key=True)
+    original_url = db.Column(db.String(2048), nullable=False)
+    short_code = db.Column(db.String(10), unique=True, nullable=False)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc),
+                          onupdate=lambda: datetime.now(timezone.utc), index=True)
+    access_count = db.Column(db.Integer, default=0)
+    url_hash = db.Column(db.String(32), index=True, default=default_url_hash)
+    redirect_policy = db.Column(db.String(16), nullable=False, default='tracked', server_default='tracked')
+    expires_at = db.Column(db.DateTime)
+    host = db.Column(db.String(255), default=default_url_host)
+
+    # Partial index: only links that can expire are indexed for the sweeper
+    __table_args__ = (
+        db.Index('ix_short_urls_expires_at', 'expires_at', sqlite_where=db.text('expires_at IS NOT NULL')),
+        db.Index('ix_short_urls_host_created_at', 'host', 'created_at'),
+        # Lets the top links leaderboard reload the most-clicked rows without a scan
+        db.Index('ix_short_urls_access_count', 'access_count'),
+    )
+
+    def to_dict(self):
+        # Objects not reloaded since commit still hold the aware datetimes they were given
+        return {
+            'id': self.id,
+            'url': self.original_url,
+            'shortCode': self.short_code,
+            'createdAt': naive_utc(self.created_at).isoformat(),
+            'updatedAt': naive_utc(self.updated_at).isoformat(),
+            'accessCount': self.access_count,
+            'redirectPolicy': self.redirect_policy,
+            'expiresAt': naive_utc(self.expires_at).isoformat() if self.expires_at else None
+        }
+
+    def is_expired(self):
+        return self.expires_at is not None and expiry_timestamp(self.expires_at) <= time.time()
+
+    def __repr__(self):
+        return f'<ShortURL {self.short_code} -> {self.original_url}>'
+
+class CodeSequence(db.Model):
+    __tablename__ = 'code_sequences'
+
+    name = db.Column(db.String(32), primary_key=True)
+    next_value = db.Column(db.BigInteger, nullable=False, default=0)
+
+class ShortURLTombstone(db.Model):
+    __tablename__ = 'short_url_tombstones'
+
+    short_code = db.Column(db.String(10), primary_key=True)
+    deleted_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class ShortURLArchive(db.Model):
+    __tablename__ = 'short_url_archive'
+
+    id = db.Column(db.Integer, primary_key=True)
+    short_url_id = db.Column(db.Integer, nullable=False)
+    short_code = db.Column(db.String(10), nullable=False, index=True)
+    original_url = db.Column(db.String(2048), nullable=False)
+    created_at = db.Column(db.DateTime)
+    access_count = db.Column(db.Integer)
+    redirect_policy = db.Column(db.String(16))
+    expires_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, nullable=False)
+
+class ClickBucket(db.Model):
+    __tablename__ = 'click_buckets'
+    __table_args__ = (
+        db.Index('ix_click_buckets_resolution_start', 'resolution', 'bucket_start'),
+        {'sqlite_with_rowid': False},
+    )
+
+    short_code = db.Column(db.String(10), primary_key=True)
+    resolution = db.Column(db.Integer, primary_key=True)
+    bucket_start = db.Column(db.BigInteger, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+class ClickDimension(db.Model):
+    __tablename__ = 'click_dimensions'
+    __table_args__ = (
+        db.Index('ix_click_dimensions_day', 'day'),
+        {'sqlite_with_rowid': False},
+    )
+
+    # Daily click counts per referrer host, country and user agent family
+    short_code = db.Column(db.String(10), primary_key=True)
+    dimension = db.Column(db.String(16), primary_key=True)
+    day = db.Column(db.BigInteger, primary_key=True)
+    value = db.Column(db.String(255), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+class ClickLogSegment(db.Model):
+    __tablename__ = 'click_log_segments'
+
+    # Click log segments already folded into click_dimensions on this shard
+    name = db.Column(db.String(128), primary_key=True)
+    records = db.Column(db.Integer, nullable=False)
+    compacted_at = db.Column(db.DateTime, nullable=False)
+
+# Hot-path lookup built once so every cache miss reuses the compiled statement
+LOOKUP_ORIGINAL_URL = (select(ShortURL.original_url, ShortURL.redirect_policy == 'permanent', ShortURL.expires_at)
+                       .where(ShortURL.short_code == bindparam('short_code')))
+
+def redirect_target(row):
+    """Redirect cache entry for a LOOKUP_ORIGINAL_URL row: (url, permanent, expiry epoch or None)"""
+    original_url, permanent, expires_at = row
+    return original_url, bool(permanent), expiry_timestamp(expires_at)
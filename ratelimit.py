@@ -0,0 +1,246 @@
+"""Per-client token bucket rate limiting
+
+Every (limit, client) pair has a bucket of at most ``burst`` tokens that
+refills at ``rate`` tokens per second; a request takes its cost in tokens
+(one, or one per URL for batches) or is rejected with the time until enough
+are available. A bucket that has been idle long enough to refill completely
+is indistinguishable from a new one, so such buckets are evicted freely and
+memory stays proportional to the clients seen in the last ``burst / rate``
+seconds.
+
+Clients are the API keys listed in the configuration, sent in a request
+header, or else the remote address. Unknown keys are ignored, so rotating
+made-up keys neither buys fresh buckets nor floods the store.
+
+Two stores hold the buckets:
+
+``MemoryBucketStore``
+    per process, split into lock stripes so concurrent requests for
+    different clients rarely contend on the same lock.
+``SQLiteBucketStore``
+    a SQLite file shared by every worker on the host, so a client gets the
+    same limit however its requests are spread across processes.
+"""
+import heapq
+import logging
+import math
+import sqlite3
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+
+def take_token(tokens, updated, now, rate, burst, cost=1):
+    """Refill a bucket to now and try to take cost tokens
+
+    Returns (tokens left, allowed, seconds until cost tokens are available).
+    """
+    tokens = min(burst, tokens + (now - updated) * rate)
+    if tokens >= cost:
+        return tokens - cost, True, 0.0
+    return tokens, False, (cost - tokens) / rate
+
+
+def retry_after_header(seconds):
+    """Retry-After value: whole seconds, at least one"""
+    return str(max(1, math.ceil(seconds)))
+
+
+class MemoryBucketStore:
+    """Token buckets in process memory, sharded over ``stripes`` locks
+
+    Each stripe keeps at most ``max_keys / stripes`` buckets. A bucket
+    records when it will be full again under its own rate and burst; when a
+    stripe is full, buckets past that time are dropped, or failing that the
+    least recently used eighth of the stripe.
+    """
+
+    def __init__(self, stripes=64, max_keys=100000):
+        self.stripes = [(threading.Lock(), {}) for _ in range(stripes)]
+        self.stripe_capacity = max(1, max_keys // stripes)
+        self.evictions = 0
+
+    def take(self, key, rate, burst, now=None, cost=1):
+        """Take cost tokens for key; returns (allowed, retry after seconds)"""
+        if now is None:
+            now = time.monotonic()
+        lock, buckets = self.stripes[zlib.crc32(key.encode('utf-8')) % len(self.stripes)]
+        with lock:
+            bucket = buckets.get(key)
+            if bucket is None:
+                if len(buckets) >= self.stripe_capacity:
+                    self._evict(buckets, now)
+                # tokens, last update, time at which the bucket is full again
+                bucket = buckets[key] = [burst, now, now]
+            bucket[0], allowed, retry_after = take_token(bucket[0], bucket[1], now, rate, burst, cost)
+            bucket[1] = now
+            bucket[2] = now + (burst - bucket[0]) / rate
+        return allowed, retry_after
+
+    def peek(self, key, rate, burst, now=None):
+        """Tokens key could spend right now, without taking any"""
+        if now is None:
+            now = time.monotonic()
+        lock, buckets = self.stripes[zlib.crc32(key.encode('utf-8')) % len(self.stripes)]
+        with lock:
+            bucket = buckets.get(key)
+            if bucket is None:
+                return burst
+            return min(burst, bucket[0] + (now - bucket[1]) * rate)
+
+    def _evict(self, buckets, now):
+        # Buckets full again carry no state, whatever limit they belong to
+        stale = [key for key, (_, _, full_at) in buckets.items() if full_at <= now]
+        if not stale:
+            stale = heapq.nsmallest(max(1, len(buckets) // 8), buckets, key=lambda key: buckets[key][1])
+        for key in stale:
+            del buckets[key]
+        self.evictions += len(stale)
+
+    def __len__(self):
+        return sum(len(buckets) for _, buckets in self.stripes)
+
+
+class SQLiteBucketStore:
+    """Token buckets in a SQLite file shared by the worker processes of a host
+
+    Each take is one short ``BEGIN IMMEDIATE`` transaction on a per-thread
+    connection. Buckets idle for longer than ``idle_seconds`` are deleted
+    every ``sweep_every`` takes. If the file stays locked past the busy
+    timeout the request is let through rather than failed.
+    """
+
+    def __init__(self, path, idle_seconds=3600, sweep_every=10000):
+        self.path = path
+        self.idle_seconds = idle_seconds
+        self.sweep_every = sweep_every
+        self._local = threading.local()
+        self._takes = 0
+        self.evictions = 0
+        self.errors = 0
+        self._connection().execute('CREATE TABLE IF NOT EXISTS rate_limit_buckets ('
+                                   'key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL) WITHOUT ROWID')
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=OFF')
+        return conn
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def take(self, key, rate, burst, now=None, cost=1):
+        """Take cost tokens for key; returns (allowed, retry after seconds)"""
+        if now is None:
+            # Wall-clock time, since the file is shared between processes
+            now = time.time()
+        conn = self._connection()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT tokens, updated FROM rate_limit_buckets WHERE key = ?', (key,)).fetchone()
+            tokens, updated = row if row is not None else (burst, now)
+            tokens, allowed, retry_after = take_token(tokens, updated, now, rate, burst, cost)
+            conn.execute('INSERT OR REPLACE INTO rate_limit_buckets (key, tokens, updated) VALUES (?, ?, ?)',
+                         (key, tokens, now))
+            conn.execute('COMMIT')
+        except sqlite3.OperationalError as exc:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            # A busy or broken store must not take requests down with it
+            self.errors += 1
+            logger.warning('Rate limit store unavailable, allowing the request: %s', exc)
+            return True, 0.0
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+
+        self._takes += 1
+        if self._takes % self.sweep_every == 0:
+            self.sweep(now)
+        return allowed, retry_after
+
+    def peek(self, key, rate, burst, now=None):
+        """Tokens key could spend right now, without taking any"""
+        if now is None:
+            now = time.time()
+        try:
+            row = self._connection().execute('SELECT tokens, updated FROM rate_limit_buckets WHERE key = ?',
+                                             (key,)).fetchone()
+        except sqlite3.OperationalError as exc:
+            self.errors += 1
+            logger.warning('Rate limit store unavailable, allowing the request: %s', exc)
+            return burst
+        if row is None:
+            return burst
+        return min(burst, row[0] + (now - row[1]) * rate)
+
+    def sweep(self, now=None):
+        """Delete buckets idle for longer than idle_seconds"""
+        if now is None:
+            now = time.time()
+        removed = self._connection().execute('DELETE FROM rate_limit_buckets WHERE updated < ?',
+                                             (now - self.idle_seconds,)).rowcount
+        self.evictions += removed
+        return removed
+
+    def __len__(self):
+        return self._connection().execute('SELECT COUNT(*) FROM rate_limit_buckets').fetchone()[0]
+
+
+class RateLimiter:
+    """Named limits of (rate per second, burst) applied to client keys
+
+    A limit with a rate of 0 is off. ``api_keys`` are the keys that identify
+    a client on their own; any other key falls back to the remote address.
+    """
+
+    def __init__(self, limits, store, api_keys=()):
+        self.limits = {name: (rate, burst) for name, (rate, burst) in limits.items() if rate > 0}
+        self.store = store
+        self.api_keys = frozenset(api_keys)
+        self.allowed = {name: 0 for name in limits}
+        self.rejected = {name: 0 for name in limits}
+
+    def client(self, api_key, remote_addr):
+        """Bucket owner of a request: a configured API key, or else its address"""
+        if api_key and api_key in self.api_keys:
+            return f'key:{api_key}'
+        return f'ip:{remote_addr}'
+
+    def burst(self, limit):
+        """Largest cost a request can ever be granted under limit, or None if it is off"""
+        return self.limits[limit][1] if limit in self.limits else None
+
+    def check(self, limit, client, cost=1):
+        """(allowed, retry after seconds) for a request of client costing cost tokens under limit"""
+        if limit not in self.limits:
+            return True, 0.0
+        rate, burst = self.limits[limit]
+        allowed, retry_after = self.store.take(f'{limit}:{client}', rate, burst, cost=cost)
+        if allowed:
+            self.allowed[limit] += 1
+        else:
+            self.rejected[limit] += 1
+        return allowed, retry_after
+
+    def peek(self, limit, client, cost=1):
+        """Like check, but only tests that cost tokens are available without spending them
+
+        Lets expensive requests be refused before their body is read; an
+        allowed peek is not counted, the check that follows it is.
+        """
+        if limit not in self.limits:
+            return True, 0.0
+        rate, burst = self.limits[limit]
+        tokens = self.store.peek(f'{limit}:{client}', rate, burst)
+        if tokens >= cost:
+            return True, 0.0
+        self.rejected[limit] += 1
+        return False, (cost - tokens) / rate
@@ -0,0 +1,810 @@
+from flask import Blueprint, Response, abort, current_app, jsonify, redirect, render_template, request, stream_with_context
+from datetime import datetime, timezone
+from functools import wraps
+import hashlib
+import heapq
+import json
+import math
+import time
+import zlib
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.exc import IntegrityError, OperationalError
+from werkzeug.local import LocalProxy
+
+from analytics import DAY, GRANULARITIES, HOUR, MINUTE, bucket_start
+from models import (CLICK_DIMENSIONS, LOOKUP_ORIGINAL_URL, REDIRECT_POLICIES, ClickDimension, ShortURL,
+                    redirect_target, url_hash)
+from search import SORT_COLUMNS, decode_cursor, encode_cursor, search_statement, url_host
+
+# Short URL API and redirects, operational endpoints, and the web interface
+api = Blueprint('api', __name__)
+ops = Blueprint('ops', __name__)
+frontend = Blueprint('frontend', __name__)
+
+# The current app's Shortener (see app.py)
+shortener = LocalProxy(lambda: current_app.extensions['shortener'])
+
+# Attempts at inserting a new short URL before giving up on code collisions
+MAX_CODE_ATTEMPTS = 5
+
+# Default time range of a click series per granularity, and the largest series served
+STATS_DEFAULT_WINDOW = {MINUTE: HOUR, HOUR: 7 * DAY, DAY: 90 * DAY}
+STATS_MAX_BUCKETS = 10000
+
+# Most values returned by a stats breakdown
+STATS_BREAKDOWN_LIMIT = 50
+
+# Default and largest page size of a search
+SEARCH_DEFAULT_LIMIT = 50
+SEARCH_MAX_LIMIT = 500
+
+# Default and largest number of links returned by /top
+TOP_DEFAULT_LIMIT = 10
+TOP_MAX_LIMIT = 100
+
+# Utility functions
+def parse_timestamp(value):
+    """Parse an epoch-seconds or ISO 8601 query parameter into epoch seconds
+
+    Raises ValueError for NaN, infinities and times datetime cannot represent.
+    """
+    try:
+        timestamp = float(value)
+    except ValueError:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        try:
+            timestamp = parsed.timestamp()
+        except (OverflowError, OSError, ValueError):
+            raise ValueError('timestamp is out of range') from None
+
+    if not math.isfinite(timestamp):
+        raise ValueError('timestamp must be finite')
+    try:
+        datetime.fromtimestamp(timestamp, timezone.utc)
+    except (OverflowError, OSError, ValueError):
+        raise ValueError('timestamp is out of range') from None
+    return timestamp
+
+def parse_redirect_policy(data, default='tracked'):
+    """Read the optional redirectPolicy field of a request body"""
+    policy = data.get('redirectPolicy', default)
+    if policy not in REDIRECT_POLICIES:
+        raise ValueError('redirectPolicy must be tracked or permanent')
+    return policy
+
+def parse_expires_at(data, default=None):
+    """Read the optional expiresAt field of a request body; null means never"""
+    if 'expiresAt' not in data:
+        return default
+    if data['expiresAt'] is None:
+        return None
+    try:
+        timestamp = parse_timestamp(data['expiresAt'])
+        expires_at = datetime.fromtimestamp(timestamp, timezone.utc)
+    except (TypeError, ValueError, OverflowError, OSError):
+        raise ValueError('expiresAt must be epoch seconds or an ISO 8601 timestamp')
+    if timestamp <= time.time():
+        raise ValueError('expiresAt must be in the future')
+    return expires_at
+
+def short_url_etag(short_url, access_count, *extra):
+    """Validator for JSON views of a short URL
+
+    Access counts are written without touching updated_at, so they are part
+    of the tag alongside it.
+    """
+    parts = (short_url.id, short_url.updated_at.isoformat(), access_count) + extra
+    return hashlib.blake2b(repr(parts).encode('utf-8'), digest_size=12).hexdigest()
+
+def conditional_json(data, short_url, etag):
+    """JSON response carrying validators, or 304 if the client's copy is current"""
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(data)
+    response.set_etag(etag)
+    response.last_modified = short_url.updated_at.replace(tzinfo=timezone.utc)
+    response.cache_control.no_cache = True
+    return response
+
+def rate_limit_response(limit, cost=1, spend=True):
+    """429 with Retry-After if the client cannot spend cost tokens under limit, else None
+
+    With spend=False the tokens are only checked, not taken.
+    """
+    limiter = shortener.rate_limiter
+    if limiter is None:
+        return None
+    from ratelimit import retry_after_header
+
+    client = limiter.client(request.headers.get(current_app.config['RATE_LIMIT_KEY_HEADER']), request.remote_addr)
+    allowed, retry_after = (limiter.check if spend else limiter.peek)(limit, client, cost)
+    if allowed:
+        return None
+    response = jsonify({'error': 'Rate limit exceeded'})
+    response.status_code = 429
+    response.headers['Retry-After'] = retry_after_header(retry_after)
+    return response
+
+def rate_limited(limit):
+    """Answer 429 with Retry-After once the client runs out of tokens for limit"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            return rate_limit_response(limit) or view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def find_short_url(short_code):
+    """Load a short URL from its shard; returns (session, short URL or None)"""
+    session = shortener.session_for(short_code)
+    return session, session.scalars(select(ShortURL).where(ShortURL.short_code == short_code)).first()
+
+def allocate_short_codes(count):
+    """Generate count distinct short codes that are not in the database yet"""
+    codes = []
+    for _ in range(MAX_CODE_ATTEMPTS):
+        candidates = set(shortener.code_generator.next_codes(count - len(codes))) - set(codes)
+        taken = set()
+        for shard, group in shortener.shards.group(candidates, key=lambda code: code).items():
+            taken.update(shortener.session(shard).execute(
+                select(ShortURL.short_code).where(ShortURL.short_code.in_(group))).scalars())
+        codes.extend(candidates - taken)
+        if len(codes) == count:
+            return codes
+    raise RuntimeError('Could not allocate unique short codes')
+
+def read_batch_urls(limit):
+    """Parse a batch request body (JSON array or NDJSON) into a list of URLs"""
+    if request.mimetype in ('application/x-ndjson', 'application/ndjson', 'application/jsonl'):
+        items = []
+        for number, line in enumerate(request.stream, 1):
+            line = line.strip()
+            if line:
+                try:
+                    items.append(json.loads(line))
+                except ValueError as exc:
+                    raise ValueError(f'Line {number}: {exc}') from None
+            if len(items) > limit:
+                break
+    else:
+        items = request.get_json()
+        if isinstance(items, dict):
+            items = items.get('urls')
+
+    if not isinstance(items, list):
+        raise ValueError('Expected a JSON array or NDJSON stream of URLs')
+
+    return [item.get('url') if isinstance(item, dict) else item for item in items]
+
+def stream_all_urls(after, fmt):
+    """Yield every short URL after the given id as JSON array or NDJSON chunks"""
+    # One server-side cursor per shard, merged by id
+    urls = heapq.merge(*[
+        session.execute(
+            select(ShortURL).where(ShortURL.id > after).order_by(ShortURL.id)
+            .execution_options(yield_per=current_app.config['ALL_URLS_STREAM_BATCH'])
+        ).scalars()
+        for session in shortener.sessions()
+    ], key=lambda url: url.id)
+
+    if fmt == 'ndjson':
+        for url in urls:
+            yield json.dumps(url.to_dict()) + '\n'
+        return
+
+    yield '['
+    separator = ''
+    for url in urls:
+        yield separator + json.dumps(url.to_dict())
+        separator = ','
+    yield ']'
+
+# API Routes
+@api.route('/shorten', methods=['POST'])
+@rate_limited('create')
+def create_short_url():
+    """Create a new short URL"""
+    data = request.get_json()
+
+    if not data or 'url' not in data:
+        return jsonify({'error': 'URL is required'}), 400
+
+    url = data['url']
+
+    # Validate URL
+    is_valid, error_message = shortener.validate_url(url)
+    if not is_valid:
+        return jsonify({'error': error_message}), 400
+
+    try:
+        policy = parse_redirect_policy(data)
+        expires_at = parse_expires_at(data)
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+
+    # Reuse the existing short URL for an identical destination and policy;
+    # links with a lifetime are never shared
+    if shortener.url_deduplicator is not None and expires_at is None:
+        existing = shortener.url_deduplicator.find(shortener.sessions(), url, policy)
+        if existing is not None:
+            return jsonify(shortener.with_pending_count(existing)), 200
+
+    # Create new short URL; the unique constraint catches the rare collision
+    for _ in range(MAX_CODE_ATTEMPTS):
+        new_url = ShortURL(id=shortener.next_row_id(), original_url=url,
+                           short_code=shortener.code_generator.next_code(),
+                           redirect_policy=policy, expires_at=expires_at)
+        session = shortener.session_for(new_url.short_code)
+        session.add(new_url)
+        try:
+            session.commit()
+            break
+        except IntegrityError:
+            session.rollback()
+    else:
+        return jsonify({'error': 'Could not allocate a unique short code'}), 503
+
+    if shortener.url_deduplicator is not None:
+        shortener.url_deduplicator.add(new_url.url_hash)
+
+    return jsonify(new_url.to_dict()), 201
+
+@api.route('/shorten/batch', methods=['POST'])
+def create_short_urls_batch():
+    """Create short URLs for a JSON array or NDJSON stream of URLs"""
+    limit = current_app.config['BATCH_MAX_URLS']
+    chunk_size = current_app.config['BATCH_CHUNK_SIZE']
+
+    # Refuse clients without a token left before reading up to limit URLs
+    limited = rate_limit_response('batch', spend=False)
+    if limited is not None:
+        return limited
+
+    try:
+        urls = read_batch_urls(limit)
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+
+    if not urls:
+        return jsonify({'error': 'No URLs provided'}), 400
+    if len(urls) > limit:
+        return jsonify({'error': f'A batch may contain at most {limit} URLs'}), 413
+
+    # Every submitted URL costs a token of the batch limit
+    if shortener.rate_limiter is not None:
+        burst = shortener.rate_limiter.burst('batch')
+        if burst is not None and len(urls) > burst:
+            return jsonify({'error': f'A rate limited batch may contain at most {burst} URLs'}), 413
+        limited = rate_limit_response('batch', cost=len(urls))
+        if limited is not None:
+            return limited
+
+    # Validate everything up front; invalid items are reported, not fatal
+    results = []
+    valid = []
+    for index, (url, (is_valid, error_message)) in enumerate(zip(urls, shortener.url_validator.validate_many(urls))):
+        if is_valid:
+            results.append({'index': index, 'url': url})
+            valid.append(results[-1])
+        else:
+            results.append({'index': index, 'url': url, 'error': error_message})
+
+    hashes = {id(item): url_hash(item['url']) for item in valid}
+
+    # With dedup on, point repeats (stored or earlier in this batch) at one code
+    fresh = valid
+    repeats = []
+    if shortener.url_deduplicator is not None:
+        stored = {}
+        for start in range(0, len(valid), chunk_size):
+            # Batches create tracked links, so only tracked ones are reused
+            stored.update(shortener.url_deduplicator.find_many(
+                shortener.sessions(), [item['url'] for item in valid[start:start + chunk_size]], 'tracked'))
+
+        fresh = []
+        first_by_hash = {}
+        for item in valid:
+            if item['url'] in stored:
+                item['shortCode'] = stored[item['url']]
+                item['existing'] = True
+            elif hashes[id(item)] in first_by_hash:
+                repeats.append((item, first_by_hash[hashes[id(item)]]))
+            else:
+                first_by_hash[hashes[id(item)]] = item
+                fresh.append(item)
+
+    # Allocate codes for the whole batch before the write transactions start,
+    # then insert chunk by chunk into each shard and commit once every shard
+    # has taken its rows, so a code collision anywhere retries the whole batch
+    row_ids = shortener.next_row_ids(len(fresh))
+    for _ in range(MAX_CODE_ATTEMPTS):
+        for start in range(0, len(fresh), chunk_size):
+            chunk = fresh[start:start + chunk_size]
+            for item, code in zip(chunk, allocate_short_codes(len(chunk))):
+                item['shortCode'] = code
+
+        by_shard = shortener.shards.group(zip(fresh, row_ids), key=lambda pair: pair[0]['shortCode'])
+        sessions = [shortener.session(shard) for shard in by_shard]
+        try:
+            now = datetime.now(timezone.utc)
+            for session, rows in zip(sessions, by_shard.values()):
+                for start in range(0, len(rows), chunk_size):
+                    session.execute(insert(ShortURL), [
+                        {'id': row_id, 'original_url': item['url'], 'short_code': item['shortCode'],
+                         'url_hash': hashes[id(item)], 'created_at': now, 'updated_at': now,
+                         'access_count': 0}
+                        for item, row_id in rows[start:start + chunk_size]
+                    ])
+            for session in sessions:
+                session.commit()
+            break
+        except IntegrityError:
+            for session in sessions:
+                session.rollback()
+    else:
+        return jsonify({'error': 'Could not allocate unique short codes'}), 503
+
+    for item, first in repeats:
+        item['shortCode'] = first['shortCode']
+        item['existing'] = True
+    if shortener.url_deduplicator is not None:
+        for item in fresh:
+            shortener.url_deduplicator.add(hashes[id(item)])
+
+    created = len(fresh)
+    return jsonify({
+        'created': created,
+        'existing': len(valid) - created,
+        'failed': len(results) - len(valid),
+        'results': results
+    }), 201 if valid else 400
+
+@api.route('/shorten/<short_code>', methods=['GET'])
+def get_short_url(short_code):
+    """Retrieve original URL from short code"""
+    _, short_url = find_short_url(short_code)
+
+    if not short_url:
+        return jsonify({'error': 'Short URL not found'}), 404
+    if short_url.is_expired():
+        return jsonify({'error': 'Short URL has expired'}), 410
+
+    return conditional_json(short_url.to_dict(), short_url, short_url_etag(short_url, short_url.access_count))
+
+@api.route('/<short_code>')
+@rate_limited('redirect')
+def redirect_to_original(short_code):
+    """Redirect to original URL and track access count"""
+    # Cache and snapshot entries are (original_url, permanent, expires) with
+    # expires in epoch seconds or None
+    target = shortener.redirect_cache.get(short_code)
+
+    if target is None and shortener.redirect_snapshot is not None:
+        target = shortener.redirect_snapshot.lookup(short_code)
+
+    if target is None:
+        # Only codes newer than the snapshot (or unknown ones) reach the database
+        target = shortener.session_for(short_code).execute(LOOKUP_ORIGINAL_URL, {'short_code': short_code}).first()
+
+        if target is None:
+            return jsonify({'error': 'Short URL not found'}), 404
+
+        target = redirect_target(target)
+        shortener.redirect_cache.set(short_code, target)
+
+    original_url, permanent, expires = target
+    if expires is not None and expires <= time.time():
+        return jsonify({'error': 'Short URL has expired'}), 410
+
+    # Increment access count; flushed to the database in batches
+    shortener.access_counts.increment(short_code)
+    shortener.click_analytics.record(short_code)
+    if shortener.leaderboard is not None:
+        shortener.leaderboard.record(short_code)
+    if shortener.click_log is not None:
+        shortener.click_log.record(short_code, request.remote_addr, request.referrer,
+                                   request.headers.get('User-Agent'))
+
+    status, cache_control = shortener.redirect_headers(permanent, expires)
+    response = redirect(original_url, code=status)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+@api.route('/shorten/<short_code>', methods=['PUT'])
+def update_short_url(short_code):
+    """Update an existing short URL"""
+    session, short_url = find_short_url(short_code)
+
+    if not short_url:
+        return jsonify({'error': 'Short URL not found'}), 404
+
+    data = request.get_json()
+
+    # Each field may be changed on its own
+    if not data or ('url' not in data and 'redirectPolicy' not in data and 'expiresAt' not in data):
+        return jsonify({'error': 'URL is required'}), 400
+
+    new_url = data.get('url', short_url.original_url)
+
+    # Validate URL
+    is_valid, error_message = shortener.validate_url(new_url)
+    if not is_valid:
+        return jsonify({'error': error_message}), 400
+
+    try:
+        policy = parse_redirect_policy(data, default=short_url.redirect_policy)
+        expires_at = parse_expires_at(data, default=short_url.expires_at)
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+
+    # Update URL
+    short_url.original_url = new_url
+    short_url.url_hash = url_hash(new_url)
+    short_url.host = url_host(new_url)
+    short_url.redirect_policy = policy
+    short_url.expires_at = expires_at
+    session.commit()
+    if shortener.url_deduplicator is not None:
+        shortener.url_deduplicator.add(short_url.url_hash)
+    shortener.forget_cached(short_code)
+
+    return jsonify(short_url.to_dict()), 200
+
+@api.route('/shorten/<short_code>', methods=['DELETE'])
+def delete_short_url(short_code):
+    """Delete a short URL"""
+    session, short_url = find_short_url(short_code)
+
+    if not short_url:
+        return jsonify({'error': 'Short URL not found'}), 404
+
+    session.delete(short_url)
+    shortener.purge_short_code(session, short_code)
+    session.commit()
+    shortener.forget_cached(short_code)
+    shortener.access_counts.discard(short_code)
+    if shortener.leaderboard is not None:
+        shortener.leaderboard.discard(short_code)
+
+    return '', 204
+
+@api.route('/shorten/<short_code>/stats', methods=['GET'])
+def get_url_stats(short_code):
+    """Get statistics for a short URL
+
+    ``granularity`` (minute, hour or day) adds a click series for the
+    ``from``/``to`` range, given as epoch seconds or ISO 8601 timestamps.
+    ``breakdown`` (referrer, country or agent) adds the daily click log
+    aggregates over the same range, largest first.
+    """
+    session, short_url = find_short_url(short_code)
+
+    if not short_url:
+        return jsonify({'error': 'Short URL not found'}), 404
+
+    stats = shortener.with_pending_count(short_url)
+
+    granularity = request.args.get('granularity')
+    dimension = request.args.get('breakdown')
+    if granularity is None and dimension is None and 'from' not in request.args:
+        return conditional_json(stats, short_url, short_url_etag(short_url, stats['accessCount']))
+
+    if dimension is not None and dimension not in CLICK_DIMENSIONS:
+        return jsonify({'error': 'breakdown must be referrer, country or agent'}), 400
+
+    width = GRANULARITIES.get(granularity or ('day' if dimension else 'hour'))
+    if width is None:
+        return jsonify({'error': 'granularity must be minute, hour or day'}), 400
+
+    try:
+        # Without to the range ends with the current bucket, so the ETag holds until it closes
+        if 'to' in request.args:
+            end = parse_timestamp(request.args['to'])
+        else:
+            end = bucket_start(datetime.now(timezone.utc).timestamp(), width) + width
+        start = parse_timestamp(request.args['from']) if 'from' in request.args else end - STATS_DEFAULT_WINDOW[width]
+    except ValueError:
+        return jsonify({'error': 'from and to must be epoch seconds or ISO 8601 timestamps'}), 400
+
+    if start >= end or (end - start) / width > STATS_MAX_BUCKETS:
+        return jsonify({'error': f'Time range must be positive and span at most {STATS_MAX_BUCKETS} buckets'}), 400
+
+    breakdown = None
+    if dimension is not None:
+        # Compaction lags behind the access count, so the tag covers its total
+        breakdown = click_breakdown(session, short_code, dimension, start, end)
+
+    # Every click also bumps the access count, so it covers the series too
+    etag = short_url_etag(short_url, stats['accessCount'], width, start, end, dimension,
+                          breakdown and sum(row['count'] for row in breakdown))
+    if request.if_none_match.contains_weak(etag):
+        return conditional_json(None, short_url, etag)
+
+    if granularity is not None or dimension is None:
+        stats['clicks'] = {
+            'granularity': granularity or 'hour',
+            'from': datetime.fromtimestamp(start, timezone.utc).isoformat(),
+            'to': datetime.fromtimestamp(end, timezone.utc).isoformat(),
+            'series': [
+                {'start': datetime.fromtimestamp(bucket, timezone.utc).isoformat(), 'count': count}
+                for bucket, count in shortener.click_analytics.series(short_code, start, end, width)
+            ]
+        }
+    if breakdown is not None:
+        stats['breakdown'] = {
+            'dimension': dimension,
+            'from': datetime.fromtimestamp(bucket_start(start, DAY), timezone.utc).isoformat(),
+            'to': datetime.fromtimestamp(end, timezone.utc).isoformat(),
+            'values': breakdown,
+        }
+    return conditional_json(stats, short_url, etag)
+
+def click_breakdown(session, short_code, dimension, start, end):
+    """Click log aggregates of one dimension over whole days in [start, end)"""
+    clicks = func.sum(ClickDimension.count).label('clicks')
+    rows = session.execute(
+        select(ClickDimension.value, clicks)
+        .where(ClickDimension.short_code == short_code, ClickDimension.dimension == dimension,
+               ClickDimension.day >= bucket_start(start, DAY), ClickDimension.day < end)
+        .group_by(ClickDimension.value).order_by(clicks.desc(), ClickDimension.value)
+        .limit(STATS_BREAKDOWN_LIMIT))
+    return [{'value': value, 'count': count} for value, count in rows]
+
+@ops.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus text exposition of request, SQL and cache metrics"""
+    if not current_app.config['METRICS_ENABLED']:
+        return jsonify({'error': 'Metrics are disabled'}), 404
+
+    return Response(shortener.metrics_registry.render(), mimetype='text/plain; version=0.0.4')
+
+@ops.route('/debug/profile', methods=['GET', 'POST'])
+def request_profile():
+    """Show the sampled cProfile report, or toggle sampling with a JSON body
+
+    POST accepts ``{"enabled": bool, "sampleRate": float, "reset": bool}``.
+    """
+    if not current_app.config['PROFILER_ALLOWED'] or not current_app.config['METRICS_ENABLED']:
+        return jsonify({'error': 'Profiling is disabled'}), 404
+
+    if request.method == 'GET':
+        return Response(shortener.request_profiler.report(request.args.get('sort', 'cumulative')),
+                        mimetype='text/plain')
+
+    data = request.get_json(silent=True) or {}
+    try:
+        shortener.request_profiler.configure(enabled=data.get('enabled'), sample_rate=data.get('sampleRate'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'sampleRate must be a number'}), 400
+    if data.get('reset'):
+        shortener.request_profiler.reset()
+
+    return jsonify({
+        'enabled': shortener.request_profiler.enabled,
+        'sampleRate': shortener.request_profiler.sample_rate,
+        'samples': shortener.request_profiler.samples
+    }), 200
+
+@api.route('/search', methods=['GET'])
+def search_urls():
+    """Find short URLs by code or destination substring and by host
+
+    ``q`` matches any substring of at least three characters of the code or
+    URL (shorter ones match code prefixes) and ``host`` a destination host
+    exactly; at least one is required. Results are ordered by ``sort``
+    (created_at or access_count) and ``order`` (desc or asc) and paged with
+    the opaque ``nextCursor``.
+    """
+    query = request.args.get('q', '').strip()
+    host = request.args.get('host', '').strip().lower().rstrip('.')
+    if not query and not host:
+        return jsonify({'error': 'q or host is required'}), 400
+
+    sort = request.args.get('sort', 'created_at')
+    if sort not in SORT_COLUMNS:
+        return jsonify({'error': 'sort must be created_at or access_count'}), 400
+    order = request.args.get('order', 'desc')
+    if order not in ('asc', 'desc'):
+        return jsonify({'error': 'order must be asc or desc'}), 400
+    limit = request.args.get('limit', SEARCH_DEFAULT_LIMIT, type=int)
+    if limit < 1 or limit > SEARCH_MAX_LIMIT:
+        return jsonify({'error': f'limit must be between 1 and {SEARCH_MAX_LIMIT}'}), 400
+    try:
+        after = decode_cursor(request.args['cursor'], sort) if 'cursor' in request.args else None
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+
+    descending = order == 'desc'
+    statement = search_statement(ShortURL, query, host, sort, descending, after, limit + 1)
+    try:
+        # Each shard's first limit + 1 matches cover the merged page
+        urls = list(heapq.merge(*[session.execute(statement).scalars().all() for session in shortener.sessions()],
+                                key=lambda url: (getattr(url, sort), url.id), reverse=descending))[:limit + 1]
+    except OperationalError:
+        return jsonify({'error': 'Search index is unavailable; run init-db'}), 503
+
+    has_more = len(urls) > limit
+    urls = urls[:limit]
+    return jsonify({
+        'urls': [url.to_dict() for url in urls],
+        'nextCursor': encode_cursor(getattr(urls[-1], sort), urls[-1].id) if has_more else None
+    })
+
+@api.route('/top', methods=['GET'])
+def get_top_urls():
+    """Most-clicked short URLs over ``window`` (all, day or hour)
+
+    Served from the in-memory leaderboard; counts from other workers are
+    folded in at each reconciliation, reported as ``reconciledAt``.
+    """
+    if shortener.leaderboard is None:
+        return jsonify({'error': 'Top links are disabled'}), 404
+    from leaderboard import WINDOWS as TOP_WINDOWS
+
+    window = request.args.get('window', 'all')
+    if window not in TOP_WINDOWS:
+        return jsonify({'error': 'window must be all, day or hour'}), 400
+    limit = request.args.get('limit', TOP_DEFAULT_LIMIT, type=int)
+    if limit < 1 or limit > TOP_MAX_LIMIT:
+        return jsonify({'error': f'limit must be between 1 and {TOP_MAX_LIMIT}'}), 400
+
+    # Over-fetch: codes deleted by another worker stay counted until the next
+    # reconciliation and are dropped below
+    top = shortener.leaderboard.top(window, 2 * limit)
+    urls = {}
+    for shard, group in shortener.shards.group(top).items():
+        urls.update(shortener.session(shard).execute(
+            select(ShortURL.short_code, ShortURL.original_url)
+            .where(ShortURL.short_code.in_([short_code for short_code, _ in group]))).all())
+
+    reconciled_at = shortener.leaderboard.reconciled_at
+    return jsonify({
+        'window': window,
+        'reconciledAt': reconciled_at.isoformat() if reconciled_at else None,
+        'urls': [{'shortCode': short_code, 'url': urls[short_code], 'clicks': clicks}
+                 for short_code, clicks in top if short_code in urls][:limit]
+    })
+
+@api.route('/all-urls', methods=['GET'])
+def get_all_urls():
+    """Get short URLs ordered by id (for frontend display)
+
+    With ``limit`` a single keyset page after the ``after`` id is returned as
+    ``{"urls": [...], "nextCursor": <id or null>}``. Without it every row is
+    streamed from a server-side cursor, as a JSON array by default or as
+    NDJSON with ``format=ndjson``.
+    """
+    try:
+        after = int(request.args.get('after', 0))
+        limit = request.args.get('limit')
+        limit = None if limit is None else int(limit)
+    except ValueError:
+        return jsonify({'error': 'after and limit must be integers'}), 400
+
+    if limit is not None:
+        if limit < 1 or limit > current_app.config['ALL_URLS_MAX_PAGE_SIZE']:
+            return jsonify({'error': f"limit must be between 1 and {current_app.config['ALL_URLS_MAX_PAGE_SIZE']}"}), 400
+
+        # Each shard's first limit + 1 rows cover the merged page
+        urls = list(heapq.merge(*[
+            session.execute(
+                select(ShortURL).where(ShortURL.id > after).order_by(ShortURL.id).limit(limit + 1)
+            ).scalars().all()
+            for session in shortener.sessions()
+        ], key=lambda url: url.id))[:limit + 1]
+        has_more = len(urls) > limit
+        urls = urls[:limit]
+        return jsonify({
+            'urls': [url.to_dict() for url in urls],
+            'nextCursor': urls[-1].id if has_more else None
+        })
+
+    fmt = request.args.get('format', 'json')
+    if fmt not in ('json', 'ndjson'):
+        return jsonify({'error': 'format must be json or ndjson'}), 400
+
+    return Response(stream_with_context(stream_all_urls(after, fmt)),
+                    mimetype='application/x-ndjson' if fmt == 'ndjson' else 'application/json')
+
+
+@ops.route('/export', methods=['GET'])
+def export_urls():
+    """Stream every short URL after the ``after`` id as gzip-compressed NDJSON
+
+    ``compress=0`` streams plain NDJSON instead.
+    """
+    if not current_app.config['BULK_TRANSFER_ALLOWED']:
+        return jsonify({'error': 'Bulk transfer is disabled'}), 404
+    from transfer import export_lines, gzip_chunks
+
+    lines = export_lines(shortener.shards.engines, ShortURL.__table__, request.args.get('after', 0, type=int),
+                         batch_size=current_app.config['BULK_TRANSFER_BATCH'])
+    if request.args.get('compress') == '0':
+        return Response(lines, mimetype='application/x-ndjson')
+
+    response = Response(gzip_chunks(lines), mimetype='application/gzip')
+    response.headers['Content-Disposition'] = 'attachment; filename=short_urls.ndjson.gz'
+    return response
+
+@ops.route('/import', methods=['POST'])
+def import_urls():
+    """Load short URLs from an NDJSON export, read from the request body as it arrives
+
+    The body is gunzipped when sent as ``application/gzip`` or with
+    ``Content-Encoding: gzip``. ``conflict`` (skip, replace or fail) picks
+    what happens to short codes that already exist.
+    """
+    if not current_app.config['BULK_TRANSFER_ALLOWED']:
+        return jsonify({'error': 'Bulk transfer is disabled'}), 404
+    from transfer import gunzip_lines, import_lines
+
+    if request.mimetype == 'application/gzip' or request.content_encoding == 'gzip':
+        lines = gunzip_lines(iter(lambda: request.stream.read(64 << 10), b''))
+    else:
+        lines = request.stream
+
+    def forget_written(rows):
+        for row in rows:
+            shortener.forget_cached(row['short_code'])
+            if shortener.url_deduplicator is not None:
+                shortener.url_deduplicator.add(url_hash(row['original_url']))
+
+    try:
+        result = import_lines(shortener.shards, ShortURL.__table__, lines,
+                              conflict=request.args.get('conflict', 'skip'),
+                              batch_size=current_app.config['BULK_TRANSFER_BATCH'],
+                              row_ids=shortener.next_row_ids if shortener.row_ids is not None else None,
+                              on_written=forget_written, url_validator=shortener.url_validator)
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+    except IntegrityError:
+        return jsonify({'error': 'Short code already exists'}), 409
+    except zlib.error:
+        return jsonify({'error': 'Request body is not valid gzip'}), 400
+
+    return jsonify(result), 200
+
+
+# Frontend Routes
+@frontend.route('/')
+def index():
+    """Frontend interface"""
+    response = current_app.make_response(render_template('index.html'))
+    response.cache_control.no_cache = True
+    response.add_etag()
+    return response.make_conditional(request)
+
+@frontend.route('/static/<path:filename>')
+def static_asset(filename):
+    """Serve a static file, gzip-compressed when the client accepts it
+
+    Requests carrying the current ``v`` (content hash) from ``asset_url()``
+    are cacheable for a year; anything else must be revalidated.
+    """
+    asset = current_app.extensions['assets'].get(filename)
+    if asset is None:
+        abort(404)
+
+    compressed = asset.gzipped is not None and 'gzip' in request.accept_encodings
+    response = Response(asset.gzipped if compressed else asset.data, mimetype=asset.mimetype)
+    if compressed:
+        response.content_encoding = 'gzip'
+    if asset.gzipped is not None:
+        response.vary.add('Accept-Encoding')
+    response.set_etag(asset.version + ('-gzip' if compressed else ''))
+    if request.args.get('v') == asset.version:
+        response.cache_control.public = True
+        response.cache_control.max_age = 365 * 24 * 3600
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@frontend.app_template_global()
+def asset_url(filename):
+    """URL of a static file with its content hash, for far-future caching"""
+    return current_app.extensions['assets'].url(filename)
@@ -0,0 +1,122 @@
+"""Search over short URLs by code, destination substring and host
+
+Every shard keeps an FTS5 index of ``short_code`` and ``original_url`` with
+the trigram tokenizer, so any substring of three or more characters is an
+index lookup instead of a ``LIKE`` scan. The index is an external-content
+table over ``short_urls`` and triggers keep it in sync, which covers the
+API as well as batch creates, imports, resharding and the expiry sweeper.
+Access count flushes do not touch indexed columns and never fire them.
+
+Destination hosts are stored in ``short_urls.host``, indexed together with
+``created_at`` so a host's newest links page without a sort.
+"""
+import base64
+from datetime import datetime
+import json
+import logging
+from urllib.parse import urlsplit
+
+from sqlalchemy import column, inspect, select, text, tuple_
+from sqlalchemy.exc import OperationalError
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'short_urls_fts'
+
+SEARCH_INDEX_DDL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "short_code, original_url, content='short_urls', content_rowid='id', tokenize='trigram')",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert AFTER INSERT ON short_urls BEGIN "
+    f"INSERT INTO {FTS_TABLE} (rowid, short_code, original_url) VALUES (new.id, new.short_code, new.original_url); "
+    "END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON short_urls BEGIN "
+    f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, short_code, original_url) "
+    "VALUES ('delete', old.id, old.short_code, old.original_url); "
+    "END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update AFTER UPDATE OF short_code, original_url ON short_urls BEGIN "
+    f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, short_code, original_url) "
+    "VALUES ('delete', old.id, old.short_code, old.original_url); "
+    f"INSERT INTO {FTS_TABLE} (rowid, short_code, original_url) VALUES (new.id, new.short_code, new.original_url); "
+    "END",
+)
+
+# Shortest query the trigram index can answer; shorter ones match code prefixes
+MIN_SUBSTRING_LENGTH = 3
+
+SORT_COLUMNS = ('created_at', 'access_count')
+
+
+def url_host(url):
+    """Lowercased host of a URL, or None if it has none"""
+    try:
+        host = urlsplit(url).hostname
+    except ValueError:
+        return None
+    if not host:
+        return None
+    return host.rstrip('.')[:255] or None
+
+
+def default_url_host(context):
+    """Column default: host of the URL being inserted"""
+    return url_host(context.get_current_parameters()['original_url'])
+
+
+def install_search_index(engine):
+    """Create the FTS index and its triggers on a shard; returns False if SQLite lacks FTS5"""
+    created = not inspect(engine).has_table(FTS_TABLE)
+    try:
+        with engine.begin() as conn:
+            for statement in SEARCH_INDEX_DDL:
+                conn.execute(text(statement))
+            if created:
+                # Index the rows stored before the index existed
+                conn.execute(text(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('rebuild')"))
+    except OperationalError as exc:
+        logger.warning('Search index unavailable on %s: %s', engine.url, exc.orig)
+        return False
+    return True
+
+
+def encode_cursor(value, row_id):
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    return base64.urlsafe_b64encode(json.dumps([value, row_id]).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, sort):
+    """(sort value, id) of a search cursor; raises ValueError if it is malformed"""
+    try:
+        value, row_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if sort == 'created_at':
+            value = datetime.fromisoformat(value)
+        elif not isinstance(value, int):
+            raise TypeError
+        if not isinstance(row_id, int):
+            raise TypeError
+    except (TypeError, ValueError):
+        raise ValueError('cursor is invalid') from None
+    return value, row_id
+
+
+def search_statement(model, query=None, host=None, sort='created_at', descending=True, after=None, limit=50):
+    """Select up to limit rows of model matching query and host, in keyset order after (value, id)"""
+    sort_column = getattr(model, sort)
+    statement = select(model)
+    if query:
+        if len(query) >= MIN_SUBSTRING_LENGTH:
+            phrase = '"' + query.replace('"', '""') + '"'
+            matches = (text(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match')
+                       .bindparams(match=phrase).columns(column('rowid')))
+            statement = statement.where(model.id.in_(matches))
+        else:
+            # Range scan of the unique short_code index
+            statement = statement.where(model.short_code >= query, model.short_code < query + '\uffff')
+    if host:
+        statement = statement.where(model.host == host)
+    if after is not None:
+        key = tuple_(sort_column, model.id)
+        statement = statement.where(key < tuple_(*after) if descending else key > tuple_(*after))
+    if descending:
+        return statement.order_by(sort_column.desc(), model.id.desc()).limit(limit)
+    return statement.order_by(sort_column, model.id).limit(limit)
@@ -0,0 +1,197 @@
+"""Routing of short codes to SQLite shard databases
+
+Each short code lives in exactly one of ``SHARD_COUNT`` SQLite files, chosen
+by a stable hash of the code, so creates and click writes on different
+shards never wait on the same write lock. Shard 0 is the primary database
+(``DATABASE_URL``), which also keeps the global ``code_sequences``; shard
+``n`` is the file next to it named ``<name>.shard<n>.db``. With one shard
+everything stays in the primary database.
+
+Changing the number of shards moves most rows, so it is done offline with::
+
+    python shards.py reshard --to 8
+
+while no worker is running, after which every worker is restarted with
+``SHARD_COUNT=8``.
+"""
+import argparse
+from collections import defaultdict
+import hashlib
+import os
+import time
+
+from sqlalchemy import create_engine, delete, func, insert, inspect, select, text
+from sqlalchemy.engine import make_url
+
+from search import install_search_index
+
+# Tables keyed by short code; every other table stays in the primary database
+SHARDED_TABLES = ('short_urls', 'short_url_tombstones', 'short_url_archive', 'click_buckets',
+                  'click_dimensions')
+
+# Bookkeeping tables every shard has its own copy of; never moved between shards
+SHARD_LOCAL_TABLES = ('click_log_segments',)
+
+# Sequence that hands out short_urls.id values unique across shards
+ROW_ID_SEQUENCE = 'short_url_id'
+
+
+def shard_index(short_code, count):
+    """Shard owning short_code; stable across processes and restarts"""
+    if count == 1:
+        return 0
+    digest = hashlib.blake2b(short_code.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % count
+
+
+def shard_database_url(url, shard):
+    """Database URL of a shard, derived from the primary database URL"""
+    if shard == 0:
+        return url
+    url = make_url(url)
+    if not url.database or url.database == ':memory:':
+        return url.render_as_string(hide_password=False)
+    root, ext = os.path.splitext(url.database)
+    return url.set(database=f'{root}.shard{shard}{ext or ".db"}').render_as_string(hide_password=False)
+
+
+def sharded_tables(metadata):
+    """Tables of metadata that are split across shards"""
+    return [metadata.tables[name] for name in SHARDED_TABLES if name in metadata.tables]
+
+
+def shard_schema(metadata):
+    """Every table a shard database needs"""
+    return sharded_tables(metadata) + [metadata.tables[name] for name in SHARD_LOCAL_TABLES
+                                       if name in metadata.tables]
+
+
+class ShardSet:
+    """Engines of every shard, indexed by shard number (0 is the primary)"""
+
+    def __init__(self, engines):
+        self.engines = list(engines)
+
+    def __len__(self):
+        return len(self.engines)
+
+    def shard_for(self, short_code):
+        return shard_index(short_code, len(self.engines))
+
+    def engine_for(self, short_code):
+        return self.engines[self.shard_for(short_code)]
+
+    def begin(self, shard=0):
+        """Open a transactional connection on a shard"""
+        return self.engines[shard].begin()
+
+    def group(self, items, key=lambda item: item[0]):
+        """Split items into {shard: [item, ...]} by the short code key(item)"""
+        if len(self.engines) == 1:
+            return {0: list(items)}
+        groups = defaultdict(list)
+        for item in items:
+            groups[self.shard_for(key(item))].append(item)
+        return groups
+
+
+def sync_row_id_sequence(engines, short_urls):
+    """Move the global row ID sequence past the largest id on any shard"""
+    largest = 0
+    for engine in engines:
+        with engine.connect() as conn:
+            largest = max(largest, conn.execute(select(func.max(short_urls.c.id))).scalar() or 0)
+    with engines[0].begin() as conn:
+        conn.execute(text('INSERT OR IGNORE INTO code_sequences (name, next_value) VALUES (:name, 0)'),
+                      {'name': ROW_ID_SEQUENCE})
+        conn.execute(text('UPDATE code_sequences SET next_value = MAX(next_value, :value) WHERE name = :name'),
+                     {'name': ROW_ID_SEQUENCE, 'value': largest + 1})
+    return largest
+
+
+def reshard(engines, count, metadata, batch_size=1000):
+    """Move every row of the sharded tables to its shard under a new shard count
+
+    ``engines`` must cover every shard that currently holds data and every
+    shard of the new layout. Rows are copied to their new shard and then
+    deleted from the old one, one batch of short codes per transaction, so
+    an interrupted run can simply be repeated. Returns {table: rows moved}.
+    """
+    tables = sharded_tables(metadata)
+    for engine in engines[1:count]:
+        metadata.create_all(engine, tables=shard_schema(metadata))
+        # Before any row arrives, so the index triggers see every copy
+        install_search_index(engine)
+
+    moved = {}
+    for table in tables:
+        moved[table.name] = 0
+        # The archive has its own surrogate key per shard
+        columns = [column for column in table.columns
+                   if not (table.name == 'short_url_archive' and column.name == 'id')]
+        for source, engine in enumerate(engines):
+            if not inspect(engine).has_table(table.name):
+                continue
+            after = ''
+            while True:
+                with engine.connect() as conn:
+                    codes = conn.execute(
+                        select(table.c.short_code).distinct().where(table.c.short_code > after)
+                        .order_by(table.c.short_code).limit(batch_size)).scalars().all()
+                if not codes:
+                    break
+                after = codes[-1]
+
+                targets = defaultdict(list)
+                for code in codes:
+                    target = shard_index(code, count)
+                    if target != source:
+                        targets[target].append(code)
+
+                for target, target_codes in targets.items():
+                    with engine.connect() as conn:
+                        rows = [dict(row._mapping) for row in conn.execute(
+                            select(*columns).where(table.c.short_code.in_(target_codes)))]
+                    with engines[target].begin() as conn:
+                        conn.execute(insert(table).prefix_with('OR REPLACE'), rows)
+                    with engine.begin() as conn:
+                        conn.execute(delete(table).where(table.c.short_code.in_(target_codes)))
+                    moved[table.name] += len(rows)
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline tools for sharded storage')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    command = subparsers.add_parser('reshard', help='move rows to their shards under a new SHARD_COUNT')
+    command.add_argument('--to', type=int, required=True, dest='count', help='new number of shards')
+    command.add_argument('--from', type=int, dest='current',
+                         help='current number of shards (default: SHARD_COUNT)')
+    command.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+    if args.count < 1:
+        parser.error('--to must be at least 1')
+
+    from app import create_app, init_database
+    from models import ShortURL, db
+
+    app = create_app()
+    init_database(app)
+    current = args.current or app.config['SHARD_COUNT']
+    with app.app_context():
+        primary = db.engine.url.render_as_string(hide_password=False)
+    engines = [create_engine(shard_database_url(primary, shard)) for shard in range(max(current, args.count))]
+
+    start = time.perf_counter()
+    moved = reshard(engines, args.count, db.metadata, batch_size=args.batch_size)
+    sync_row_id_sequence(engines[:args.count], ShortURL.__table__)
+    for table, rows in moved.items():
+        print(f'{table}: moved {rows} rows')
+    print(f'Resharded from {current} to {args.count} shards in {time.perf_counter() - start:.2f}s; '
+          f'restart every worker with SHARD_COUNT={args.count}')
+    for shard in range(args.count, current):
+        print(f'{engines[shard].url.database} is now empty and can be removed')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,363 @@
+"""Memory-mapped, read-only snapshot of the short code -> URL mapping
+
+The snapshot is a single binary file::
+
+    header   magic, version, key width, generation (max id), updated_at
+             high-water mark, record count, offset of the URL blob
+    records  fixed-width (code, flags, url length, url offset, expiry), sorted
+             by code; expiry is epoch seconds or 0 for links that never expire
+    blob     UTF-8 URLs back to back
+
+Every worker maps the same file read-only, so the pages are shared through
+the OS page cache instead of being duplicated per process, and a lookup is
+a binary search over the mapped records. Files are replaced atomically, and
+readers re-map when they notice a new file.
+
+Build or refresh a snapshot with::
+
+    python snapshot.py build redirects.snap [--full]
+"""
+import argparse
+import heapq
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from contextlib import ExitStack
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import func, select
+from sqlalchemy.exc import SQLAlchemyError
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'URLSNAP\0'
+VERSION = 3
+KEY_WIDTH = 10
+
+HEADER = struct.Struct('<8sHHIQdQQ')
+RECORD = struct.Struct(f'<{KEY_WIDTH}sBxIQd')
+# Versions 1 and 2 have no expiry; version 1 had zeroed padding where the flags byte now sits
+LEGACY_RECORD = struct.Struct(f'<{KEY_WIDTH}sBxIQ')
+RECORDS = {1: LEGACY_RECORD, 2: LEGACY_RECORD, 3: RECORD}
+
+# Record flags
+PERMANENT = 1
+
+# Rows changed this close to the previous high-water mark are re-read, so a
+# transaction that committed late is never missed by an incremental build or
+# a dedup refresh
+OVERLAP = timedelta(seconds=60)
+
+
+class Snapshot:
+    """Read-only view over one snapshot file"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as handle:
+            self.stat = os.fstat(handle.fileno())
+            self._mm = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            (magic, version, key_width, _, self.generation, high_water,
+             self.count, self._blob_offset) = HEADER.unpack_from(self._mm, 0)
+        except struct.error:
+            self._mm.close()
+            raise
+        if magic != MAGIC or version not in RECORDS or key_width != KEY_WIDTH:
+            self._mm.close()
+            raise ValueError(f'{path} is not a version {VERSION} redirect snapshot')
+        if not HEADER.size + self.count * RECORDS[version].size <= self._blob_offset <= len(self._mm):
+            self._mm.close()
+            raise ValueError(f'{path} is truncated')
+        self.updated_high_water = datetime.fromtimestamp(high_water, timezone.utc) if high_water else None
+        self._record = RECORDS[version]
+
+    def _key(self, index):
+        start = HEADER.size + index * self._record.size
+        return self._mm[start:start + KEY_WIDTH]
+
+    def _entry(self, index):
+        fields = self._record.unpack_from(self._mm, HEADER.size + index * self._record.size)
+        key, flags, length, offset = fields[:4]
+        expires = fields[4] if len(fields) > 4 and fields[4] else None
+        start = self._blob_offset + offset
+        return key, self._mm[start:start + length].decode('utf-8'), bool(flags & PERMANENT), expires
+
+    def lookup(self, short_code):
+        """Return (url, permanent, expires) for short_code, or None if it is not in the snapshot"""
+        key = short_code.encode('ascii', 'ignore')
+        if len(key) > KEY_WIDTH or len(key) != len(short_code):
+            return None
+        key = key.ljust(KEY_WIDTH, b'\0')
+
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == self.count or self._key(low) != key:
+            return None
+
+        return self._entry(low)[1:]
+
+    def items(self):
+        """Yield (short_code, url, permanent, expires) tuples in code order"""
+        for index in range(self.count):
+            key, url, permanent, expires = self._entry(index)
+            yield key.rstrip(b'\0').decode('ascii'), url, permanent, expires
+
+    def close(self):
+        self._mm.close()
+
+
+class SnapshotReader:
+    """Process-wide handle that follows atomic replacements of a snapshot file
+
+    Codes updated or deleted by this process are masked until a newer file is
+    mapped, so a worker never serves a mapping it has just changed. Given the
+    ``shards`` and tables, every check also masks the codes any process has
+    changed since the build: rows past the snapshot's ``updated_at``
+    high-water mark and newer tombstones, both read from their indexes.
+    """
+
+    def __init__(self, path, check_interval=5.0, shards=None, short_urls=None, tombstones=None):
+        self.path = path
+        self.check_interval = check_interval
+        self.shards = shards
+        self.short_urls = short_urls
+        self.tombstones = tombstones
+        self.snapshot = None
+        self._masked = set()
+        self._changes_since = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, short_code):
+        """Return (url, permanent, expires) for short_code, or None to fall back to the database"""
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._reload(now)
+
+        snapshot = self.snapshot
+        if snapshot is None or short_code in self._masked:
+            self.misses += 1
+            return None
+
+        target = snapshot.lookup(short_code)
+        if target is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return target
+
+    def mask(self, short_code):
+        """Stop answering for short_code until the next snapshot is mapped"""
+        self._masked.add(short_code)
+
+    def _reload(self, now):
+        with self._lock:
+            if now < self._next_check:
+                return
+            self._next_check = now + self.check_interval
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                return
+
+            snapshot = self.snapshot
+            if snapshot is None or (stat.st_ino, stat.st_mtime_ns) != (snapshot.stat.st_ino, snapshot.stat.st_mtime_ns):
+                # The old mapping is left to the garbage collector so in-flight lookups finish safely
+                try:
+                    snapshot = Snapshot(self.path)
+                except (OSError, ValueError, struct.error) as exc:
+                    # Empty, truncated or foreign files are skipped until a good one replaces them
+                    logger.warning('Redirect snapshot unused, cannot read %s: %s', self.path, exc)
+                    self.snapshot = None
+                    return
+                masked = set()
+                since = snapshot.updated_high_water
+                since = since.replace(tzinfo=None) - OVERLAP if since is not None else None
+            else:
+                masked, since = self._masked, self._changes_since
+
+            # An empty snapshot (no high-water mark) answers nothing that could be stale
+            if self.shards is not None and since is not None:
+                checked = datetime.now(timezone.utc).replace(tzinfo=None)
+                try:
+                    masked |= self.changed_codes(since)
+                except SQLAlchemyError as exc:
+                    # Without the changes every answer could be stale; the next check retries
+                    logger.warning('Redirect snapshot unused, changed codes unavailable: %s', exc)
+                    self.snapshot = None
+                    return
+                since = checked - OVERLAP
+
+            self._masked, self._changes_since = masked, since
+            self.snapshot = snapshot
+
+    def changed_codes(self, since):
+        """Codes updated or deleted on any shard at or after since (naive UTC)"""
+        codes = set()
+        for shard in range(len(self.shards)):
+            with self.shards.begin(shard) as conn:
+                codes.update(conn.execute(select(self.short_urls.c.short_code)
+                                          .where(self.short_urls.c.updated_at >= since)).scalars())
+                codes.update(conn.execute(select(self.tombstones.c.short_code)
+                                          .where(self.tombstones.c.deleted_at >= since)).scalars())
+        return codes
+
+    def stats(self):
+        snapshot = self.snapshot
+        return {
+            'generation': snapshot.generation if snapshot else None,
+            'entries': snapshot.count if snapshot else 0,
+            'masked': len(self._masked),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+def write_snapshot(path, entries, generation, updated_high_water):
+    """Atomically write sorted (short_code, url, permanent, expires) entries to path"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix='.snapshot-', dir=directory)
+    blob_fd, blob_path = tempfile.mkstemp(prefix='.snapshot-blob-', dir=directory)
+    try:
+        count = 0
+        offset = 0
+        with os.fdopen(fd, 'wb') as out, os.fdopen(blob_fd, 'w+b') as blob:
+            out.write(b'\0' * HEADER.size)
+            for short_code, url, permanent, expires in entries:
+                encoded = url.encode('utf-8')
+                out.write(RECORD.pack(short_code.encode('ascii').ljust(KEY_WIDTH, b'\0'),
+                                      PERMANENT if permanent else 0, len(encoded), offset, expires or 0.0))
+                blob.write(encoded)
+                offset += len(encoded)
+                count += 1
+
+            blob_offset = out.tell()
+            blob.seek(0)
+            while True:
+                chunk = blob.read(1 << 20)
+                if not chunk:
+                    break
+                out.write(chunk)
+
+            high_water = updated_high_water.replace(tzinfo=timezone.utc).timestamp() if updated_high_water else 0.0
+            out.seek(0)
+            out.write(HEADER.pack(MAGIC, VERSION, KEY_WIDTH, 0, generation, high_water, count, blob_offset))
+            out.flush()
+            os.fsync(out.fileno())
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+    finally:
+        os.unlink(blob_path)
+    return count
+
+
+def merge_sorted(old, changed, removed):
+    """Merge old snapshot entries with changed rows, both sorted by code"""
+    changed = iter(changed)
+    pending = next(changed, None)
+    for entry in old:
+        short_code = entry[0]
+        while pending is not None and pending[0] < short_code:
+            yield pending
+            pending = next(changed, None)
+        if pending is not None and pending[0] == short_code:
+            continue
+        if short_code not in removed:
+            yield entry
+    while pending is not None:
+        yield pending
+        pending = next(changed, None)
+
+
+def build_snapshot(connections, short_urls, tombstones, path, full=False, batch_size=10000):
+    """Build path from the database, incrementally when a previous snapshot exists
+
+    ``connections`` holds one connection per shard; their rows are merged by
+    code. An incremental build re-reads only rows whose ``updated_at`` is
+    past the previous high-water mark and drops codes with newer tombstones.
+    Returns (entries written, whether the build was incremental).
+    """
+    previous = None
+    if not full and os.path.exists(path):
+        try:
+            previous = Snapshot(path)
+        except ValueError:
+            previous = None
+
+    # Both maxima are answered from the primary key and the updated_at index
+    maxima = [connection.execute(select(func.max(short_urls.c.id), func.max(short_urls.c.updated_at))).first()
+              for connection in connections]
+    generation = max((row[0] for row in maxima if row[0] is not None), default=None)
+    high_water = max((row[1] for row in maxima if row[1] is not None), default=None)
+
+    query = (select(short_urls.c.short_code, short_urls.c.original_url,
+                    short_urls.c.redirect_policy == 'permanent', short_urls.c.expires_at)
+             .order_by(short_urls.c.short_code))
+    removed = set()
+    if previous is not None and previous.updated_high_water is not None:
+        since = previous.updated_high_water.replace(tzinfo=None) - OVERLAP
+        query = query.where(short_urls.c.updated_at >= since)
+        for connection in connections:
+            removed.update(connection.execute(
+                select(tombstones.c.short_code).where(tombstones.c.deleted_at >= since)).scalars())
+
+    rows = heapq.merge(*[
+        ((code, url, bool(permanent), expires_at.replace(tzinfo=timezone.utc).timestamp() if expires_at else None)
+         for code, url, permanent, expires_at in connection.execution_options(yield_per=batch_size).execute(query))
+        for connection in connections
+    ], key=lambda entry: entry[0])
+    if previous is None:
+        entries = rows
+    else:
+        entries = merge_sorted(previous.items(), rows, removed)
+
+    try:
+        count = write_snapshot(path, entries, generation or 0, high_water)
+    finally:
+        if previous is not None:
+            previous.close()
+    return count, previous is not None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the memory-mapped redirect snapshot')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help='build or incrementally refresh a snapshot')
+    build.add_argument('path')
+    build.add_argument('--full', action='store_true', help='ignore any existing snapshot')
+    args = parser.parse_args()
+
+    from app import create_app
+    from models import ShortURL, ShortURLTombstone
+
+    app = create_app()
+    shards = app.extensions['shortener'].shards
+
+    start = time.perf_counter()
+    with ExitStack() as stack:
+        connections = [stack.enter_context(engine.connect()) for engine in shards.engines]
+        count, incremental = build_snapshot(connections, ShortURL.__table__,
+                                            ShortURLTombstone.__table__, args.path, full=args.full)
+    print(f"Wrote {count} entries to {args.path} ({'incremental' if incremental else 'full'}) "
+          f'in {time.perf_counter() - start:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+from sqlalchemy import event
+
+# Named storage profiles: PRAGMAs run on every new connection plus pool sizing
+PROFILES = {
+    'default': {
+        'pragmas': {},
+        'pool': {},
+    },
+    'tuned': {
+        'pragmas': {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'mmap_size': 256 * 1024 * 1024,
+            'cache_size': -64 * 1024,
+            'busy_timeout': 5000,
+            'temp_store': 'MEMORY',
+        },
+        'pool': {
+            'pool_size': 10,
+            'max_overflow': 20,
+            'pool_timeout': 30,
+        },
+    },
+}
+
+
+def resolve_profile(name, overrides=None):
+    """Return (pragmas, pool options) for a profile with per-key overrides applied"""
+    if name not in PROFILES:
+        raise ValueError(f'Unknown SQLite profile: {name!r}')
+
+    pragmas = dict(PROFILES[name]['pragmas'])
+    pool = dict(PROFILES[name]['pool'])
+    for key, value in (overrides or {}).items():
+        if value is None:
+            continue
+        if key in ('pool_size', 'max_overflow', 'pool_timeout'):
+            pool[key] = value
+        else:
+            pragmas[key] = value
+    return pragmas, pool
+
+
+def apply_pragmas(engine, pragmas):
+    """Run the given PRAGMAs on every connection the engine opens"""
+    if not pragmas or engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for key, value in pragmas.items():
+                cursor.execute(f'PRAGMA {key} = {value}')
+        finally:
+            cursor.close()
@@ -5,7 +5,7 @@ document.getElementById('createForm').addEventListener('submit', async (e) => {
     e.preventDefault();
     const url = document.getElementById('originalUrl').value;
     const resultDiv = document.getElementById('createResult');
-    
+
     try {
         const response = await fetch('/shorten', {
             method: 'POST',
@@ -14,9 +14,9 @@ document.getElementById('createForm').addEventListener('submit', async (e) => {
             },
             body: JSON.stringify({ url })
         });
-        
+
         const data = await response.json();
-        
+
         if (response.ok) {
             resultDiv.innerHTML = `
                 <div class="result success">
@@ -40,11 +40,11 @@ document.getElementById('getForm').addEventListener('submit', async (e) => {
     e.preventDefault();
     const shortCode = document.getElementById('shortCodeGet').value;
     const resultDiv = document.getElementById('getResult');
-    
+
     try {
         const response = await fetch(`/shorten/${shortCode}`);
         const data = await response.json();
-        
+
         if (response.ok) {
             resultDiv.innerHTML = `
                 <div class="result success">
@@ -69,7 +69,7 @@ document.getElementById('updateForm').addEventListener('submit', async (e) => {
     const shortCode = document.getElementById('shortCodeUpdate').value;
     const newUrl = document.getElementById('newUrl').value;
     const resultDiv = document.getElementById('updateResult');
-    
+
     try {
         const response = await fetch(`/shorten/${shortCode}`, {
             method: 'PUT',
@@ -78,9 +78,9 @@ document.getElementById('updateForm').addEventListener('submit', async (e) => {
             },
             body: JSON.stringify({ url: newUrl })
         });
-        
+
         const data = await response.json();
-        
+
         if (response.ok) {
             resultDiv.innerHTML = `
                 <div class="result success">
@@ -104,12 +104,12 @@ document.getElementById('deleteForm').addEventListener('submit', async (e) => {
     e.preventDefault();
     const shortCode = document.getElementById('shortCodeDelete').value;
     const resultDiv = document.getElementById('deleteResult');
-    
+
     try {
         const response = await fetch(`/shorten/${shortCode}`, {
             method: 'DELETE'
         });
-        
+
         if (response.status === 204) {
             resultDiv.innerHTML = `<div class="result success">Short URL "${shortCode}" deleted successfully!</div>`;
             document.getElementById('deleteForm').reset();
@@ -127,11 +127,11 @@ document.getElementById('statsForm').addEventListener('submit', async (e) => {
     e.preventDefault();
     const shortCode = document.getElementById('shortCodeStats').value;
     const resultDiv = document.getElementById('statsResult');
-    
+
     try {
         const response = await fetch(`/shorten/${shortCode}/stats`);
         const data = await response.json();
-        
+
         if (response.ok) {
             resultDiv.innerHTML = `
                 <div class="result success">
@@ -150,21 +150,64 @@ document.getElementById('statsForm').addEventListener('submit', async (e) => {
     }
 });
 
-// Load all URLs
+// Load all URLs, one keyset page at a time
+const PAGE_SIZE = 100;
+let nextCursor = null;
+
+function renderUrlItem(url) {
+    return `
+        <div class="url-item">
+            <strong>${url.shortCode}</strong><br>
+            Original: ${url.url}<br>
+            Access Count: ${url.accessCount}<br>
+            Created: ${new Date(url.createdAt).toLocaleString()}<br>
+            <a href="/${url.shortCode}" target="_blank">Visit</a> | 
+            <a href="/shorten/${url.shortCode}/stats" target="_blank">Stats</a>
+        </div>
+    `;
+}
+
 async function loadAllURLs() {
     const resultDiv = document.getElementById('allUrls');
     resultDiv.innerHTML = '<div class="result info">Loading...</div>';
-    
+    nextCursor = null;
+    await loadURLPage(true);
+}
+
+async function loadMoreURLs() {
+    await loadURLPage(false);
+}
+
+async function loadURLPage(firstPage) {
+    const resultDiv = document.getElementById('allUrls');
+    const params = new URLSearchParams({ limit: PAGE_SIZE });
+    if (nextCursor !== null) {
+        params.set('after', nextCursor);
+    }
+
     try {
-        // Since we don't have a dedicated endpoint for all URLs, we'll simulate by showing recent ones
-        // In a real application, you'd have a proper endpoint for this
-        resultDiv.innerHTML = `
-            <div class="result info">
-                Individual URL operations are working. For a complete list of all URLs, 
-                you would need to implement a dedicated endpoint in the backend.
-            </div>
-        `;
+        const response = await fetch(`/all-urls?${params}`);
+        const data = await response.json();
+
+        if (response.ok) {
+            if (firstPage && data.urls.length === 0) {
+                resultDiv.innerHTML = '<div class="result info">No URLs found. Create your first short URL!</div>';
+                return;
+            }
+
+            if (firstPage) {
+                resultDiv.innerHTML = `
+                    <div class="result success" id="urlList"></div>
+                    <button id="loadMoreUrls" onclick="loadMoreURLs()">Load More</button>
+                `;
+            }
+            document.getElementById('urlList').insertAdjacentHTML('beforeend', data.urls.map(renderUrlItem).join(''));
+            nextCursor = data.nextCursor;
+            document.getElementById('loadMoreUrls').style.display = nextCursor === null ? 'none' : '';
+        } else {
+            resultDiv.innerHTML = `<div class="result error">Error: ${data.error}</div>`;
+        }
     } catch (error) {
         resultDiv.innerHTML = `<div class="result error">Error: ${error.message}</div>`;
     }
-}
\ No newline at end of file
+}
@@ -0,0 +1,121 @@
+"""Short code uniqueness: the shuffle is a bijection, base62 round-trips and
+block allocation never hands out an ID twice
+"""
+import random
+
+import pytest
+
+from codegen import (ALPHABET, BASE, IdBlockAllocator, SequentialCodeGenerator, ShuffledCodeGenerator,
+                     base62_decode, base62_encode, make_code_generator)
+
+
+class FakeSequence:
+    """In-memory stand-in for the code_sequences row behind reserve_id_block"""
+
+    def __init__(self):
+        self.next_value = 0
+        self.calls = []
+
+    def reserve(self, size):
+        self.calls.append(size)
+        start = self.next_value
+        self.next_value += size
+        return start
+
+
+@pytest.mark.parametrize('secret', ['url-shortener', 'another secret', b'\x00bytes'])
+def test_permute_is_a_bijection_on_two_character_codes(secret):
+    generator = ShuffledCodeGenerator(None, secret, length=2)
+    assert generator.domain == BASE ** 2 == 3844
+    images = [generator.permute(number) for number in range(generator.domain)]
+    assert sorted(images) == list(range(generator.domain))
+
+
+def test_permute_depends_on_the_secret():
+    first = ShuffledCodeGenerator(None, 'one', length=2)
+    second = ShuffledCodeGenerator(None, 'two', length=2)
+    assert [first.permute(n) for n in range(100)] != [second.permute(n) for n in range(100)]
+
+
+def test_permute_rejects_ids_outside_the_keyspace():
+    generator = ShuffledCodeGenerator(None, 'secret', length=2)
+    for number in (-1, generator.domain, generator.domain + 1):
+        with pytest.raises(ValueError):
+            generator.permute(number)
+
+
+def test_shuffled_codes_are_fixed_length_and_unique():
+    sequence = FakeSequence()
+    generator = ShuffledCodeGenerator(IdBlockAllocator(sequence.reserve, block_size=100), 'secret', length=2)
+    codes = [generator.next_code() for _ in range(50)] + generator.next_codes(BASE ** 2 - 50)
+    assert all(len(code) == 2 for code in codes)
+    assert len(set(codes)) == BASE ** 2
+
+
+def test_base62_round_trips():
+    rng = random.Random(62)
+    numbers = list(range(200)) + [BASE ** k + d for k in range(1, 12) for d in (-1, 0, 1)]
+    numbers += [rng.randrange(BASE ** 10) for _ in range(1000)]
+    for number in numbers:
+        assert base62_decode(base62_encode(number)) == number
+        padded = base62_encode(number, 8)
+        assert len(padded) >= 8 and base62_decode(padded) == number
+
+
+def test_base62_encoding_edges():
+    assert base62_encode(0) == ALPHABET[0]
+    assert base62_encode(BASE - 1) == ALPHABET[-1]
+    assert base62_encode(BASE) == ALPHABET[1] + ALPHABET[0]
+    assert base62_encode(5, 3) == ALPHABET[0] * 2 + ALPHABET[5]
+    with pytest.raises(ValueError):
+        base62_encode(-1)
+
+
+@pytest.mark.parametrize('counts', [[1] * 25, [3, 7, 10, 1, 9], [25], [4, 30, 2, 11]])
+def test_next_ids_across_block_boundaries(counts):
+    sequence = FakeSequence()
+    allocator = IdBlockAllocator(sequence.reserve, block_size=10)
+    ids = []
+    for count in counts:
+        batch = allocator.next_ids(count)
+        assert len(batch) == count
+        ids.extend(batch)
+    assert ids == sorted(set(ids))
+    assert set(ids) <= set(range(sequence.next_value))
+
+
+def test_next_ids_reserves_one_block_per_refill():
+    sequence = FakeSequence()
+    allocator = IdBlockAllocator(sequence.reserve, block_size=10)
+    assert [allocator.next_id() for _ in range(10)] == list(range(10))
+    assert sequence.calls == [10]
+    assert allocator.next_ids(3) == [10, 11, 12]
+    assert sequence.calls == [10, 10]
+    # A request larger than a block drains the current one, then reserves the rest in one go
+    assert allocator.next_ids(30) == list(range(13, 43))
+    assert sequence.calls == [10, 10, 23]
+
+
+def test_allocators_sharing_a_sequence_never_overlap():
+    sequence = FakeSequence()
+    allocators = [IdBlockAllocator(sequence.reserve, block_size=7) for _ in range(3)]
+    rng = random.Random(3)
+    ids = []
+    for _ in range(200):
+        ids.extend(rng.choice(allocators).next_ids(rng.randint(1, 9)))
+    assert len(ids) == len(set(ids))
+
+
+def test_sequential_codes_have_the_minimum_length():
+    sequence = FakeSequence()
+    generator = SequentialCodeGenerator(IdBlockAllocator(sequence.reserve, block_size=5), length=3)
+    codes = generator.next_codes(12)
+    assert all(len(code) == 3 for code in codes)
+    assert [base62_decode(code) - BASE ** 2 for code in codes] == list(range(12))
+
+
+def test_make_code_generator_rejects_unknown_strategies():
+    with pytest.raises(ValueError):
+        make_code_generator('sorted', reserve_block=FakeSequence().reserve)
+    with pytest.raises(ValueError):
+        make_code_generator('shuffle')
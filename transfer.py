@@ -0,0 +1,217 @@
+"""Streaming export and import of the short URL table as NDJSON
+
+One JSON object per line and row, in id order across every shard::
+
+    {"id": 1, "short_code": "aB3", "original_url": "https://...", "created_at": "...",
+     "updated_at": "...", "access_count": 7, "redirect_policy": "tracked", "expires_at": null}
+
+Files ending in ``.gz`` (and request or response bodies of type
+``application/gzip``) are gzip-compressed. Both directions work batch by
+batch from server-side cursors and line iterators, so memory use does not
+grow with the number of rows.
+
+Imported rows get new ids, since ids are only unique per database, and an
+``updated_at`` of the import time so incremental snapshot builds pick them
+up. Existing short codes are skipped, replaced or fail the import.
+Destinations are validated like those of new links, so an import cannot
+add or redirect to targets the API would refuse.
+"""
+from contextlib import ExitStack
+from datetime import datetime, timezone
+import heapq
+import json
+import logging
+import time
+import zlib
+
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert
+
+from models import REDIRECT_POLICIES
+from validation import UrlValidator
+
+logger = logging.getLogger(__name__)
+
+EXPORT_COLUMNS = ('id', 'short_code', 'original_url', 'created_at', 'updated_at', 'access_count',
+                  'redirect_policy', 'expires_at')
+
+# What to do when an imported short code already exists
+CONFLICT_MODES = ('skip', 'replace', 'fail')
+
+# Columns overwritten by a replacing import; the id and short_code stay put
+REPLACED_COLUMNS = ('original_url', 'created_at', 'updated_at', 'access_count', 'url_hash', 'host',
+                    'redirect_policy', 'expires_at')
+
+MAX_CODE_LENGTH = 10
+
+
+def export_lines(engines, short_urls, after=0, batch_size=1000):
+    """Yield one NDJSON line per short URL after the given id, merged by id across engines"""
+    start = time.perf_counter()
+    count = 0
+    columns = [short_urls.c[name] for name in EXPORT_COLUMNS]
+    query = select(*columns).where(short_urls.c.id > after).order_by(short_urls.c.id)
+    with ExitStack() as stack:
+        connections = [stack.enter_context(engine.connect()) for engine in engines]
+        rows = heapq.merge(*[
+            connection.execution_options(yield_per=batch_size).execute(query)
+            for connection in connections
+        ], key=lambda row: row.id)
+        for row in rows:
+            count += 1
+            yield json.dumps({name: value.isoformat() if isinstance(value, datetime) else value
+                              for name, value in zip(EXPORT_COLUMNS, row)}, separators=(',', ':')) + '\n'
+
+    elapsed = time.perf_counter() - start
+    logger.info('Exported %d short URLs in %.2fs (%.0f rows/s)', count, elapsed, count / elapsed if elapsed else 0)
+
+
+def gzip_chunks(lines, level=6, chunk_size=64 << 10):
+    """Gzip-compress an iterable of text lines into chunks of bytes"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    pending = []
+    size = 0
+    for line in lines:
+        pending.append(line.encode('utf-8'))
+        size += len(pending[-1])
+        if size >= chunk_size:
+            chunk = compressor.compress(b''.join(pending))
+            pending, size = [], 0
+            if chunk:
+                yield chunk
+    yield compressor.compress(b''.join(pending)) + compressor.flush()
+
+
+def parse_datetime(value, field):
+    """Naive UTC datetime of an ISO 8601 field, as the models store them"""
+    if value is None:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{field} must be an ISO 8601 timestamp') from None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def parse_line(line, now):
+    """Insert parameters of one exported row, given as text or UTF-8 bytes"""
+    item = json.loads(line)
+    if not isinstance(item, dict):
+        raise ValueError('expected a JSON object')
+    short_code, original_url = item.get('short_code'), item.get('original_url')
+    if not isinstance(short_code, str) or not 0 < len(short_code) <= MAX_CODE_LENGTH:
+        raise ValueError(f'short_code must be a string of 1 to {MAX_CODE_LENGTH} characters')
+    if not isinstance(original_url, str) or not original_url:
+        raise ValueError('original_url is required')
+    access_count = item.get('access_count') or 0
+    if not isinstance(access_count, int):
+        raise ValueError('access_count must be an integer')
+    redirect_policy = item.get('redirect_policy') or 'tracked'
+    if redirect_policy not in REDIRECT_POLICIES:
+        raise ValueError(f"redirect_policy must be one of {', '.join(REDIRECT_POLICIES)}")
+    return {
+        'short_code': short_code,
+        'original_url': original_url,
+        'created_at': parse_datetime(item.get('created_at'), 'created_at') or now,
+        'updated_at': now,
+        'access_count': access_count,
+        'redirect_policy': redirect_policy,
+        'expires_at': parse_datetime(item.get('expires_at'), 'expires_at'),
+    }
+
+
+def import_lines(shards, short_urls, lines, conflict='skip', batch_size=1000, row_ids=None, on_written=None,
+                 url_validator=None):
+    """Insert exported NDJSON lines in batches; returns a summary of the run
+
+    Every batch is one executemany per shard, committed on its own, so an
+    interrupted import can be resumed by running it again with ``skip``.
+    ``row_ids(count)`` hands out ids when the database cannot assign them
+    (several shards), and ``on_written(rows)`` sees the parameters of
+    every row that was inserted or replaced. Each batch's URLs go through
+    ``url_validator`` (a ``validation.UrlValidator``) before it is written.
+
+    Raises ValueError for a malformed line or invalid URL and IntegrityError
+    for an existing short code under ``fail``; earlier batches stay committed.
+    """
+    if conflict not in CONFLICT_MODES:
+        raise ValueError(f"conflict must be one of {', '.join(CONFLICT_MODES)}")
+    if url_validator is None:
+        url_validator = UrlValidator()
+
+    statement = insert(short_urls)
+    if conflict == 'skip':
+        statement = statement.on_conflict_do_nothing(index_elements=['short_code'])
+    elif conflict == 'replace':
+        statement = statement.on_conflict_do_update(
+            index_elements=['short_code'],
+            set_={name: statement.excluded[name] for name in REPLACED_COLUMNS})
+    statement = statement.returning(short_urls.c.short_code)
+
+    start = time.perf_counter()
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    rows = written = 0
+    batch = []
+    numbers = []
+
+    def write(batch, numbers):
+        verdicts = url_validator.validate_many([params['original_url'] for params in batch])
+        for number, (is_valid, error_message) in zip(numbers, verdicts):
+            if not is_valid:
+                raise ValueError(f'Line {number}: {error_message}')
+        if row_ids is not None:
+            for params, row_id in zip(batch, row_ids(len(batch))):
+                params['id'] = row_id
+        count = 0
+        for shard, group in shards.group(batch, key=lambda params: params['short_code']).items():
+            with shards.begin(shard) as conn:
+                stored = set(conn.execute(statement, group).scalars())
+            count += len(stored)
+            if on_written is not None and stored:
+                on_written([params for params in group if params['short_code'] in stored])
+        return count
+
+    try:
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                batch.append(parse_line(line, now))
+            except ValueError as exc:
+                raise ValueError(f'Line {number}: {exc}') from None
+            numbers.append(number)
+            if len(batch) >= batch_size:
+                written += write(batch, numbers)
+                rows += len(batch)
+                batch, numbers = [], []
+        if batch:
+            written += write(batch, numbers)
+            rows += len(batch)
+    finally:
+        elapsed = time.perf_counter() - start
+        logger.info('Imported %d of %d short URLs in %.2fs (%.0f rows/s)',
+                    written, rows, elapsed, rows / elapsed if elapsed else 0)
+
+    return {
+        'rows': rows,
+        'written': written,
+        'skipped': rows - written,
+        'seconds': round(elapsed, 3),
+        'rowsPerSecond': round(rows / elapsed) if elapsed else None,
+    }
+
+
+def gunzip_lines(chunks):
+    """Split a stream of gzip-compressed byte chunks into lines of bytes"""
+    decompressor = zlib.decompressobj(31)
+    tail = b''
+    for chunk in chunks:
+        data = tail + decompressor.decompress(chunk)
+        lines = data.split(b'\n')
+        tail = lines.pop()
+        yield from lines
+    tail += decompressor.flush()
+    if tail:
+        yield tail
@@ -0,0 +1,102 @@
+"""URL validation with a precompiled fast path and a memo cache
+
+``validators.url`` runs several regexes, an IDNA round-trip and query
+parsing for every call. Most submitted links are plain ``http(s)`` URLs
+with an ASCII domain, so those are accepted by a single precompiled
+pattern that only matches a strict subset of what ``validators.url``
+accepts; everything else (IP hosts, credentials, unicode, unusual
+queries, other schemes, ...) falls through to the full validator.
+"""
+import re
+
+from cache import LRUCache
+
+# Domain labels and TLD as required by validators.domain; no underscores,
+# no trailing dot, and only ASCII so the IDNA encoding is the identity
+_LABEL = r'[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?'
+_HOST = rf'(?P<host>(?:{_LABEL}\.)+[a-z0-9][a-z0-9-]{{0,61}}[a-z])'
+# Ports 1-9999, a subset of the ports validators accepts
+_PORT = r'(?::[1-9][0-9]{0,3})?'
+_PATH = r"(?:/[a-z0-9/\-._~!$&'()*+,;=:@%]*)?"
+# key=value pairs joined by '&', which parse_qs accepts in strict mode
+# with either separator
+_PAIR = r'[a-z0-9\-._~%]+=[a-z0-9\-._~%]*'
+_QUERY = rf'(?:\?{_PAIR}(?:&{_PAIR})*)?'
+_FRAGMENT = r"(?:#[a-z0-9?/:@\-._~%!$&'()*+,;=]*)?"
+
+FAST_URL = re.compile(rf'https?://{_HOST}{_PORT}{_PATH}{_QUERY}{_FRAGMENT}', re.IGNORECASE)
+
+MAX_HOST_LENGTH = 253
+
+REQUIRED = 'URL is required'
+INVALID = 'Invalid URL format'
+
+
+def fast_match(url):
+    """True if url is certainly valid without running the full validator"""
+    match = FAST_URL.fullmatch(url)
+    return match is not None and len(match.group('host')) <= MAX_HOST_LENGTH
+
+
+class UrlValidator:
+    """Validate URLs with the fast path first and memoize the verdicts"""
+
+    def __init__(self, cache_size=100000):
+        self.cache = LRUCache(maxsize=cache_size)
+        self.fast_accepts = 0
+        self.full_checks = 0
+
+    def is_valid(self, url):
+        verdict = self.cache.get(url)
+        if verdict is not None:
+            return verdict
+
+        if fast_match(url):
+            self.fast_accepts += 1
+            verdict = True
+        else:
+            self.full_checks += 1
+            # Imported on first use; most workers only ever take the fast path
+            import validators
+            verdict = bool(validators.url(url))
+        self.cache.set(url, verdict)
+        return verdict
+
+    def validate(self, url):
+        """Return (is_valid, error_message) like validate_url always has"""
+        if not url:
+            return False, REQUIRED
+        if not isinstance(url, str) or not self.is_valid(url):
+            return False, INVALID
+        return True, ''
+
+    def validate_many(self, urls):
+        """Validate a sequence of submitted values, one (is_valid, error) per item
+
+        Repeated URLs within the batch are checked once.
+        """
+        verdicts = {}
+        results = []
+        for url in urls:
+            # Same order of checks as validate()
+            if not url:
+                results.append((False, REQUIRED))
+                continue
+            if not isinstance(url, str):
+                results.append((False, INVALID))
+                continue
+
+            verdict = verdicts.get(url)
+            if verdict is None:
+                verdict = verdicts[url] = self.is_valid(url)
+            results.append((True, '') if verdict else (False, INVALID))
+        return results
+
+    def stats(self):
+        stats = self.cache.stats()
+        return {
+            'fastAccepts': self.fast_accepts,
+            'fullChecks': self.full_checks,
+            'cacheHits': stats['hits'],
+            'cacheSize': stats['size'],
+        }